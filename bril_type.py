@@ -8,7 +8,7 @@ https://capra.cs.cornell.edu/bril/lang/syntax.html
 from typing import TypedDict, Union
 
 Type = Union[None, str, dict[str, "Type"]]
-Literal = Union[bool, int]
+Literal = Union[bool, int, float]
 
 
 class Instruction(TypedDict, total=False):
@@ -344,6 +344,10 @@ type State = {
   // L12 Dynamic Compiler
   isTracing: boolean;
   trace: Array<Array<object>>;
+
+  // For profile-guided layout: how often each CFG edge was taken, keyed by function, then by
+  // the label control came from ("" for the top of the function), then by the label it went to.
+  edges: Record<string, Record<string, Record<string, number>>>;
 };
 
 /**
@@ -394,6 +398,7 @@ function evalCall(instr: bril.Operation, state: State): Action {
     // L12 Dynamic Compiler
     isTracing: state.isTracing,
     trace: state.trace,
+    edges: state.edges,
   };
   const retVal = evalFunc(func, newState);
 
@@ -955,6 +960,11 @@ function evalFunc(func: bril.Function, state: State): Value | null {
         }
       }
     } else if ("label" in line) {
+      // Count the edge taken into this block.
+      const funcEdges = (state.edges[func.name] ??= {});
+      const fromEdges = (funcEdges[state.curlabel ?? ""] ??= {});
+      fromEdges[line.label] = (fromEdges[line.label] ?? 0) + 1;
+
       // Update CFG tracking for SSA phi nodes.
       state.lastlabel = state.curlabel;
       state.curlabel = line.label;
@@ -1050,6 +1060,14 @@ function evalProg(prog: bril.Program) {
     args.splice(pidx, 1);
   }
 
+  // `-e` prints the edge profile instead of the trace.
+  let edgeProfiling = false;
+  const eidx = args.indexOf("-e");
+  if (eidx > -1) {
+    edgeProfiling = true;
+    args.splice(eidx, 1);
+  }
+
   // Remaining arguments are for the main function.k
   const expected = main.args || [];
   const newEnv = parseMainArguments(expected, args);
@@ -1066,10 +1084,15 @@ function evalProg(prog: bril.Program) {
     // L12 Dynamic Compiler
     isTracing: true,
     trace: [],
+    edges: {},
   };
   evalFunc(main, state);
 
-  console.log(JSON.stringify(state.trace, null, 2));
+  if (edgeProfiling) {
+    console.log(JSON.stringify(state.edges, null, 2));
+  } else {
+    console.log(JSON.stringify(state.trace, null, 2));
+  }
   
   if (!heap.isEmpty()) {
     throw error(
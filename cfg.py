@@ -1,18 +1,34 @@
-from typing import Dict, List
+from typing import Callable, Dict, Iterable, List, Set, TypeVar
 import json
 
 from bril_type import *
 from node import RootNode, Node, visualize as visualize_node
 from block import Block, visualize as visualize_block
-from utils import load
+from utils import fresh_name, load
+
+T = TypeVar("T")
+
+EdgeProfile = Dict[str, Dict[str, int]]
 
 
 def to_cfg(instrs: List[Instruction], f_id: int) -> List[Block]:
     blocks: List[Block] = []
     block_instrs: List[Instruction] = []
 
-    # Group by basic blocks
+    # Group by basic blocks, a label starts a new block and a terminator ends one
     for instr in instrs:
+        if "label" in instr and block_instrs:
+            blocks.append(
+                Block(
+                    id=f"f{f_id}-{len(blocks)}",
+                    label="",
+                    predecessors=set(),
+                    successors=set(),
+                    instrs=block_instrs,
+                )
+            )
+            block_instrs = []
+
         block_instrs.append(instr)
         if instr.get("op") in {"jmp", "br", "ret"}:
             blocks.append(
@@ -46,17 +62,9 @@ def to_cfg(instrs: List[Instruction], f_id: int) -> List[Block]:
         else:
             block.label = block.id
 
-    # Add remaining labels
-    for block in blocks:
-        for instr in block.instrs:
-            if "label" in instr:
-                label_str = instr["label"]
-                if label_str not in label_to_block:
-                    label_to_block[label_str] = block
-
     # Add edges
     for i in range(len(blocks) - 1):
-        if blocks[i].instrs[-1].get("op") in {"jmp", "br"}:
+        if blocks[i].instrs[-1].get("op") in {"jmp", "br", "ret"}:
             continue
         blocks[i].successors.add(blocks[i + 1])
         blocks[i + 1].predecessors.add(blocks[i])
@@ -119,7 +127,7 @@ def to_cfg_fine_grain(bril: Program) -> List[RootNode]:
 
         # Add edges between nodes
         for i in range(len(nodes) - 1):
-            if nodes[i].instr.get("op") in {"jmp", "br"}:
+            if nodes[i].instr.get("op") in {"jmp", "br", "ret"}:
                 continue
             nodes[i].successors.add(nodes[i + 1])
             nodes[i + 1].predecessors.add(nodes[i])
@@ -148,11 +156,157 @@ def to_cfg_fine_grain(bril: Program) -> List[RootNode]:
     return cfg_root_nodes
 
 
+def reachable_blocks(entry_block: Block) -> Set[Block]:
+    """Return the blocks reachable from entry_block."""
+    reachable: Set[Block] = {entry_block}
+    stack = [entry_block]
+    while stack:
+        for succ in stack.pop().successors:
+            if succ not in reachable:
+                reachable.add(succ)
+                stack.append(succ)
+    return reachable
+
+
+def strongly_connected_components(
+    entry: T, successors: Callable[[T], Iterable[T]]
+) -> List[List[T]]:
+    """
+    Decompose the graph reachable from entry into strongly connected components using
+    Tarjan's algorithm (iteratively, so deep CFGs do not hit the recursion limit).
+
+    Components are returned in topological order: every edge between two components goes from
+    an earlier component to a later one. Members of a component are listed in DFS discovery
+    order, so a loop header comes before its body. Works for both nodes and blocks.
+    """
+    index: Dict[T, int] = {}  # DFS discovery order
+    lowlink: Dict[T, int] = {}  # smallest index reachable through the DFS subtree
+    on_stack: Set[T] = set()
+    scc_stack: List[T] = []
+    sccs: List[List[T]] = []
+
+    index[entry] = lowlink[entry] = 0
+    scc_stack.append(entry)
+    on_stack.add(entry)
+    dfs_stack = [(entry, iter(successors(entry)))]
+
+    while dfs_stack:
+        node, succs = dfs_stack[-1]
+        for succ in succs:
+            if succ not in index:
+                index[succ] = lowlink[succ] = len(index)
+                scc_stack.append(succ)
+                on_stack.add(succ)
+                dfs_stack.append((succ, iter(successors(succ))))
+                break
+            elif succ in on_stack:
+                lowlink[node] = min(lowlink[node], index[succ])
+        else:
+            dfs_stack.pop()
+            if dfs_stack:
+                parent = dfs_stack[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+            # node is the root of a component, pop it off the stack
+            if lowlink[node] == index[node]:
+                scc: List[T] = []
+                while True:
+                    member = scc_stack.pop()
+                    on_stack.remove(member)
+                    scc.append(member)
+                    if member == node:
+                        break
+                scc.reverse()
+                sccs.append(scc)
+
+    # Tarjan's algorithm finds components in reverse topological order
+    sccs.reverse()
+    return sccs
+
+
 def get_entry_nodes(nodes: List[Node]) -> List[Node]:
     """Return the entry nodes (one for each function) of a CFG."""
     return [node for node in nodes if len(node.predecessors) == 0]
 
 
+def reverse_postorder(entry: T, successors: Callable[[T], Iterable[T]]) -> List[T]:
+    """
+    Return the nodes reachable from entry in reverse postorder (iterative DFS).
+    """
+    postorder: List[T] = []
+    seen: Set[T] = {entry}
+    stack = [(entry, iter(successors(entry)))]
+    while stack:
+        node, succs = stack[-1]
+        for succ in succs:
+            if succ not in seen:
+                seen.add(succ)
+                stack.append((succ, iter(successors(succ))))
+                break
+        else:
+            stack.pop()
+            postorder.append(node)
+
+    postorder.reverse()
+    return postorder
+
+
+def insert_before_terminator(block: Block, instr: Instruction) -> None:
+    if block.instrs and block.instrs[-1].get("op") in {"jmp", "br", "ret"}:
+        block.instrs.insert(len(block.instrs) - 1, instr)
+    else:
+        block.instrs.append(instr)
+
+
+def count_jumps(blocks: List[Block]) -> int:
+    return sum(
+        1
+        for block in blocks
+        for instr in block.instrs
+        if instr.get("op") in {"jmp", "br"}
+    )
+
+
+def make_jumps_explicit(blocks: List[Block]) -> None:
+    """Label every block and end every block that falls through with a jmp."""
+    taken = {block.label for block in blocks if "label" in block.instrs[0]}
+    for block in blocks:
+        if "label" not in block.instrs[0]:
+            block.label = fresh_name(block.id.replace("-", "."), taken)
+            block.instrs.insert(0, {"label": block.label})
+
+    for block, next_block in zip(blocks, blocks[1:]):
+        if block.instrs[-1].get("op") not in {"jmp", "br", "ret"}:
+            if next_block in block.successors:
+                block.instrs.append({"op": "jmp", "labels": [next_block.label]})
+
+
+def fall_through(blocks: List[Block]) -> List[Block]:
+    """
+    Drop jumps to the block laid out next and the labels nobody refers to. Returns the blocks
+    that are left with instructions.
+    """
+    for block, next_block in zip(blocks, blocks[1:]):
+        if not block.instrs:
+            continue
+        terminator = block.instrs[-1]
+        if terminator.get("op") == "jmp" and terminator["labels"] == [next_block.label]:
+            block.instrs.pop()
+    referenced = {
+        label
+        for block in blocks
+        for instr in block.instrs
+        for label in instr.get("labels", [])
+    }
+    for block in blocks:
+        block.instrs = [
+            instr
+            for instr in block.instrs
+            if "label" not in instr or instr["label"] in referenced
+        ]
+    return [block for block in blocks if block.instrs]
+
+
 if __name__ == "__main__":
     program, cli_flags = load(["-f"])
 
@@ -0,0 +1,218 @@
+"""
+Dead code elimination on SSA form by marking and sweeping.
+
+Instructions with effects are live, and so is the single definition of every argument of a live
+instruction. Everything else is removed in one pass, without iterating to a fixpoint. In
+aggressive mode branches are not assumed live either: a branch is only kept if a live
+instruction is control dependent on it, other branches jump straight to their nearest live
+post-dominator, which removes dead ifs and loops. The sweep needs SSA form: functions that are
+not in it are converted into pruned SSA form and back.
+
+    bril2json < prog.bril | python3 ssa.py -to | python3 dce.py -aggressive | python3 ssa.py -from
+"""
+import json
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+from block import Block, blocks_to_instrs
+from bril_type import *
+from cfg import reachable_blocks, to_cfg
+from defuse import DefUseIndex
+from dominator import control_dependence_block, get_immediate_post_dominators_block
+from ssa import from_ssa, to_ssa, validate_ssa, var_types
+from utils import load
+
+# operations that are live even if their result is never used
+EFFECT_OPS = {
+    "print",
+    "store",
+    "free",
+    "alloc",
+    "call",
+    "ret",
+    "jmp",
+    "br",
+    "speculate",
+    "commit",
+    "guard",
+}
+
+
+def dce(blocks: List[Block], aggressive: bool = False) -> Tuple[List[Block], int]:
+    """
+    Perform dead code elimination on the blocks of a function in SSA form (blocks[0] is the
+    entry block).
+
+    Returns a tuple of the remaining blocks and the number of instructions eliminated.
+    """
+    # use-def chains: in SSA form every variable has exactly one definition
+    index = DefUseIndex.from_blocks(blocks)
+
+    label_to_block = {block.label: block for block in blocks}
+
+    if aggressive:
+        control_deps = control_dependence_block(blocks[0])
+        ipdom = get_immediate_post_dominators_block(blocks[0])
+
+    marked: Set[int] = set()  # ids of live instructions
+    live_blocks: Set[Block] = set()  # blocks with a live instruction (aggressive mode)
+    worklist: List[Instruction] = []
+    block_worklist: List[Block] = []
+
+    def _mark(block: Block, instr: Instruction) -> None:
+        if id(instr) not in marked:
+            marked.add(id(instr))
+            worklist.append(instr)
+            block_worklist.append(block)
+
+    def _mark_terminator(block: Block) -> None:
+        if block.instrs and block.instrs[-1].get("op") in {"br", "jmp", "ret"}:
+            _mark(block, block.instrs[-1])
+        else:
+            block_worklist.append(block)  # falls through, only its block is live
+
+    for block in blocks:
+        for instr in block.instrs:
+            op = instr.get("op")
+            if op in EFFECT_OPS and not (aggressive and op in {"br", "jmp"}):
+                _mark(block, instr)
+
+        # branches of blocks that never reach the exit are kept, dead infinite loops stay
+        if aggressive and block not in ipdom:
+            _mark_terminator(block)
+
+    def _propagate() -> None:
+        while worklist or block_worklist:
+            while worklist:
+                instr = worklist.pop()
+                if instr.get("op") == "phi":
+                    # which value a phi takes depends on the edge it is reached through
+                    for label in instr["labels"]:
+                        if aggressive and label in label_to_block:
+                            _mark_terminator(label_to_block[label])
+                for arg in instr.get("args", []):
+                    definition = index.single_definition(arg)
+                    if definition is None:
+                        continue
+                    def_block = index.block_of(definition)
+                    if def_block is not None:
+                        _mark(def_block, definition)
+
+            # a live block needs the branches that decide whether it runs
+            while block_worklist:
+                block = block_worklist.pop()
+                if aggressive and block not in live_blocks:
+                    live_blocks.add(block)
+                    for dep in control_deps.get(block, set()):
+                        _mark_terminator(dep)
+
+    _propagate()
+
+    # dead branches jump to their nearest live post-dominator, if every path leaves the
+    # function without running a live instruction the branch is kept after all
+    retarget: Dict[Block, Block] = {}
+    if aggressive:
+        while True:
+            for block in blocks:
+                instr = block.instrs[-1] if block.instrs else {}
+                if instr.get("op") != "br" or id(instr) in marked:
+                    continue
+                target: Optional[Block] = ipdom.get(block)
+                while target is not None and target not in live_blocks:
+                    target = ipdom.get(target)
+                if target is None:
+                    _mark(block, instr)
+                else:
+                    retarget[block] = target
+            if not worklist:
+                break
+            retarget.clear()
+            _propagate()
+
+    # sweep
+    eliminated = 0
+    for block in blocks:
+        new_instrs: List[Instruction] = []
+        for instr in block.instrs:
+            if "label" in instr or id(instr) in marked or instr.get("op") == "jmp":
+                # a jmp does not make its block live, but it is kept to not fall through
+                new_instrs.append(instr)
+            elif block in retarget and instr is block.instrs[-1]:
+                target = retarget[block]
+                new_instrs.append({"op": "jmp", "labels": [target.label]})
+                for succ in block.successors:
+                    succ.predecessors.discard(block)
+                block.successors = {target}
+                target.predecessors.add(block)
+            else:
+                eliminated += 1
+        block.instrs = new_instrs
+
+    if not retarget:
+        return blocks, eliminated
+
+    # drop the blocks that became unreachable, and their incoming edges into phis
+    reachable = reachable_blocks(blocks[0])
+    for block in blocks:
+        if block not in reachable:
+            eliminated += sum(1 for instr in block.instrs if "op" in instr)
+            continue
+        block.predecessors = {pred for pred in block.predecessors if pred in reachable}
+        pred_labels = {pred.label for pred in block.predecessors}
+        for instr in block.instrs:
+            if instr.get("op") == "phi":
+                incoming = [
+                    (label, arg)
+                    for label, arg in zip(instr["labels"], instr["args"])
+                    if label in pred_labels
+                ]
+                instr["labels"] = [label for label, _ in incoming]
+                instr["args"] = [arg for _, arg in incoming]
+
+    return [block for block in blocks if block in reachable], eliminated
+
+
+def dce_func(func: Function, fi: int, aggressive: bool = False) -> int:
+    """
+    Perform dead code elimination on a function that is not in SSA form: it is converted into
+    pruned SSA form, swept and converted back. Mutates func.
+
+    Returns the number of instructions eliminated.
+    """
+    blocks = to_cfg(func.get("instrs", []), fi)
+    if not blocks:
+        return 0
+
+    func_args = func.get("args", [])
+    instrs = to_ssa(blocks, var_types(func), "pruned", func_args)
+    blocks, eliminated = dce(to_cfg(instrs, fi), aggressive)
+    func["instrs"] = from_ssa(to_cfg(blocks_to_instrs(blocks), fi), func_args)
+    return eliminated
+
+
+if __name__ == "__main__":
+    program, cli_flags = load(["-aggressive", "-stats"])
+
+    if program is None:
+        sys.exit(1)
+
+    for fi, func in enumerate(program["functions"]):
+        blocks = to_cfg(func.get("instrs", []), fi)
+        if not blocks:
+            continue
+
+        func_name = func.get("name", f"f{fi}")
+        if validate_ssa(blocks, func.get("args", [])):
+            blocks, eliminated = dce(blocks, cli_flags["aggressive"])
+            func["instrs"] = blocks_to_instrs(blocks)
+        elif any(instr.get("op") == "phi" for instr in func.get("instrs", [])):
+            print(f"{func_name}: has phis but is not in SSA form", file=sys.stderr)
+            sys.exit(1)
+        else:
+            # sweeping reassigned variables would drop all but their last definition
+            eliminated = dce_func(func, fi, cli_flags["aggressive"])
+
+        if cli_flags["stats"]:
+            print(f"{func_name}: {eliminated} eliminated", file=sys.stderr)
+
+    print(json.dumps(program, indent=2, sort_keys=True))
@@ -0,0 +1,147 @@
+"""
+A def-use index of a function: which instructions define and use each variable.
+
+Built in one pass over the instructions and kept up to date as a pass adds, replaces or removes
+instructions, so passes do not have to rescan the function to find a variable's definitions or
+whether it is still used.
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+from block import Block
+from bril_type import *
+
+
+class DefUseIndex:
+    # key: var, value: instructions (by id) that define it
+    _defs: Dict[str, Dict[int, Instruction]]
+    # key: var, value: instructions (by id) that use it
+    _uses: Dict[str, Dict[int, Instruction]]
+    # key: var, value: number of uses, an instruction using var twice counts twice
+    _use_counts: Dict[str, int]
+    # key: id of an indexed instruction, value: the block it is in, if known
+    _block_of: Dict[int, Optional[Block]]
+
+    def __init__(self) -> None:
+        self._defs = defaultdict(dict)
+        self._uses = defaultdict(dict)
+        self._use_counts = defaultdict(int)
+        self._block_of = {}
+
+    @classmethod
+    def from_blocks(cls, blocks: Iterable[Block]) -> "DefUseIndex":
+        index = cls()
+        for block in blocks:
+            for instr in block.instrs:
+                index.add(instr, block)
+        return index
+
+    @classmethod
+    def from_instrs(cls, instrs: Iterable[Instruction]) -> "DefUseIndex":
+        index = cls()
+        for instr in instrs:
+            index.add(instr)
+        return index
+
+    def add(self, instr: Instruction, block: Optional[Block] = None) -> None:
+        """Index a new instruction."""
+        self._block_of[id(instr)] = block
+        if "dest" in instr:
+            self._defs[instr["dest"]][id(instr)] = instr
+        self._add_uses(instr)
+
+    def remove(self, instr: Instruction) -> None:
+        """Drop a deleted instruction from the index."""
+        del self._block_of[id(instr)]
+        if "dest" in instr:
+            self._discard(self._defs, instr["dest"], instr)
+        self._remove_uses(instr)
+
+    def replace(self, old: Instruction, new: Instruction) -> None:
+        """Index new in place of old, in the same block."""
+        block = self._block_of[id(old)]
+        self.remove(old)
+        self.add(new, block)
+
+    def set_args(self, instr: Instruction, args: List[str]) -> None:
+        """Change the arguments of an indexed instruction."""
+        self._remove_uses(instr)
+        instr["args"] = args
+        self._add_uses(instr)
+
+    def replace_all_uses(self, var: str, new_var: str) -> int:
+        """
+        Rewrite every use of var into a use of new_var. Returns the number of uses rewritten.
+        """
+        count = self._use_counts.get(var, 0)
+        for instr in self.uses(var):
+            self.set_args(
+                instr, [new_var if arg == var else arg for arg in instr["args"]]
+            )
+        return count
+
+    def definitions(self, var: str) -> List[Instruction]:
+        return list(self._defs[var].values()) if var in self._defs else []
+
+    def single_definition(self, var: str) -> Optional[Instruction]:
+        """Return the definition of var if it has exactly one (always the case in SSA form)."""
+        defs = self._defs.get(var)
+        if defs is None or len(defs) != 1:
+            return None
+        return next(iter(defs.values()))
+
+    def last_definition(self, var: str) -> Optional[Instruction]:
+        """
+        Return the definition of var indexed last, the last one in the function if the index was
+        built from its instructions in order and none of them has been replaced since.
+        """
+        defs = self._defs.get(var)
+        return next(reversed(defs.values())) if defs else None
+
+    def def_blocks(self, var: str) -> Set[Block]:
+        """Return the blocks in which var is assigned."""
+        return {
+            block
+            for block in map(self.block_of, self.definitions(var))
+            if block is not None
+        }
+
+    def uses(self, var: str) -> List[Instruction]:
+        return list(self._uses[var].values()) if var in self._uses else []
+
+    def use_count(self, var: str) -> int:
+        return self._use_counts.get(var, 0)
+
+    def is_used(self, var: str) -> bool:
+        return self._use_counts.get(var, 0) > 0
+
+    def block_of(self, instr: Instruction) -> Optional[Block]:
+        return self._block_of.get(id(instr))
+
+    def defined_vars(self) -> Set[str]:
+        return set(self._defs.keys())
+
+    def used_vars(self) -> Set[str]:
+        return set(self._uses.keys())
+
+    def _add_uses(self, instr: Instruction) -> None:
+        for arg in instr.get("args", []):
+            self._uses[arg][id(instr)] = instr
+            self._use_counts[arg] += 1
+
+    def _remove_uses(self, instr: Instruction) -> None:
+        for arg in instr.get("args", []):
+            self._discard(self._uses, arg, instr)
+            self._use_counts[arg] -= 1
+            if self._use_counts[arg] == 0:
+                del self._use_counts[arg]
+
+    @staticmethod
+    def _discard(
+        table: Dict[str, Dict[int, Instruction]], var: str, instr: Instruction
+    ) -> None:
+        instrs = table.get(var)
+        if instrs is not None:
+            instrs.pop(id(instr), None)
+            if not instrs:
+                del table[var]
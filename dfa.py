@@ -1,19 +1,23 @@
+import json
 import sys
 from abc import ABC, abstractmethod
 from collections import defaultdict, deque
-from typing import Callable, Dict, Iterable, List, Optional, Set
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 
+from block import Block
 from bril_type import *
-from cfg import to_cfg_fine_grain, get_entry_nodes
+from cfg import reachable_blocks, to_cfg_fine_grain
 from dfa_framework import DataFlowAnalysis
 from dot import DotFilmStrip
-from node import Node
+from fold import PURE_OPS, canonicalize, fold, simplify
+from node import Node, RootNode
 from utils import load
 
 
 def reaching_definition(
     cfg_root_nodes: List[Node],
     visualize_mode: bool = False,
+    scc_mode: bool = False,
 ) -> List[DataFlowAnalysis]:
     """Returns a data flow analysis for reaching defintions for each function in the program.
 
@@ -45,6 +49,7 @@ def reaching_definition(
             transfer_function=transfer_function,
             merge_function=merge_function,
             visualize_mode=visualize_mode,
+            scc_mode=scc_mode,
         )
         dfa.run()
         dfas.append(dfa)
@@ -52,97 +57,96 @@ def reaching_definition(
     return dfas
 
 
-def constant_propagation(
-    cfg_root_nodes: List[Node],
-    visualize_mode: bool = False,
-) -> List[DataFlowAnalysis]:
-    """Returns a data flow analysis for constant propagation for each function in the program.
+class ConstantType(ABC):
+    @abstractmethod
+    def merge(self, other: "ConstantType") -> "ConstantType":
+        pass
 
-    Sets contain a mapping from variable names to their constant values.
-    """
-
-    class ConstantType(ABC):
-        @abstractmethod
-        def merge(self, other: "ConstantType") -> "ConstantType":
-            pass
+    @abstractmethod
+    def val(self) -> Optional[Literal]:
+        pass
 
-        @abstractmethod
-        def val(self) -> Optional[int | bool]:
-            pass
 
-    class Constant(ConstantType):
-        def __init__(self, val: int | bool):
-            self._val = val
+class Constant(ConstantType):
+    def __init__(self, val: Literal):
+        self._val = val
 
-        def merge(self, other: "ConstantType") -> "ConstantType":
-            if isinstance(other, Constant):
-                if self.val() == other.val():
-                    return self
-                else:
-                    return Unknown()
+    def merge(self, other: "ConstantType") -> "ConstantType":
+        if isinstance(other, Constant):
+            if self == other:
+                return self
             else:
-                return other.merge(self)
+                return Unknown()
+        else:
+            return other.merge(self)
 
-        def val(self) -> Optional[int | bool]:
-            return self._val
+    def val(self) -> Optional[Literal]:
+        return self._val
 
-        def __str__(self):
-            return str(self._val)
+    def __str__(self):
+        return str(self._val)
 
-        def __repr__(self):
-            return str(self._val)
+    def __repr__(self):
+        return str(self._val)
+
+    def __eq__(self, other):
+        # compare representations, 1 and true or 0.0 and -0.0 are different constants
+        if isinstance(other, Constant):
+            return type(self._val) is type(other._val) and repr(self._val) == repr(
+                other._val
+            )
+        else:
+            return False
 
-        def __eq__(self, other):
-            if isinstance(other, Constant):
-                return self._val == other._val
-            else:
-                return False
 
-    class Unknown(ConstantType):
-        def merge(self, other: "ConstantType") -> "ConstantType":
-            return self
+class Unknown(ConstantType):
+    def merge(self, other: "ConstantType") -> "ConstantType":
+        return self
 
-        def val(self) -> Optional[int | bool]:
-            return None
+    def val(self) -> Optional[Literal]:
+        return None
 
-        def __str__(self):
-            return "Unknown"
+    def __str__(self):
+        return "Unknown"
 
-        def __repr__(self):
-            return "Unknown"
+    def __repr__(self):
+        return "Unknown"
 
-        def __eq__(self, other):
-            return isinstance(other, Unknown)
+    def __eq__(self, other):
+        return isinstance(other, Unknown)
 
-    class Uninitialized(ConstantType):
-        def merge(self, other: "ConstantType") -> "ConstantType":
-            return other
 
-        def val(self) -> Optional[int | bool]:
-            return None
+class Uninitialized(ConstantType):
+    def merge(self, other: "ConstantType") -> "ConstantType":
+        return other
 
-        def __str__(self):
-            return ""
+    def val(self) -> Optional[Literal]:
+        return None
 
-        def __repr__(self):
-            return ""
+    def __str__(self):
+        return ""
 
-        def __eq__(self, other):
-            return isinstance(other, Uninitialized)
+    def __repr__(self):
+        return ""
 
-    op_to_func: Dict[str, Callable] = {
-        "add": lambda x, y: x + y,
-        "mul": lambda x, y: x * y,
-        "sub": lambda x, y: x - y,
-        "div": lambda x, y: x // y,
-        "eq": lambda x, y: x == y,
-        "lt": lambda x, y: x < y,
-        "gt": lambda x, y: x > y,
-        "le": lambda x, y: x <= y,
-        "ge": lambda x, y: x >= y,
-        "and": lambda x, y: x and y,
-        "or": lambda x, y: x or y,
-        "not": lambda x: not x,
+    def __eq__(self, other):
+        return isinstance(other, Uninitialized)
+
+
+def constant_propagation(
+    cfg_root_nodes: List[RootNode],
+    visualize_mode: bool = False,
+    scc_mode: bool = False,
+) -> List[DataFlowAnalysis]:
+    """Returns a data flow analysis for constant propagation for each function in the program.
+
+    Sets contain a mapping from variable names to their constant values. Function arguments
+    and variables assigned anything but a constant expression are Unknown.
+    """
+    # key: id of a function's entry node, value: names of the function's arguments
+    entry_args: Dict[str, List[str]] = {
+        root_node.entry_node.id: [arg["name"] for arg in root_node.func_args]
+        for root_node in cfg_root_nodes
     }
 
     def transfer_function(
@@ -150,41 +154,33 @@ def constant_propagation(
     ) -> Dict[str, ConstantType]:
         """New variables that are constants in this node, plus previous variables that are constants, minus variables that are no longer constants."""
         op = node.instr.get("op")
-        if op is None:
+        if op is None and node.id not in entry_args:
             return in_set
 
         new_mapping = dict(in_set)
+        for arg in entry_args.get(node.id, []):
+            new_mapping[arg] = Unknown()
+
+        dest = node.instr.get("dest")
+        if dest is None:
+            return new_mapping
+
+        args = node.instr.get("args", [])
+        values = [constant_value(in_set, arg) for arg in args]
+        val: Optional[Literal] = None
 
         # Assignments of new constant - add to mapping
         if op == "const":
-            dest = node.instr.get("dest")
             val = node.instr.get("value")
-            if dest is not None and val is not None:
-                new_mapping[dest] = Constant(val)
-
-        # Operations with constants - add to mapping
-        elif op in op_to_func.keys():
-            dest = node.instr.get("dest")
-            args = node.instr.get("args")
-            if dest is not None and args is not None:
-                if len(args) == 2:
-                    arg0 = args[0]
-                    arg1 = args[1]
-                    if arg0 in in_set and arg1 in in_set:
-                        new_mapping[dest] = Constant(
-                            op_to_func[op](in_set[arg0], in_set[arg1])
-                        )
-                elif len(args) == 1:
-                    arg0 = args[0]
-                    if arg0 in in_set:
-                        new_mapping[dest] = Constant(op_to_func[op](in_set[arg0]))
-
-        # Override existing constant - set to unknown
-        elif "dest" in node.instr:
-            dest = node.instr.get("dest")
-            if dest in in_set:
-                new_mapping[dest] = Unknown()
 
+        # Copies and operations with constants - add to mapping
+        elif op == "id":
+            val = values[0]
+        elif op in PURE_OPS and all(v is not None for v in values):
+            val = fold(op, values)  # type: ignore
+
+        # Any other assignment - set to unknown
+        new_mapping[dest] = Unknown() if val is None else Constant(val)
         return new_mapping
 
     def merge_function(
@@ -205,12 +201,13 @@ def constant_propagation(
     dfas = []
     for root_node in cfg_root_nodes:
         dfa = DataFlowAnalysis(
-            entry_node=root_node,
+            entry_node=root_node.entry_node,
             in_sets=init_in_set,
             out_sets=init_out_set,
             transfer_function=transfer_function,
             merge_function=merge_function,
             visualize_mode=visualize_mode,
+            scc_mode=scc_mode,
         )
         dfa.run()
         dfas.append(dfa)
@@ -218,47 +215,253 @@ def constant_propagation(
     return dfas
 
 
+def constant_value(facts: Dict[str, ConstantType], var: str) -> Optional[Literal]:
+    """The value of var if it is a known constant in facts, otherwise None."""
+    fact = facts.get(var)
+    return fact.val() if fact is not None else None
+
+
+def apply_constant_propagation(func: Function, dfa: DataFlowAnalysis) -> int:
+    """Mutates func to apply the results of its constant propagation analysis.
+
+    Instructions whose result is a known constant become consts, algebraic identities with a
+    constant argument (x * 1, x + 0, ...) become copies, branches on a constant condition
+    become jumps, and jumps to the label right after them are dropped. Bril arguments are
+    always variables, so the uses of a constant are replaced by folding the instructions that
+    use it. Returns the number of instructions rewritten or removed.
+    """
+    rewritten = 0
+    # key: id of an instruction of func, value: the instruction replacing it
+    replacements: Dict[int, Instruction] = {}
+
+    # only nodes reachable from the entry have facts
+    q: deque[Node] = deque([dfa.entry_node])
+    seen: Set[str] = {dfa.entry_node.id}
+    while q:
+        node = q.popleft()
+        for succ in node.successors:
+            if succ.id not in seen:
+                seen.add(succ.id)
+                q.append(succ)
+
+        instr = node.instr
+        op = instr.get("op")
+        if op is None or op == "const":
+            continue
+
+        in_set = dfa.in_sets[node.id]
+        new_instr: Optional[Instruction] = None
+        if op == "br":
+            cond = constant_value(in_set, instr["args"][0])
+            if cond is not None:
+                label = instr["labels"][0] if cond else instr["labels"][1]
+                new_instr = {"op": "jmp", "labels": [label]}
+
+        elif "dest" in instr:
+            val = constant_value(dfa.out_sets[node.id], instr["dest"])
+            if val is not None:
+                new_instr = {
+                    "dest": instr["dest"],
+                    "op": "const",
+                    "type": instr["type"],
+                    "value": val,
+                }
+            elif op in PURE_OPS:
+                simplified = simplify(
+                    op,
+                    instr["args"],
+                    [constant_value(in_set, arg) for arg in instr["args"]],
+                )
+                if simplified is not None:
+                    kind, result = simplified
+                    new_instr = {"dest": instr["dest"], "type": instr["type"]}
+                    if kind == "arg":
+                        new_instr.update({"op": "id", "args": [instr["args"][result]]})  # type: ignore
+                    else:
+                        new_instr.update({"op": "const", "value": result})
+
+        if new_instr is not None:
+            # the node shares the instruction with func
+            replacements[id(instr)] = new_instr
+            rewritten += 1
+
+    instrs = [replacements.get(id(instr), instr) for instr in func.get("instrs", [])]
+    new_instrs: List[Instruction] = []
+    for ii, instr in enumerate(instrs):
+        if instr.get("op") == "jmp":
+            # the labels up to the next instruction
+            following = set()
+            for next_instr in instrs[ii + 1 :]:
+                if "label" not in next_instr:
+                    break
+                following.add(next_instr["label"])
+            if instr["labels"][0] in following:
+                rewritten += 1
+                continue
+        new_instrs.append(instr)
+    func["instrs"] = new_instrs
+
+    return rewritten
+
+
+def live_variables_block(
+    blocks: List[Block],
+) -> Tuple[Dict[Block, Set[str]], Dict[Block, Set[str]]]:
+    """Returns the variables live into and out of each block of a basic block CFG.
+
+    A backward analysis solved with a worklist of blocks. The arguments of a phi are live out
+    of the predecessor named by the matching label, rather than live into the phi's block.
+    """
+    label_to_block = {block.label: block for block in blocks}
+
+    # gen and kill depend on whether a use comes before a definition in the block, which
+    # DefUseIndex does not record, so the blocks are scanned
+    uses: Dict[
+        Block, Set[str]
+    ] = {}  # variables used before any definition in the block
+    defs: Dict[Block, Set[str]] = {}  # variables defined in the block
+    phi_uses: Dict[Block, Set[str]] = defaultdict(set)  # read by phis in a successor
+    for block in blocks:
+        uses[block], defs[block] = set(), set()
+        for instr in block.instrs:
+            if instr.get("op") == "phi":
+                for arg, label in zip(instr.get("args", []), instr.get("labels", [])):
+                    if label in label_to_block:
+                        phi_uses[label_to_block[label]].add(arg)
+            else:
+                uses[block].update(
+                    arg for arg in instr.get("args", []) if arg not in defs[block]
+                )
+            if "dest" in instr:
+                defs[block].add(instr["dest"])
+
+    live_in: Dict[Block, Set[str]] = {block: set() for block in blocks}
+    live_out: Dict[Block, Set[str]] = {block: set() for block in blocks}
+
+    worklist = deque(reversed(blocks))
+    queued = set(blocks)
+    while worklist:
+        block = worklist.popleft()
+        queued.remove(block)
+
+        out_set = set(phi_uses[block])
+        for succ in block.successors:
+            out_set |= live_in[succ]
+        live_out[block] = out_set
+
+        in_set = uses[block] | (out_set - defs[block])
+        if in_set != live_in[block]:
+            live_in[block] = in_set
+            for pred in block.predecessors:
+                if pred not in queued:
+                    queued.add(pred)
+                    worklist.append(pred)
+
+    return live_in, live_out
+
+
+def expression_key(instr: Instruction) -> Optional[tuple]:
+    """The canonical (op, args) tuple of a pure computation, e.g. ("add", ("a", "b")), the same
+    shape LVN numbers values by, but over variable names. None for any other instruction.
+    """
+    if instr.get("op") not in PURE_OPS or "dest" not in instr:
+        return None
+    return canonicalize(instr["op"], tuple(instr.get("args", [])))
+
+
+def available_expressions_block(
+    blocks: List[Block],
+) -> Tuple[List[tuple], Dict[str, int], Dict[Block, int], Dict[Block, int]]:
+    """Returns the expressions of a basic block CFG, the ones each variable kills (the ones
+    reading it) and the ones available into and out of each block, as bit vectors (bit i is
+    set if expressions[i] is in the set).
+
+    An expression is available at a point if it is computed on every path from the entry to the
+    point, and none of its arguments is redefined after that. A forward analysis, intersecting
+    over predecessors, solved with a worklist of blocks. Blocks unreachable from the entry have
+    nothing available.
+    """
+    expressions: List[tuple] = []
+    index: Dict[tuple, int] = {}  # key: expression, value: its bit
+    uses_var: Dict[str, int] = defaultdict(
+        int
+    )  # key: var, value: expressions reading it
+    for block in blocks:
+        for instr in block.instrs:
+            key = expression_key(instr)
+            if key is not None and key not in index:
+                index[key] = len(expressions)
+                expressions.append(key)
+                for arg in key[1]:
+                    uses_var[arg] |= 1 << index[key]
+    universe = (1 << len(expressions)) - 1
+
+    gen: Dict[Block, int] = {}  # computed in the block and not killed after
+    kill: Dict[Block, int] = {}  # an argument is redefined in the block
+    for block in blocks:
+        gen[block], kill[block] = 0, 0
+        for instr in block.instrs:
+            key = expression_key(instr)
+            if key is not None:
+                gen[block] |= 1 << index[key]
+            if "dest" in instr:
+                gen[block] &= ~uses_var[instr["dest"]]
+                kill[block] |= uses_var[instr["dest"]]
+
+    reachable = reachable_blocks(blocks[0])
+
+    avail_in: Dict[Block, int] = {block: 0 for block in blocks}
+    avail_out: Dict[Block, int] = {
+        block: universe if block in reachable else 0 for block in blocks
+    }
+
+    worklist = deque(block for block in blocks if block in reachable)
+    queued = set(worklist)
+    while worklist:
+        block = worklist.popleft()
+        queued.remove(block)
+
+        # nothing is available on entry to the function, even if the entry is a loop header
+        in_set = 0 if block is blocks[0] else universe
+        for pred in block.predecessors:
+            if pred in reachable:
+                in_set &= avail_out[pred]
+        avail_in[block] = in_set
+
+        out_set = gen[block] | (in_set & ~kill[block])
+        if out_set != avail_out[block]:
+            avail_out[block] = out_set
+            for succ in block.successors:
+                if succ not in queued:
+                    queued.add(succ)
+                    worklist.append(succ)
+
+    return expressions, dict(uses_var), avail_in, avail_out
+
+
 if __name__ == "__main__":
-    program, _ = load()
+    program, cli_flags = load(["-viz", "-scc"])
 
     if program is None:
         sys.exit(1)
 
     cfg_root_nodes = to_cfg_fine_grain(program)
-
-    # accumulate all nodes in the program
-    cfg_nodes = []
-    for root_node in cfg_root_nodes:
-        q = deque([root_node.entry_node])
-        seen: Set[Node] = set()
-
-        while q:
-            node = q.popleft()
-            seen.add(node)
-            q.extend([succ for succ in node.successors if succ not in seen])
-
-        cfg_nodes.extend(list(seen))
-
-    ####################################################################################
-    ## Run reaching definitions DFA on Catalan example and generate DFA animation
-    # name = "catalan-reaching-definitons"
-    # rd_dfas = reaching_definition(get_entry_nodes(cfgs), visualize_mode=True)
-
-    # rd_ex = rd_dfas[1]
-    # dfs = DotFilmStrip(name)
-    # dfs.dot_frames = rd_ex.dot_graphs
-    # dfs.render(f"./lesson_tasks/l4/dfa-animations/{name}")
-    ####################################################################################
-
-    ####################################################################################
-    ## Run constant prop DFA on Catalan example and generate DFA animation
-    name = "catalan-constant-prop"
-    cp_dfas = constant_propagation(get_entry_nodes(cfg_nodes), visualize_mode=True)
-
-    cp_ex = cp_dfas[1]
-    dfs = DotFilmStrip(name)
-    dfs.extend_frames(cp_ex.dot_graphs)
-    dfs.render(f"./lesson_tasks/l4/dfa-animations/{name}")
-    ####################################################################################
-
-    # json.dump(program, sys.stdout, indent=2)
+    cp_dfas = constant_propagation(
+        cfg_root_nodes, visualize_mode=cli_flags["viz"], scc_mode=cli_flags["scc"]
+    )
+
+    if cli_flags["viz"]:
+        # Generate a constant propagation DFA animation for each function
+        for root_node, dfa in zip(cfg_root_nodes, cp_dfas):
+            name = f"{root_node.func_name}-constant-prop"
+            dfs = DotFilmStrip(name)
+            dfs.extend_frames(dfa.dot_graphs)
+            dfs.render(f"./lesson_tasks/l4/dfa-animations/{name}")
+        sys.exit(0)
+
+    # Apply the constant propagation results and emit the optimized program
+    funcs = {func.get("name"): func for func in program["functions"]}
+    for root_node, dfa in zip(cfg_root_nodes, cp_dfas):
+        apply_constant_propagation(funcs[root_node.func_name], dfa)
+
+    json.dump(program, sys.stdout, indent=2)
@@ -1,7 +1,9 @@
+import sys
 from collections import deque
 from dataclasses import dataclass
 from typing import Callable, Dict, Generic, Iterable, Set, TypeVar, List
 
+from cfg import strongly_connected_components
 from node import Node
 
 import graphviz  # type: ignore
@@ -19,6 +21,9 @@ class DataFlowAnalysis(Generic[T]):
     visualize_mode: bool  # If true, track vizualized dot graph of each iter
     dot_graphs: List[str] = []  # List of dot graphs for each iter
 
+    # If true, solve one strongly connected component of the CFG at a time
+    scc_mode: bool
+
     def __init__(
         self: "DataFlowAnalysis",
         entry_node: Node,
@@ -27,6 +32,7 @@ class DataFlowAnalysis(Generic[T]):
         transfer_function: Callable[[Node, T], T],
         merge_function: Callable[[List[T]], T],
         visualize_mode: bool = False,
+        scc_mode: bool = False,
     ) -> None:
         self.entry_node = entry_node
         self.in_sets = in_sets
@@ -34,8 +40,14 @@ class DataFlowAnalysis(Generic[T]):
         self.transfer_function = transfer_function
         self.merge_function = merge_function
         self.visualize_mode = visualize_mode
+        self.dot_graphs = []
+        self.scc_mode = scc_mode
 
     def run(self: "DataFlowAnalysis") -> None:
+        if self.scc_mode:
+            self.run_by_scc()
+            return
+
         # Init worklist with all nodes in CFG
         seen: Set[str] = set()
         q: deque[Node] = deque([self.entry_node])
@@ -58,7 +70,7 @@ class DataFlowAnalysis(Generic[T]):
             new_in_set: T = self.merge_function(
                 [self.out_sets[pred.id] for pred in node.predecessors]
             )
-            new_out_set: T = self.transfer_function(node, in_set)
+            new_out_set: T = self.transfer_function(node, new_in_set)
 
             if new_in_set != in_set or new_out_set != out_set:
                 self.in_sets[node.id] = new_in_set
@@ -69,7 +81,46 @@ class DataFlowAnalysis(Generic[T]):
             if self.visualize_mode:
                 self.dot_graphs.append(self.visualize())
 
-        print(f"Ran {iters} iterations")
+        print(f"Ran {iters} iterations", file=sys.stderr)
+
+    def run_by_scc(self: "DataFlowAnalysis") -> None:
+        """Solve the analysis one strongly connected component at a time.
+
+        Components are visited in topological order, so the facts flowing into a component are
+        final before it is solved and only nodes inside a loop are ever revisited."""
+        sccs = strongly_connected_components(
+            self.entry_node, lambda node: sorted(node.successors)
+        )
+
+        iters = 0
+        for scc in sccs:
+            scc_ids = {node.id for node in scc}
+            worklist: deque[Node] = deque(scc)
+            queued: Set[str] = set(scc_ids)
+
+            while worklist:
+                node = worklist.popleft()
+                queued.remove(node.id)
+
+                new_in_set: T = self.merge_function(
+                    [self.out_sets[pred.id] for pred in node.predecessors]
+                )
+                new_out_set: T = self.transfer_function(node, new_in_set)
+                self.in_sets[node.id] = new_in_set
+
+                if new_out_set != self.out_sets[node.id]:
+                    self.out_sets[node.id] = new_out_set
+                    # successors outside the component are visited after it converges
+                    for succ in node.successors:
+                        if succ.id in scc_ids and succ.id not in queued:
+                            queued.add(succ.id)
+                            worklist.append(succ)
+
+                iters += 1
+                if self.visualize_mode:
+                    self.dot_graphs.append(self.visualize())
+
+        print(f"Ran {iters} iterations", file=sys.stderr)
 
     def visualize(self: "DataFlowAnalysis") -> str:
         """Visualize a dataflow analysis on CFG using graphviz.
@@ -2,18 +2,22 @@
 A series of dominance utilities functions including
 - Constructing the dominance tree [-t]
 - Computing the dominance frontier [-f]
+- Constructing the post-dominance tree [-pt]
+- Computing the control dependence graph [-cdg]
 """
 import sys
 from collections import deque
-from typing import Dict, List, Set
+from typing import Callable, Dict, Iterable, List, Optional, Set, TypeVar
 
 from bril_type import *
-from cfg import get_entry_nodes, to_cfg_fine_grain
+from cfg import get_entry_nodes, reverse_postorder, to_cfg, to_cfg_fine_grain
 from node import Node, visualize_from_nodes
 from block import Block, visualize as visualize_block
 from utils import load
 from dot import DotFilmStrip
 
+T = TypeVar("T")
+
 
 def strictly_dominates(node_a: Node, node_b: Node, b_dominators: Set[Node]) -> bool:
     """
@@ -61,8 +65,10 @@ def _get_dominators(entry: Node) -> Dict[Node, Set[Node]]:
 
             old_len = len(dom[node])
 
+            # unreachable predecessors do not constrain dominance
             for p in node.predecessors:
-                dom[node] = dom[node].intersection(dom[p])
+                if p in dom:
+                    dom[node] = dom[node].intersection(dom[p])
             dom[node].add(node)
 
             new_len = len(dom[node])
@@ -100,8 +106,10 @@ def _get_dominators_block(entry: Block) -> Dict[Block, Set[Block]]:
 
             old_len = len(dom[block])
 
+            # unreachable predecessors do not constrain dominance
             for p in block.predecessors:
-                dom[block] = dom[block].intersection(dom[p])
+                if p in dom:
+                    dom[block] = dom[block].intersection(dom[p])
             dom[block].add(block)
 
             new_len = len(dom[block])
@@ -202,7 +210,12 @@ def dominance_frontier(a: Node, entry_node: Node | None = None) -> List[Node]:
         b
         for b in all_nodes
         if not strictly_dominates(a, b, doms[b])
-        and any([a in doms[pre_node_b] for pre_node_b in b.predecessors])
+        and any(
+            [
+                pre_node_b in doms and a in doms[pre_node_b]
+                for pre_node_b in b.predecessors
+            ]
+        )
     ]
 
     return frontier
@@ -233,12 +246,376 @@ def dominance_frontier_block(a: Block, entry_block: Block | None = None) -> List
         b
         for b in all_nodes
         if not strictly_dominates_block(a, b, doms[b])
-        and any([a in doms[pre_node_b] for pre_node_b in b.predecessors])
+        and any(
+            [
+                pre_node_b in doms and a in doms[pre_node_b]
+                for pre_node_b in b.predecessors
+            ]
+        )
     ]
 
     return frontier
 
 
+def _get_idoms(
+    entry: T,
+    successors: Callable[[T], Iterable[T]],
+    predecessors: Callable[[T], Iterable[T]],
+) -> Dict[T, T]:
+    """
+    Return the immediate dominator of every node reachable from entry (the entry maps to itself).
+
+    Uses the iterative algorithm of Cooper, Harvey and Kennedy: idoms are refined over the nodes
+    in reverse postorder until they stop changing, which takes a handful of passes in practice.
+    The graph is given by its successor/predecessor functions so the same machinery works for
+    nodes, blocks and the reversed CFG used for post-dominators.
+    """
+    rpo = reverse_postorder(entry, successors)
+    rpo_index = {node: i for i, node in enumerate(rpo)}
+    idom: Dict[T, T] = {entry: entry}
+
+    def intersect(a: T, b: T) -> T:
+        while a != b:
+            while rpo_index[a] > rpo_index[b]:
+                a = idom[a]
+            while rpo_index[b] > rpo_index[a]:
+                b = idom[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for node in rpo[1:]:
+            # nodes may be None (e.g. a virtual exit), so track whether new_idom is set
+            new_idom: Optional[T] = None
+            found = False
+            for pred in predecessors(node):
+                # skip unreachable and not yet processed predecessors
+                if pred not in idom:
+                    continue
+                new_idom = intersect(pred, new_idom) if found else pred  # type: ignore
+                found = True
+
+            if found and (node not in idom or idom[node] != new_idom):
+                idom[node] = new_idom  # type: ignore
+                changed = True
+
+    return idom
+
+
+def _get_frontiers(
+    idom: Dict[T, T], predecessors: Callable[[T], Iterable[T]]
+) -> Dict[T, Set[T]]:
+    """
+    Return the dominance frontier of every node in idom.
+
+    For each join node, walk up the dominator tree from each predecessor until reaching the
+    join's immediate dominator, adding the join to the frontier of every node on the way.
+    """
+    frontiers: Dict[T, Set[T]] = {node: set() for node in idom}
+    for node in idom:
+        preds = [pred for pred in predecessors(node) if pred in idom]
+        # the root is also entered from outside the graph, so one back edge makes it a join
+        if len(preds) < (1 if idom[node] == node else 2):
+            continue
+        for pred in preds:
+            runner = pred
+            while runner != idom[node]:
+                frontiers[runner].add(node)
+                runner = idom[runner]
+            if idom[node] == node:
+                # a root that is the target of a back edge is in its own frontier
+                frontiers[node].add(node)
+
+    return frontiers
+
+
+def tree_children(idom: Dict[T, T]) -> Dict[T, List[T]]:
+    """
+    Return a mapping of each node to the nodes it immediately dominates.
+    """
+    children: Dict[T, List[T]] = {node: [] for node in idom}
+    for node, parent in idom.items():
+        if node != parent:
+            children[parent].append(node)
+    return children
+
+
+def dominates(a: Block, b: Block, idom: Dict[Block, Block]) -> bool:
+    """Return true if a dominates b, by walking up the dominator tree from b."""
+    while True:
+        if a == b:
+            return True
+        if idom[b] == b:
+            return False
+        b = idom[b]
+
+
+def get_immediate_dominators_block(entry_block: Block) -> Dict[Block, Block]:
+    """
+    Return the immediate dominator of every block reachable from entry_block.
+
+    The entry block maps to itself.
+    """
+    return _get_idoms(
+        entry_block,
+        lambda block: sorted(block.successors),
+        lambda block: block.predecessors,
+    )
+
+
+def dominance_frontiers_block(
+    entry_block: Block, idom: Optional[Dict[Block, Block]] = None
+) -> Dict[Block, Set[Block]]:
+    """
+    Return the dominance frontier of every block reachable from entry_block, computed in a
+    single pass over the dominator tree. Pass idom to reuse already computed idoms.
+    """
+    if idom is None:
+        idom = get_immediate_dominators_block(entry_block)
+    return _get_frontiers(idom, lambda block: block.predecessors)
+
+
+def _func_nodes(entry_node: Node) -> Dict[str, Node]:
+    """
+    Return the fine-grain nodes reachable from entry_node, keyed by node id.
+    """
+    nodes: Dict[str, Node] = {}
+    q = deque([entry_node])
+    while q:
+        node = q.popleft()
+        if node.id not in nodes:
+            nodes[node.id] = node
+            q.extend(node.successors)
+    return nodes
+
+
+def _block_node_ids(blocks: List[Block]) -> Dict[Block, List[str]]:
+    """
+    Return the ids of the fine-grain nodes in each block, in order.
+
+    Blocks partition the function's instructions in order, and fine-grain node ids are
+    f{fi}-{instruction index}, so the ids follow from the block sizes.
+    """
+    node_ids: Dict[Block, List[str]] = {}
+    ii = 0
+    for block in blocks:
+        fi = block.id.split("-")[0]
+        node_ids[block] = [f"{fi}-{ii + i}" for i in range(len(block.instrs))]
+        ii += len(block.instrs)
+    return node_ids
+
+
+def get_immediate_dominators(entry_node: Node, blocks: List[Block]) -> Dict[Node, Node]:
+    """
+    Return the immediate dominator of every fine-grain node reachable from entry_node (the
+    entry node maps to itself), where blocks is the basic block CFG of the same function.
+
+    Dominators are computed on the (much smaller) block CFG. Inside a block dominance is just
+    instruction order: a node is immediately dominated by the previous node in its block, and
+    the first node of a block by the last node of the block's immediate dominator.
+    """
+    nodes = _func_nodes(entry_node)
+    node_ids = _block_node_ids(blocks)
+    block_idom = get_immediate_dominators_block(blocks[0])
+
+    idom: Dict[Node, Node] = {}
+    for block, parent in block_idom.items():
+        ids = node_ids[block]
+        first = nodes[ids[0]]
+        idom[first] = first if block == parent else nodes[node_ids[parent][-1]]
+        for prev_id, node_id in zip(ids, ids[1:]):
+            idom[nodes[node_id]] = nodes[prev_id]
+
+    return idom
+
+
+def dominance_frontiers(
+    entry_node: Node, blocks: List[Block]
+) -> Dict[Node, List[Node]]:
+    """
+    Return the dominance frontier of every fine-grain node reachable from entry_node, where
+    blocks is the basic block CFG of the same function.
+
+    A node dominates the rest of its block and everything its block strictly dominates, and
+    control only enters a block through its first node, so every node in a block has the same
+    frontier: the first nodes of the block's dominance frontier.
+    """
+    nodes = _func_nodes(entry_node)
+    node_ids = _block_node_ids(blocks)
+    block_idom = get_immediate_dominators_block(blocks[0])
+    block_frontiers = _get_frontiers(block_idom, lambda block: block.predecessors)
+
+    frontiers: Dict[Node, List[Node]] = {}
+    for block, block_frontier in block_frontiers.items():
+        frontier = sorted(nodes[node_ids[df_block][0]] for df_block in block_frontier)
+        for node_id in node_ids[block]:
+            frontiers[nodes[node_id]] = frontier
+
+    return frontiers
+
+
+def dominators_from_idoms(idom: Dict[T, T]) -> Dict[T, Set[T]]:
+    """
+    Expand immediate dominators into the full set of dominators of every node.
+    """
+    children = tree_children(idom)
+    stack = [node for node, parent in idom.items() if node == parent]
+    doms: Dict[T, Set[T]] = {root: {root} for root in stack}
+    while stack:
+        node = stack.pop()
+        for child in children[node]:
+            doms[child] = doms[node] | {child}
+            stack.append(child)
+    return doms
+
+
+def dominance_tree_from_idoms(idom: Dict[Node, Node]) -> List[Node]:
+    """
+    Construct the dominance tree given a mapping of nodes to their immediate dominators.
+    """
+    dom_tree_nodes: Dict[str, Node] = {
+        node.id: Node(
+            id=node.id,
+            predecessors=set(),
+            successors=set(),
+            instr=node.instr,
+            label=node.label,
+        )
+        for node in idom
+    }
+
+    for node, parent in idom.items():
+        if node != parent:
+            dom_tree_nodes[parent.id].successors.add(dom_tree_nodes[node.id])
+            dom_tree_nodes[node.id].predecessors.add(dom_tree_nodes[parent.id])
+
+    return list(dom_tree_nodes.values())
+
+
+def _exit_blocks(entry_block: Block) -> List[Block]:
+    """
+    Return the blocks reachable from entry_block that leave the function (ret or fall off the end).
+    """
+    rpo = reverse_postorder(entry_block, lambda block: sorted(block.successors))
+    return sorted(block for block in rpo if len(block.successors) == 0)
+
+
+def get_immediate_post_dominators_block(
+    entry_block: Block,
+) -> Dict[Optional[Block], Optional[Block]]:
+    """
+    Return the immediate post-dominator of every block that can reach the function exit.
+
+    A function may return from several blocks, so post-dominators are computed with respect to a
+    virtual exit, represented by None, whose predecessors are all exit blocks. A block mapped to
+    None is immediately post-dominated by the virtual exit. Blocks that can never reach an exit
+    (e.g. infinite loops) are left out of the mapping.
+    """
+    exits = _exit_blocks(entry_block)
+
+    def successors(block: Optional[Block]) -> Iterable[Optional[Block]]:
+        # successors in the reversed CFG
+        return exits if block is None else sorted(block.predecessors)
+
+    def predecessors(block: Optional[Block]) -> Iterable[Optional[Block]]:
+        # predecessors in the reversed CFG
+        if block is None:
+            return []
+        return [None] if block in exits else block.successors
+
+    return _get_idoms(None, successors, predecessors)
+
+
+def post_dominance_tree_block(entry_block: Block) -> List[Block]:
+    """
+    Construct the post-dominance tree for a function, rooted at a virtual exit block.
+    """
+    ipdom = get_immediate_post_dominators_block(entry_block)
+
+    # block ids are f{fi}-{index}, give the virtual exit an index no real block uses, including
+    # the blocks that never reach it (with no exit at all, the tree is just the virtual exit)
+    fi = entry_block.id.split("-")[0]
+    max_ii = max(
+        int(block.id.split("-")[1])
+        for block in reverse_postorder(entry_block, lambda block: block.successors)
+    )
+    exit_block = Block(
+        id=f"{fi}-{max_ii + 1}",
+        label="exit",
+        predecessors=set(),
+        successors=set(),
+        instrs=[{"label": "exit"}],
+    )
+
+    tree_blocks: Dict[Optional[Block], Block] = {None: exit_block}
+    for block in ipdom.keys():
+        if block is not None:
+            tree_blocks[block] = Block(
+                id=block.id,
+                label=block.label,
+                predecessors=set(),
+                successors=set(),
+                instrs=block.instrs,
+            )
+
+    for block, parent in ipdom.items():
+        if block is not None:
+            tree_blocks[parent].successors.add(tree_blocks[block])
+            tree_blocks[block].predecessors.add(tree_blocks[parent])
+
+    return list(tree_blocks.values())
+
+
+def control_dependence_block(entry_block: Block) -> Dict[Block, Set[Block]]:
+    """
+    Return a mapping of each block to the set of blocks it is control dependent on.
+
+    B is control dependent on A iff A has a successor from which B is always reached (B post-
+    dominates it) while B does not strictly post-dominate A, i.e. A's branch decides whether B
+    runs. These are exactly the post-dominance frontiers, computed on the reversed CFG.
+    """
+    ipdom = get_immediate_post_dominators_block(entry_block)
+    exits = set(_exit_blocks(entry_block))
+
+    def predecessors(block: Optional[Block]) -> Iterable[Optional[Block]]:
+        # predecessors in the reversed CFG
+        if block is None:
+            return []
+        return list(block.successors) + ([None] if block in exits else [])
+
+    frontiers = _get_frontiers(ipdom, predecessors)
+    return {
+        block: {dep for dep in deps if dep is not None}
+        for block, deps in frontiers.items()
+        if block is not None
+    }
+
+
+def control_dependence_graph_block(entry_block: Block) -> List[Block]:
+    """
+    Construct the control dependence graph, with an edge A -> B iff B is control dependent on A.
+    """
+    deps = control_dependence_block(entry_block)
+    cdg_blocks = {
+        block: Block(
+            id=block.id,
+            label=block.label,
+            predecessors=set(),
+            successors=set(),
+            instrs=block.instrs,
+        )
+        for block in deps.keys()
+    }
+
+    for block, controllers in deps.items():
+        for controller in controllers:
+            cdg_blocks[controller].successors.add(cdg_blocks[block])
+            cdg_blocks[block].predecessors.add(cdg_blocks[controller])
+
+    return list(cdg_blocks.values())
+
+
 def visualize_frontier(
     key_node: Node,
     frontier: List[Node],
@@ -298,54 +675,62 @@ def visualize_frontier(
 
 
 if __name__ == "__main__":
-    program, cli_flags = load(["-t", "-f", "-v"])
+    program, cli_flags = load(["-t", "-f", "-v", "-pt", "-cdg"])
 
     if program is None:
         sys.exit(1)
 
-    if not cli_flags["t"] and not cli_flags["f"]:
-        print("Please specify either -t or -f")
+    if not any(cli_flags[flag] for flag in ["t", "f", "pt", "cdg"]):
+        print("Please specify either -t, -f, -pt or -cdg")
         sys.exit(1)
 
-    cfg_root_nodes = to_cfg_fine_grain(program)
-
-    # accumulate all nodes in the program
-    cfg_nodes = []
-    for root_node in cfg_root_nodes:
-        q = deque([root_node.entry_node])
-        seen: Set[Node] = set()
-
-        while q:
-            node = q.popleft()
-            seen.add(node)
-            q.extend([succ for succ in node.successors if succ not in seen])
+    if cli_flags["pt"] or cli_flags["cdg"]:
+        # post-dominance analyses run on the basic block cfg
+        for fi, func in enumerate(program["functions"]):
+            blocks = to_cfg(func.get("instrs", []), fi)
+            if not blocks:
+                continue
 
-        cfg_nodes.extend(list(seen))
+            print(f"Function {func.get('name', f'f{fi}')}:")
+            if cli_flags["pt"]:
+                print(visualize_block(post_dominance_tree_block(blocks[0])))
+            else:
+                print(visualize_block(control_dependence_graph_block(blocks[0])))
+        sys.exit(0)
 
-    # entry_nodes = get_entry_nodes(cfg_nodes)
+    cfg_root_nodes = {
+        root_node.func_name: root_node for root_node in to_cfg_fine_grain(program)
+    }
 
     if cli_flags["t"]:
         print("Generating dominance tree for each function...")
-
-        for i in range(len(cfg_root_nodes)):
-            print(f"Function {cfg_root_nodes[i].func_name}:")
-            doms = _get_dominators(cfg_root_nodes[i].entry_node)
-            t = dominance_tree(doms)
-            print(visualize_from_nodes(t))
-
-    elif cli_flags["f"]:
+    else:
         print("Generating dominance frontier for all nodes in CFG...")
-        for i in range(len(cfg_root_nodes)):
-            print(f"Function {cfg_root_nodes[i].func_name}:")
-            doms = _get_dominators(cfg_root_nodes[i].entry_node)
-            t = dominance_tree(doms)
-
-            frontiers = [(node, dominance_frontier(node)) for node in sorted(cfg_nodes)]
 
-            if not cli_flags["v"]:
-                for key_node, frontier in frontiers:
-                    print(f"Node {key_node.id}:")
-                    print(visualize_frontier(key_node, frontier, doms, cfg_nodes))
+    for fi, func in enumerate(program["functions"]):
+        func_name = func.get("name", f"f{fi}")
+        if func_name not in cfg_root_nodes:
+            continue  # function without instructions
+
+        print(f"Function {func_name}:")
+        entry_node = cfg_root_nodes[func_name].entry_node
+
+        # dominance is computed on basic blocks and refined to single instructions
+        blocks = to_cfg(func.get("instrs", []), fi)
+        idom = get_immediate_dominators(entry_node, blocks)
+
+        if cli_flags["t"]:
+            print(visualize_from_nodes(dominance_tree_from_idoms(idom)))
+
+        elif not cli_flags["v"]:
+            doms = dominators_from_idoms(idom)
+            cfg_nodes = sorted(doms.keys())
+            frontiers = dominance_frontiers(entry_node, blocks)
+            for key_node in cfg_nodes:
+                print(f"Node {key_node.id}:")
+                print(
+                    visualize_frontier(key_node, frontiers[key_node], doms, cfg_nodes)
+                )
         # else:
         # visualize animation for dominance relation for all nodes in CFG
         # name = "perfect"
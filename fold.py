@@ -0,0 +1,218 @@
+"""
+Shared helpers for value numbering passes: canonical forms of pure expressions, constant
+folding with Bril's semantics (64-bit wrapping integers, division truncating towards zero,
+IEEE doubles) and algebraic identities such as x + 0 and x * 1.
+"""
+import json
+import math
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from bril_type import *
+
+# operations whose result only depends on their arguments
+PURE_OPS = {
+    "add",
+    "sub",
+    "mul",
+    "div",
+    "eq",
+    "lt",
+    "gt",
+    "le",
+    "ge",
+    "not",
+    "and",
+    "or",
+    "fadd",
+    "fsub",
+    "fmul",
+    "fdiv",
+    "feq",
+    "flt",
+    "fgt",
+    "fle",
+    "fge",
+    "ceq",
+    "clt",
+    "cgt",
+    "cle",
+    "cge",
+    "char2int",
+    "int2char",
+    "ptradd",
+}
+
+COMMUTATIVE_OPS = {"add", "mul", "eq", "and", "or", "fadd", "fmul", "feq", "ceq"}
+
+# a > b is b < a, so both are numbered as the same value
+MIRRORED_OPS = {
+    "gt": "lt",
+    "ge": "le",
+    "fgt": "flt",
+    "fge": "fle",
+    "cgt": "clt",
+    "cge": "cle",
+}
+
+
+def canonicalize(op: str, args: Tuple) -> Tuple[str, Tuple]:
+    """
+    Return a canonical (op, args) for an expression, so that equal values look the same:
+    arguments of commutative ops are sorted and mirrored comparisons are flipped.
+    Arguments must be comparable to each other, e.g. all value numbers.
+    """
+    if op in MIRRORED_OPS:
+        return MIRRORED_OPS[op], tuple(reversed(args))
+    if op in COMMUTATIVE_OPS:
+        return op, tuple(sorted(args))
+    return op, args
+
+
+def const_key(type: Type, value: Literal) -> tuple:
+    """
+    Return the value tuple of a constant, so that constants with the same type and value look
+    the same. 0.0 and -0.0 are equal in Python but not in Bril, so floats also carry their sign.
+    """
+    if isinstance(value, float):
+        return "const", json.dumps(type), value, math.copysign(1.0, value)
+    return "const", json.dumps(type), value
+
+
+def wrap_int(value: int) -> int:
+    """Wrap an integer to a signed 64-bit value."""
+    value &= (1 << 64) - 1
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _div(a: int, b: int) -> Optional[int]:
+    if b == 0:
+        return None  # a runtime error, leave it to happen at runtime
+    quotient = abs(a) // abs(b)
+    return wrap_int(quotient if (a >= 0) == (b >= 0) else -quotient)
+
+
+INT_FOLDS: Dict[str, Callable[..., Optional[Literal]]] = {
+    "add": lambda a, b: wrap_int(a + b),
+    "sub": lambda a, b: wrap_int(a - b),
+    "mul": lambda a, b: wrap_int(a * b),
+    "div": _div,
+    "eq": lambda a, b: a == b,
+    "lt": lambda a, b: a < b,
+    "gt": lambda a, b: a > b,
+    "le": lambda a, b: a <= b,
+    "ge": lambda a, b: a >= b,
+}
+
+BOOL_FOLDS: Dict[str, Callable[..., Optional[Literal]]] = {
+    "not": lambda a: not a,
+    "and": lambda a, b: a and b,
+    "or": lambda a, b: a or b,
+}
+
+
+def _fdiv(a: float, b: float) -> Optional[float]:
+    if b == 0:
+        return None  # inf or nan, which have no JSON literal
+    return a / b
+
+
+FLOAT_FOLDS: Dict[str, Callable[..., Optional[Literal]]] = {
+    "fadd": lambda a, b: a + b,
+    "fsub": lambda a, b: a - b,
+    "fmul": lambda a, b: a * b,
+    "fdiv": _fdiv,
+    "feq": lambda a, b: a == b,
+    "flt": lambda a, b: a < b,
+    "fgt": lambda a, b: a > b,
+    "fle": lambda a, b: a <= b,
+    "fge": lambda a, b: a >= b,
+}
+
+
+def is_int(value: Literal) -> bool:
+    # bool is a subclass of int in Python, but not in Bril
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def fold(op: str, values: List[Literal]) -> Optional[Literal]:
+    """
+    Return the result of op on constant int, bool or float arguments, or None if it can not be
+    folded (another op or type, or an operation that fails at runtime such as division by zero).
+    """
+    if op in INT_FOLDS and all(is_int(value) for value in values):
+        return INT_FOLDS[op](*values)
+    if op in BOOL_FOLDS and all(isinstance(value, bool) for value in values):
+        return BOOL_FOLDS[op](*values)
+    if op in FLOAT_FOLDS and all(
+        isinstance(value, (int, float)) and not isinstance(value, bool)
+        for value in values
+    ):
+        # float literals without a fraction may be stored as JSON integers
+        result = FLOAT_FOLDS[op](*map(float, values))
+        if isinstance(result, float) and not math.isfinite(result):
+            return None
+        return result
+    return None
+
+
+def simplify(
+    op: str, args: Sequence, consts: Sequence[Optional[Literal]]
+) -> Optional[Tuple[str, Literal]]:
+    """
+    Apply an algebraic identity to op, for arguments that are not all constants.
+    - args: the arguments as value numbers, equal arguments hold equal values
+    - consts: the constant value of each argument, or None if it is not a constant
+
+    Returns ("arg", i) if the result is argument i, ("const", value) if the result is a
+    constant, or None if no identity applies. Float identities are limited to the ones that
+    hold for -0.0 and nan as well.
+    """
+    if len(args) != 2:
+        return None
+    a, b = consts
+
+    def _int_is(value: Optional[Literal], n: int) -> bool:
+        return value is not None and is_int(value) and value == n
+
+    if op == "add":
+        if _int_is(a, 0):
+            return "arg", 1
+        if _int_is(b, 0):
+            return "arg", 0
+    elif op == "sub":
+        if _int_is(b, 0):
+            return "arg", 0
+        if args[0] == args[1]:
+            return "const", 0
+    elif op == "mul":
+        if _int_is(a, 0) or _int_is(b, 0):
+            return "const", 0
+        if _int_is(a, 1):
+            return "arg", 1
+        if _int_is(b, 1):
+            return "arg", 0
+    elif op == "div":
+        if _int_is(b, 1):
+            return "arg", 0
+    elif op in {"eq", "le", "ge"} and args[0] == args[1]:
+        return "const", True
+    elif op in {"lt", "gt"} and args[0] == args[1]:
+        return "const", False
+    elif op in {"and", "or"}:
+        # the value that decides the result: false for and, true for or
+        absorbing = op == "or"
+        if a is absorbing or b is absorbing:
+            return "const", absorbing
+        if a is (not absorbing):
+            return "arg", 1
+        if b is (not absorbing) or args[0] == args[1]:
+            return "arg", 0
+    elif op == "fmul":
+        if a is not None and not isinstance(a, bool) and a == 1:
+            return "arg", 1
+        if b is not None and not isinstance(b, bool) and b == 1:
+            return "arg", 0
+    elif op == "fdiv":
+        if b is not None and not isinstance(b, bool) and b == 1:
+            return "arg", 0
+    return None
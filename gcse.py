@@ -0,0 +1,173 @@
+"""
+Global common subexpression elimination driven by available expressions.
+
+A pure computation whose expression is available where it runs (computed on every path to it and
+none of its arguments redefined since) is redundant. The nearest computations of the expression
+on the paths reaching it are found by searching the CFG backwards. If they all assign the same
+variable and it is not redefined on the way, the redundant computation becomes a copy of that
+variable (or disappears, if it assigns the variable itself). Otherwise those computations also
+save their result in a new temporary, which the redundant one copies. Copy propagation and dead
+code elimination, as done by LVN and TDCE, then remove most of the copies.
+
+    bril2json < prog.bril | python3 gcse.py | python3 -m lesson_tasks.l3.lvn
+        | python3 -m lesson_tasks.l3.tdce | brili -p
+"""
+import json
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+from block import Block, blocks_to_instrs
+from bril_type import *
+from cfg import to_cfg
+from dfa import available_expressions_block, expression_key
+from utils import fresh_name, load
+
+
+def _last_computation(block: Block, key: tuple) -> Optional[int]:
+    """
+    The index of the last instruction of block that computes key, if none of the expression's
+    arguments is redefined after it.
+    """
+    for i in range(len(block.instrs) - 1, -1, -1):
+        instr = block.instrs[i]
+        if expression_key(instr) == key:
+            return i
+        if instr.get("dest") in key[1]:
+            return None
+    return None
+
+
+def _reaching_computations(
+    block: Block, i: int, key: tuple
+) -> Optional[Tuple[List[Instruction], Set[str]]]:
+    """
+    Return the computations of key nearest to instruction i of block on every path reaching it,
+    together with the variables defined between them and the instruction. None if a path from
+    the entry has no computation.
+    """
+    found: List[Instruction] = []
+    redefined: Set[str] = set()
+    for instr in block.instrs[:i]:
+        if "dest" in instr:
+            redefined.add(instr["dest"])
+
+    seen: Set[Block] = set(block.predecessors)
+    stack = list(block.predecessors)
+    while stack:
+        pred = stack.pop()
+        j = _last_computation(pred, key)
+        if j is not None:
+            found.append(pred.instrs[j])
+        if not pred.predecessors and j is None:
+            return None  # reached the entry without computing the expression
+        for instr in pred.instrs[(j + 1 if j is not None else 0) :]:
+            if "dest" in instr:
+                redefined.add(instr["dest"])
+        if j is None:
+            for next_pred in pred.predecessors:
+                if next_pred not in seen:
+                    seen.add(next_pred)
+                    stack.append(next_pred)
+    return found, redefined
+
+
+def gcse(blocks: List[Block], taken: Set[str]) -> int:
+    """
+    Mutates the blocks of a function (blocks[0] is the entry block) to remove computations of
+    expressions that are already available. New temporaries are named apart from the variables
+    in taken. Returns the number of computations replaced.
+    """
+    expressions, kills, avail_in, _ = available_expressions_block(blocks)
+    bit = {key: i for i, key in enumerate(expressions)}
+
+    # key: id of a redundant instruction, value: variable holding its value
+    sources: Dict[int, str] = {}
+    # key: id of a computation, value: temporary it also saves its result in
+    temps: Dict[int, str] = {}
+    temp_of: Dict[tuple, str] = {}  # key: expression, value: its temporary
+
+    for block in blocks:
+        available = avail_in[block]
+        # key: expression computed in the block and not killed since, value: its computation
+        local: Dict[tuple, Instruction] = {}
+        defined_since: Dict[tuple, Set[str]] = {}  # variables defined after local[key]
+        for i, instr in enumerate(block.instrs):
+            key = expression_key(instr)
+            if key is not None and available >> bit[key] & 1:
+                reaching: Optional[Tuple[List[Instruction], Set[str]]]
+                if key in local:
+                    reaching = [local[key]], defined_since[key]
+                else:
+                    reaching = _reaching_computations(block, i, key)
+                if reaching is not None:
+                    computations, redefined = reaching
+                    dests = {computation["dest"] for computation in computations}
+                    if len(dests) == 1 and not dests & redefined:
+                        (sources[id(instr)],) = dests
+                    else:
+                        if key not in temp_of:
+                            temp_of[key] = fresh_name(f"{instr['dest']}.cse", taken)
+                        sources[id(instr)] = temp_of[key]
+                        for computation in computations:
+                            temps[id(computation)] = temp_of[key]
+
+            if key is not None:
+                available |= 1 << bit[key]
+                local[key] = instr
+                defined_since[key] = set()
+            if "dest" in instr:
+                available &= ~kills.get(instr["dest"], 0)
+                for other in list(local):
+                    if instr["dest"] in other[1]:
+                        del local[other]
+                    elif other != key:
+                        defined_since[other].add(instr["dest"])
+
+    for block in blocks:
+        new_instrs: List[Instruction] = []
+        for instr in block.instrs:
+            source, temp = sources.get(id(instr)), temps.get(id(instr))
+
+            def _copy(dest: str, arg: str) -> Instruction:
+                return {"dest": dest, "op": "id", "type": instr["type"], "args": [arg]}
+
+            if source is not None:
+                if temp is not None and temp != source:
+                    new_instrs.append(_copy(temp, source))
+                if instr["dest"] != source:
+                    new_instrs.append(_copy(instr["dest"], source))
+            elif temp is not None:
+                # keep computing the value, into the temporary first
+                new_instrs.append({**instr, "dest": temp})
+                new_instrs.append(_copy(instr["dest"], temp))
+            else:
+                new_instrs.append(instr)
+        block.instrs = new_instrs
+
+    return len(sources)
+
+
+if __name__ == "__main__":
+    program, cli_flags = load(["-stats"])
+
+    if program is None:
+        sys.exit(1)
+
+    for fi, func in enumerate(program["functions"]):
+        blocks = to_cfg(func.get("instrs", []), fi)
+        if not blocks:
+            continue
+
+        taken = {arg["name"] for arg in func.get("args", [])}
+        for instr in func.get("instrs", []):
+            taken.update(instr.get("args", []))
+            if "dest" in instr:
+                taken.add(instr["dest"])
+
+        replaced = gcse(blocks, taken)
+        func["instrs"] = blocks_to_instrs(blocks)
+
+        if cli_flags["stats"]:
+            print(f"{func['name']}: {replaced} replaced", file=sys.stderr)
+
+    print(json.dumps(program, indent=2, sort_keys=True))
@@ -0,0 +1,195 @@
+"""
+Global value numbering on SSA form, scoped over the dominator tree.
+
+Extends the table of `lesson_tasks/l3/lvn.py` from one basic block to every block a value's
+definition dominates: a pure expression that was already computed in a dominating block is not
+recomputed, copies are propagated, constant expressions are folded and redundant or meaningless
+phis are removed. The input must be in SSA form.
+
+    bril2json < prog.bril | python3 ssa.py -to -pruned | python3 gvn.py | python3 ssa.py -from
+"""
+import json
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+from block import Block, blocks_to_instrs
+from bril_type import *
+from cfg import reverse_postorder, to_cfg
+from dominator import tree_children, get_immediate_dominators_block
+from fold import PURE_OPS, canonicalize, const_key, fold
+from utils import load
+
+
+def gvn(blocks: List[Block], func_args: Optional[List[Argument]] = None) -> int:
+    """
+    Mutates the blocks of a function in SSA form (blocks[0] is the entry block) to perform GVN
+    on them. Returns the number of instructions removed.
+    """
+    num2val: List[tuple] = []  # Maps value numbers to value tuples
+    var2num: Dict[str, int] = {}  # Maps var names to their value number
+    num2var: Dict[int, str] = {}  # Maps value numbers to their leader var
+    num2const: Dict[int, Literal] = {}  # Maps value numbers of constants to their value
+    table: Dict[tuple, int] = {}  # Maps value tuples in scope to their value number
+    numbered: Set[str] = set()  # Vars whose definition has been numbered
+
+    def _new_num(value: tuple, var: str) -> int:
+        num2val.append(value)
+        num = len(num2val) - 1
+        num2var[num] = var
+        var2num[var] = num
+        return num
+
+    def _num(var: str) -> int:
+        # arguments, uses with no definition and defs reached through a back edge
+        if var not in var2num:
+            _new_num(("var", var), var)
+        return var2num[var]
+
+    def _leader(var: str) -> str:
+        return num2var[var2num[var]] if var in var2num else var
+
+    for arg in func_args or []:
+        _num(arg["name"])
+        numbered.add(arg["name"])
+
+    idom = get_immediate_dominators_block(blocks[0])
+    children = tree_children(idom)
+    rpo_index = {
+        block: i
+        for i, block in enumerate(
+            reverse_postorder(blocks[0], lambda b: sorted(b.successors))
+        )
+    }
+
+    removed = 0
+
+    # (block, None) numbers the block, (block, added) drops its table entries after its subtree
+    stack: List[Tuple[Block, Optional[List[tuple]]]] = [(blocks[0], None)]
+    while stack:
+        block, added = stack.pop()
+        if added is not None:
+            for key in added:
+                del table[key]
+            continue
+
+        added = []
+        new_instrs: List[Instruction] = []
+        for instr in block.instrs:
+            if "op" not in instr:
+                new_instrs.append(instr)  # label
+                continue
+
+            if "dest" not in instr:
+                # effects only: print, store, br, ret, ...
+                if "args" in instr:
+                    instr["args"] = [_leader(arg) for arg in instr["args"]]
+                new_instrs.append(instr)
+                continue
+
+            dest = instr["dest"]
+            op = instr["op"]
+            value: Optional[tuple] = None
+            numbered.add(dest)
+
+            if op == "phi":
+                # args of edges from blocks numbered so far are already leaders, the
+                # others (back edges) are numbered as plain vars for now
+                args = instr["args"]
+                if (
+                    len(set(args)) == 1
+                    and args[0] in numbered
+                    and len(args) == len(block.predecessors)
+                ):
+                    # meaningless phi: its one value is defined on every incoming path, so
+                    # its definition dominates the phi
+                    var2num[dest] = _num(args[0])
+                    removed += 1
+                    continue
+                value = (
+                    "phi",
+                    block.label,
+                    tuple(sorted(zip(instr["labels"], map(_num, args)))),
+                )
+
+            elif op == "id":
+                # copy propagation
+                var2num[dest] = _num(instr["args"][0])
+                removed += 1
+                continue
+
+            elif op == "const":
+                value = const_key(instr["type"], instr["value"])
+
+            elif op in PURE_OPS:
+                instr["args"] = [_leader(arg) for arg in instr["args"]]
+                nums = tuple(_num(arg) for arg in instr["args"])
+                if all(num in num2const for num in nums):
+                    folded = fold(op, [num2const[num] for num in nums])
+                    if folded is not None:
+                        instr = {
+                            "op": "const",
+                            "dest": dest,
+                            "type": instr["type"],
+                            "value": folded,
+                        }
+                        op = "const"
+                        value = const_key(instr["type"], folded)
+                if value is None:
+                    value = canonicalize(op, nums)
+
+            else:
+                # calls, loads, allocs: every execution is a new value
+                if "args" in instr:
+                    instr["args"] = [_leader(arg) for arg in instr["args"]]
+
+            if value is not None and value in table:
+                # computed before in a dominating block
+                var2num[dest] = table[value]
+                removed += 1
+                continue
+
+            num = _new_num(value if value is not None else ("var", dest), dest)
+            if value is not None:
+                table[value] = num
+                added.append(value)
+            if op == "const":
+                num2const[num] = instr["value"]
+            new_instrs.append(instr)
+
+        block.instrs = new_instrs
+
+        # phis read their args at the end of the predecessor
+        for succ in block.successors:
+            for instr in succ.instrs:
+                if instr.get("op") == "phi":
+                    instr["args"] = [
+                        _leader(arg) if label == block.label else arg
+                        for arg, label in zip(instr["args"], instr["labels"])
+                    ]
+
+        # children in reverse postorder, so forward edges into a join are numbered first
+        stack.append((block, added))
+        for child in sorted(children[block], key=lambda b: rpo_index[b], reverse=True):
+            stack.append((child, None))
+
+    return removed
+
+
+if __name__ == "__main__":
+    program, cli_flags = load(["-stats"])
+
+    if program is None:
+        sys.exit(1)
+
+    for fi, func in enumerate(program["functions"]):
+        blocks = to_cfg(func.get("instrs", []), fi)
+        if not blocks:
+            continue
+
+        removed = gvn(blocks, func.get("args", []))
+        func["instrs"] = blocks_to_instrs(blocks)
+
+        if cli_flags["stats"]:
+            print(f"{func.get('name', f'f{fi}')}: {removed} removed", file=sys.stderr)
+
+    print(json.dumps(program, indent=2, sort_keys=True))
@@ -0,0 +1,415 @@
+"""
+Induction variable strength reduction and elimination on SSA form.
+
+A basic induction variable is a phi in a loop header that starts at a value from the preheader
+and is incremented by a loop-invariant step on the back edge. Derived induction variables are
+computed from one with multiplications, additions and ptradds by loop-invariant values, e.g.
+`ptradd arr (add (mul i n) j)`. Each derived variable that is worth it becomes a new phi of its
+own, started in the preheader and incremented with an add (or a ptradd) on the back edge, so
+the chain of instructions computing it is no longer executed on every iteration. A basic
+variable that is then only compared to constant bounds is replaced in the comparisons by one of
+its reduced derived variables and removed, when the loop's exit test tells the values it takes
+and none of them (or the bounds) overflows once scaled. The input must be in SSA form.
+
+    bril2json < prog.bril | python3 ssa.py -to -pruned | python3 licm.py | python3 indvars.py
+        | python3 ssa.py -from
+"""
+import json
+import math
+import sys
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+from block import Block, blocks_to_instrs
+from bril_type import *
+from cfg import insert_before_terminator, reverse_postorder, to_cfg
+from defuse import DefUseIndex
+from fold import is_int
+from loops import Loop, get_loop_forest
+from ssa import UNDEFINED, var_types
+from utils import fresh_name, load
+
+COMPARISON_OPS = {"eq", "lt", "gt", "le", "ge"}
+# key: comparison, value: the comparison that holds when it does not
+NEGATED_OPS = {"lt": "ge", "ge": "lt", "le": "gt", "gt": "le", "eq": "ne", "ne": "eq"}
+# key: comparison, value: the same comparison with its arguments swapped
+SWAPPED_OPS = {"lt": "gt", "gt": "lt", "le": "ge", "ge": "le", "eq": "eq", "ne": "ne"}
+
+
+def trip_count(op: str, start: int, bound: int, step: int) -> Optional[int]:
+    """
+    Return the number of times `op value bound` holds for value = start, start + step, ... before
+    it first fails, or None if it never fails or the value would overflow first.
+    """
+    if op in {"gt", "ge"}:
+        op, start, bound, step = SWAPPED_OPS[op], -start, -bound, -step
+    if op == "le":
+        op, bound = "lt", bound + 1
+    if op == "eq":
+        if start != bound:
+            return 0
+        return 1 if step != 0 else None
+    if op == "ne":
+        if step == 0 or (bound - start) % step != 0 or (bound - start) // step < 0:
+            return None
+        trips = (bound - start) // step
+    else:
+        if start >= bound:
+            return 0
+        if step <= 0:
+            return None
+        trips = -((start - bound) // step)
+    if abs(start + trips * step) >= 1 << 63:
+        return None
+    return trips
+
+
+@dataclass(frozen=True)
+class Family:
+    """
+    The value of a derived induction variable: basic * product(scale) + the sum of the
+    products of the offset terms, added to base with a ptradd if it is a pointer. Factors and
+    terms are loop-invariant variables.
+    """
+
+    basic: str
+    scale: Tuple[str, ...]
+    offset: Tuple[Tuple[str, ...], ...]
+    base: Optional[str]  # the pointer the value is an offset of, if any
+    depth: int  # number of instructions that compute the variable from basic
+
+    def is_worth_reducing(self) -> bool:
+        # a chain of instructions becomes one update, a multiplication becomes an addition
+        return self.depth >= 2 or bool(self.scale)
+
+
+def _reduce_loop(
+    loop: Loop,
+    rpo: List[Block],
+    index: DefUseIndex,
+    taken: Set[str],
+    types: Dict[str, Type],
+) -> Tuple[int, int]:
+    """
+    Reduce the derived induction variables of loop and eliminate its redundant basic ones.
+    Returns the number of variables reduced and eliminated.
+    """
+    preheader = loop.preheader
+    if preheader is None or len(loop.latches) != 1:
+        return 0, 0
+    (latch,) = loop.latches
+    header = loop.header
+    if any(
+        not block.instrs or "label" not in block.instrs[0]
+        for block in (preheader, latch, header)
+    ):
+        return 0, 0  # new phis need the labels of their edges
+
+    def _in_loop(var: str) -> bool:
+        definition = index.single_definition(var)
+        return definition is not None and index.block_of(definition) in loop.body
+
+    def _const(var: str) -> Optional[Literal]:
+        definition = index.single_definition(var)
+        if definition is not None and definition.get("op") == "const":
+            return definition["value"]
+        return None
+
+    # key: basic induction variable, value: (initial value, step, incremented variable)
+    basics: Dict[str, Tuple[str, str, str]] = {}
+    for instr in header.instrs:
+        if instr.get("op") != "phi" or len(instr["args"]) != 2:
+            continue
+        incoming = dict(zip(instr["labels"], instr["args"]))
+        init, next_var = incoming.get(preheader.label), incoming.get(latch.label)
+        if init is None or next_var is None or UNDEFINED in (init, next_var):
+            continue
+        increment = index.single_definition(next_var)
+        if increment is None or increment.get("op") != "add" or not _in_loop(next_var):
+            continue
+        args = increment["args"]
+        if args[0] == instr["dest"] and not _in_loop(args[1]):
+            basics[instr["dest"]] = (init, args[1], next_var)
+        elif args[1] == instr["dest"] and not _in_loop(args[0]):
+            basics[instr["dest"]] = (init, args[0], next_var)
+
+    if not basics:
+        return 0, 0
+    updates = {next_var for _, _, next_var in basics.values()}
+
+    # derived induction variables, definitions dominate their uses so one pass is enough
+    families: Dict[str, Family] = {var: Family(var, (), (), None, 0) for var in basics}
+    derived: List[str] = []
+    for block in rpo:
+        if block not in loop.body:
+            continue
+        for instr in block.instrs:
+            dest, op = instr.get("dest"), instr.get("op")
+            if dest is None or dest in updates or op not in {"mul", "add", "ptradd"}:
+                continue
+            a, b = instr["args"]
+            if op == "ptradd":
+                family = families.get(b)
+                if family is None or family.base is not None or _in_loop(a):
+                    continue
+                families[dest] = Family(
+                    family.basic, family.scale, family.offset, a, family.depth + 1
+                )
+            else:
+                if a not in families or _in_loop(b):
+                    a, b = b, a
+                family = families.get(a)
+                if family is None or family.base is not None or _in_loop(b):
+                    continue
+                if op == "mul":
+                    families[dest] = Family(
+                        family.basic,
+                        family.scale + (b,),
+                        tuple(term + (b,) for term in family.offset),
+                        None,
+                        family.depth + 1,
+                    )
+                else:
+                    families[dest] = Family(
+                        family.basic,
+                        family.scale,
+                        family.offset + ((b,),),
+                        None,
+                        family.depth + 1,
+                    )
+            derived.append(dest)
+
+    # loop-invariant values are computed in the preheader
+    def _emit(op: str, args: List[str], type: Type, base: str) -> str:
+        dest = fresh_name(base, taken)
+        instr: Instruction = {"dest": dest, "op": op, "type": type, "args": args}
+        insert_before_terminator(preheader, instr)
+        index.add(instr, preheader)
+        types[dest] = type
+        return dest
+
+    def _product(factors: Tuple[str, ...], base: str) -> str:
+        result = factors[0]
+        for factor in factors[1:]:
+            result = _emit("mul", [result, factor], "int", f"{base}.scale")
+        return result
+
+    def _linear(family: Family, value: str, base: str) -> str:
+        """Emit value * scale + offset of family."""
+        result = _product((value,) + family.scale, base)
+        for term in family.offset:
+            result = _emit("add", [result, _product(term, base)], "int", base)
+        return result
+
+    reduced = 0
+    # key: basic induction variable, value: its reduced int variables and their families
+    reduced_ints: Dict[str, List[Tuple[str, Family]]] = {}
+    for var in derived:
+        family = families[var]
+        uses = index.uses(var)
+        if (
+            not family.is_worth_reducing()
+            or not uses
+            or any(index.block_of(use) not in loop.body for use in uses)
+            # only needed to compute other derived variables
+            or all(use.get("dest") in families for use in uses)
+        ):
+            continue
+
+        init, step, _ = basics[family.basic]
+        type = types[var]
+        new_init = _linear(family, init, f"{var}.init")
+        new_step = _product(family.scale + (step,), f"{var}.step")
+        if family.base is not None:
+            new_init = _emit("ptradd", [family.base, new_init], type, f"{var}.init")
+
+        phi_var = fresh_name(f"{var}.iv", taken)
+        next_var = fresh_name(f"{var}.next", taken)
+        update: Instruction = {
+            "dest": next_var,
+            "op": "ptradd" if family.base is not None else "add",
+            "type": type,
+            "args": [phi_var, new_step],
+        }
+        insert_before_terminator(latch, update)
+        index.add(update, latch)
+        phi: Instruction = {
+            "dest": phi_var,
+            "op": "phi",
+            "type": type,
+            "args": [new_init, next_var],
+            "labels": [preheader.label, latch.label],
+        }
+        header.instrs.insert(1, phi)
+        index.add(phi, header)
+        types[phi_var] = types[next_var] = type
+
+        index.replace_all_uses(var, phi_var)
+        reduced += 1
+        if family.base is None:
+            reduced_ints.setdefault(family.basic, []).append((phi_var, family))
+
+    # derived variables that are no longer used
+    changed = True
+    while changed:
+        changed = False
+        for var in derived:
+            definition = index.single_definition(var)
+            if definition is None or index.is_used(var):
+                continue
+            def_block = index.block_of(definition)
+            if def_block is not None:
+                def_block.instrs = [i for i in def_block.instrs if i is not definition]
+            index.remove(definition)
+            changed = True
+
+    def _int(var: str) -> Optional[int]:
+        value = _const(var)
+        return value if value is not None and is_int(value) else None  # type: ignore
+
+    def _values(var: str, compares: List[Instruction]) -> Optional[Tuple[int, int]]:
+        """
+        Return the least and greatest values basic variable var holds in the loop, if it starts
+        at a constant, steps by a constant and the exit test in the header compares it to a
+        constant.
+        """
+        init, step, _ = basics[var]
+        start, step_value = _int(init), _int(step)
+        terminator = header.instrs[-1]
+        if start is None or step_value is None or terminator.get("op") != "br":
+            return None
+        test = index.single_definition(terminator["args"][0])
+        if test is None or not any(test is use for use in compares):
+            return None
+        inside = [
+            any(block.label == label for block in loop.body)
+            for label in terminator["labels"]
+        ]
+        if inside not in ([True, False], [False, True]):
+            return None
+        a, b = test["args"]
+        op = test["op"] if inside[0] else NEGATED_OPS[test["op"]]
+        if a != var:
+            a, b, op = b, a, SWAPPED_OPS[op]
+        bound = _int(b)
+        if a != var or bound is None:
+            return None
+        # the test runs in every iteration, it sees the value that leaves the loop last
+        trips = trip_count(op, start, bound, step_value)
+        if trips is None:
+            return None
+        end = start + trips * step_value
+        return min(start, end), max(start, end)
+
+    # basic variables only compared to constant bounds are replaced by a reduced variable with a
+    # positive constant scale and a constant offset: i < n is i * c + d < n * c + d as long as
+    # neither side overflows, which is checked for every value i holds in the loop. The bounds
+    # are scaled in the preheader, so they must be defined outside the loop
+    eliminated = 0
+    for var, (_, _, next_var) in basics.items():
+        phi_def = index.single_definition(var)
+        update_def = index.single_definition(next_var)
+        if phi_def is None or update_def is None:
+            continue
+        if any(use is not phi_def for use in index.uses(next_var)):
+            continue
+        compares = [use for use in index.uses(var) if use is not update_def]
+        if any(
+            use.get("op") not in COMPARISON_OPS
+            or index.block_of(use) not in loop.body
+            or any(
+                arg != var and (_int(arg) is None or _in_loop(arg))
+                for arg in use["args"]
+            )
+            for use in compares
+        ):
+            continue
+
+        values = _values(var, compares) if compares else None
+        replacement: Optional[Tuple[str, Family]] = None
+        for phi_var, family in reduced_ints.get(var, []):
+            scales = [_int(factor) for factor in family.scale]
+            terms = [[_int(factor) for factor in term] for term in family.offset]
+            if values is None or None in scales or any(None in term for term in terms):
+                continue
+            scale = math.prod(scales)  # type: ignore
+            offset = sum(math.prod(term) for term in terms)  # type: ignore
+            points = list(values) + [
+                _int(arg) for use in compares for arg in use["args"] if arg != var
+            ]
+            if scale > 0 and all(
+                -(1 << 63) <= point * scale + offset < 1 << 63  # type: ignore
+                for point in points
+            ):
+                replacement = (phi_var, family)
+                break
+        if compares and replacement is None:
+            continue
+
+        for use in compares:
+            phi_var, family = replacement  # type: ignore
+            args = [
+                phi_var if arg == var else _linear(family, arg, f"{arg}.bound")
+                for arg in use["args"]
+            ]
+            index.set_args(use, args)
+
+        for definition in (phi_def, update_def):
+            def_block = index.block_of(definition)
+            if def_block is not None:
+                def_block.instrs = [i for i in def_block.instrs if i is not definition]
+            index.remove(definition)
+        eliminated += 1
+
+    return reduced, eliminated
+
+
+def reduce_induction_variables(
+    func_name: str,
+    blocks: List[Block],
+    types: Dict[str, Type],
+    func_args: List[Argument],
+) -> Tuple[int, int]:
+    """
+    Mutates the blocks of a function in SSA form (blocks[0] is the entry block) to strength
+    reduce and eliminate induction variables, innermost loops first. The CFG is not changed, so
+    the cached loop forest of the function stays valid. Returns the number of variables reduced
+    and eliminated.
+    """
+    index = DefUseIndex.from_blocks(blocks)
+    taken = (
+        index.defined_vars() | index.used_vars() | {arg["name"] for arg in func_args}
+    )
+    rpo = reverse_postorder(blocks[0], lambda b: sorted(b.successors))
+
+    reduced, eliminated = 0, 0
+    for loop in get_loop_forest(func_name, blocks).loops:
+        loop_reduced, loop_eliminated = _reduce_loop(loop, rpo, index, taken, types)
+        reduced += loop_reduced
+        eliminated += loop_eliminated
+    return reduced, eliminated
+
+
+if __name__ == "__main__":
+    program, cli_flags = load(["-stats"])
+
+    if program is None:
+        sys.exit(1)
+
+    for fi, func in enumerate(program["functions"]):
+        blocks = to_cfg(func.get("instrs", []), fi)
+        if not blocks:
+            continue
+
+        reduced, eliminated = reduce_induction_variables(
+            func.get("name", f"f{fi}"), blocks, var_types(func), func.get("args", [])
+        )
+        func["instrs"] = blocks_to_instrs(blocks)
+
+        if cli_flags["stats"]:
+            print(
+                f"{func.get('name', f'f{fi}')}: {reduced} reduced, {eliminated} eliminated",
+                file=sys.stderr,
+            )
+
+    print(json.dumps(program, indent=2, sort_keys=True))
@@ -0,0 +1,303 @@
+"""
+Function inlining with a size budget.
+
+Builds the call graph of the program and inlines calls to small functions that are not
+recursive (not part of a cycle in the call graph). Functions are processed callees first, so a
+callee is inlined with its own calls already inlined, and it is only inlined while its size (the
+number of instructions) is within the budget. Variables and labels of an inlined body are renamed
+apart from the caller's, arguments the callee never assigns are substituted instead of copied
+and returns become a copy of the result and a jump past the inlined body.
+
+Given an edge profile, as printed by `brili-trace.ts -e`, -stats also reports the change in the
+number of calls and instructions executed. A block runs as often as control enters its label,
+the first block of a function as often as the function is called. The returns of a callee with
+several of them are split between its call sites in proportion to how often each site calls it.
+
+    bril2json < prog.bril | deno run brili-trace.ts -e {args} > prog.edges.json
+    bril2json < prog.bril | python3 inline.py -budget 40 -profile prog.edges.json | brili -p
+"""
+import copy
+import json
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+from bril_type import *
+from cfg import EdgeProfile, strongly_connected_components
+from utils import fresh_name, load
+
+DEFAULT_BUDGET = 40  # largest callee, in instructions, that is inlined
+
+
+def call_graph(program: Program) -> Dict[str, Set[str]]:
+    """Return the names of the functions each function calls."""
+    return {
+        func["name"]: {
+            name
+            for instr in func.get("instrs", [])
+            if instr.get("op") == "call"
+            for name in instr.get("funcs", [])
+        }
+        for func in program["functions"]
+    }
+
+
+def recursive_functions(graph: Dict[str, Set[str]]) -> Set[str]:
+    """Return the functions that can call themselves, directly or through other functions."""
+    recursive: Set[str] = set()
+    for scc in _sccs(graph):
+        if len(scc) > 1 or scc[0] in graph.get(scc[0], set()):
+            recursive.update(scc)
+    return recursive
+
+
+def _sccs(graph: Dict[str, Set[str]]) -> List[List[str]]:
+    """Strongly connected components of the call graph, callers before callees."""
+    # a virtual root calls every function, so every function is reachable
+    sccs = strongly_connected_components(
+        None,
+        lambda name: sorted(graph) if name is None else sorted(graph.get(name, set())),
+    )
+    return [scc for scc in sccs if scc != [None]]  # type: ignore
+
+
+def function_size(func: Function) -> int:
+    return sum(1 for instr in func.get("instrs", []) if "op" in instr)
+
+
+def _executions(
+    program: Program, profiles: Dict[str, EdgeProfile]
+) -> Tuple[Dict[int, int], Dict[str, int]]:
+    """
+    Return the number of times each instruction of program runs (key: id of the instruction)
+    and each function is entered, given the edge profile of each function.
+    """
+    # key: function, value: key: label, value: times control entered it
+    entered: Dict[str, Dict[str, int]] = {}
+    for func in program["functions"]:
+        entered[func["name"]] = {}
+        for targets in profiles.get(func["name"], {}).values():
+            for label, count in targets.items():
+                entered[func["name"]][label] = (
+                    entered[func["name"]].get(label, 0) + count
+                )
+
+    def _scan(entries: Dict[str, int]) -> Dict[int, int]:
+        runs: Dict[int, int] = {}
+        for func in program["functions"]:
+            count = entries.get(func["name"], 0)
+            for instr in func.get("instrs", []):
+                if "label" in instr:
+                    count = entered[func["name"]].get(instr["label"], 0)
+                runs[id(instr)] = count
+                if instr.get("op") in {"jmp", "br", "ret"}:
+                    count = 0  # anything before the next label is unreachable
+        return runs
+
+    # a function is entered once per call, main once more. Calls in the first block of a
+    # function depend on the entries counted so far, a cycle of those would never terminate
+    entries: Dict[str, int] = {"main": 1}
+    for _ in range(len(program["functions"]) + 1):
+        runs = _scan(entries)
+        new_entries: Dict[str, int] = {"main": 1}
+        for func in program["functions"]:
+            for instr in func.get("instrs", []):
+                if instr.get("op") == "call":
+                    name = instr["funcs"][0]
+                    new_entries[name] = new_entries.get(name, 0) + runs[id(instr)]
+        if new_entries == entries:
+            break
+        entries = new_entries
+    return runs, entries
+
+
+def _inline_call(
+    call: Instruction,
+    callee: Function,
+    taken_vars: Set[str],
+    taken_labels: Set[str],
+) -> List[Instruction]:
+    """Return the instructions that replace call with the body of callee."""
+    instrs = callee.get("instrs", [])
+    assigned = {instr["dest"] for instr in instrs if "dest" in instr}
+
+    renamed_vars: Dict[str, str] = {}
+    body: List[Instruction] = []
+    for param, arg in zip(callee.get("args", []), call.get("args", [])):
+        if param["name"] in assigned:
+            renamed_vars[param["name"]] = fresh_name(
+                f"{param['name']}.{callee['name']}", taken_vars
+            )
+            body.append(
+                {
+                    "dest": renamed_vars[param["name"]],
+                    "op": "id",
+                    "type": param["type"],
+                    "args": [arg],
+                }
+            )
+        else:
+            # never assigned in the callee, the caller's variable can be used directly
+            renamed_vars[param["name"]] = arg
+
+    def _var(var: str) -> str:
+        if var not in renamed_vars:
+            renamed_vars[var] = fresh_name(f"{var}.{callee['name']}", taken_vars)
+        return renamed_vars[var]
+
+    renamed_labels: Dict[str, str] = {}
+
+    def _label(label: str) -> str:
+        if label not in renamed_labels:
+            renamed_labels[label] = fresh_name(
+                f"{label}.{callee['name']}", taken_labels
+            )
+        return renamed_labels[label]
+
+    after = fresh_name(f"{callee['name']}.return", taken_labels)
+    for instr in instrs:
+        instr = copy.deepcopy(instr)
+        if "label" in instr:
+            instr["label"] = _label(instr["label"])
+            body.append(instr)
+            continue
+        if "args" in instr:
+            instr["args"] = [_var(arg) for arg in instr["args"]]
+        if "dest" in instr:
+            instr["dest"] = _var(instr["dest"])
+        if "labels" in instr:
+            instr["labels"] = [_label(label) for label in instr["labels"]]
+
+        if instr["op"] == "ret":
+            if "dest" in call and instr.get("args"):
+                body.append(
+                    {
+                        "dest": call["dest"],
+                        "op": "id",
+                        "type": call["type"],
+                        "args": instr["args"],
+                    }
+                )
+            body.append({"op": "jmp", "labels": [after]})
+        else:
+            body.append(instr)
+
+    if body and body[-1].get("op") == "jmp" and body[-1]["labels"] == [after]:
+        body.pop()  # falls through to the end of the inlined body instead
+    body.append({"label": after})
+    return body
+
+
+def _entry_cost(callee: Function) -> int:
+    """The instructions an inlined body starts with: a copy of each parameter callee assigns."""
+    assigned = {instr["dest"] for instr in callee.get("instrs", []) if "dest" in instr}
+    return sum(param["name"] in assigned for param in callee.get("args", []))
+
+
+def _return_cost(call: Instruction, callee: Function, ret: Instruction) -> int:
+    """
+    The instructions ret of callee becomes when inlined at call: a copy of the result and a
+    jump past the inlined body, which the last instruction falls through instead.
+    """
+    return ("dest" in call and bool(ret.get("args"))) + (
+        ret is not callee["instrs"][-1]
+    )
+
+
+def inline_program(
+    program: Program,
+    budget: int = DEFAULT_BUDGET,
+    profiles: Optional[Dict[str, EdgeProfile]] = None,
+) -> Tuple[int, Optional[int], Optional[int]]:
+    """
+    Mutates program to inline calls to non-recursive functions with at most budget
+    instructions. Returns the number of calls inlined and, given the edge profile of each
+    function, the net change in the number of calls and of instructions executed.
+    """
+    graph = call_graph(program)
+    recursive = recursive_functions(graph)
+    funcs: Dict[str, Function] = {func["name"]: func for func in program["functions"]}
+    runs, entries = _executions(program, profiles) if profiles is not None else ({}, {})
+    calls_change = 0
+    executed_change = 0.0
+
+    def _has_phis(func: Function) -> bool:
+        # splitting the caller's block would change the predecessor labels of its phis
+        return any(instr.get("op") == "phi" for instr in func.get("instrs", []))
+
+    inlined = 0
+    # callees first, so they are inlined into their callers with their own calls inlined
+    for scc in reversed(_sccs(graph)):
+        for name in scc:
+            caller = funcs[name]
+            if _has_phis(caller):
+                continue
+
+            taken_vars = {arg["name"] for arg in caller.get("args", [])}
+            taken_labels: Set[str] = set()
+            for instr in caller.get("instrs", []):
+                taken_vars.update(instr.get("args", []))
+                if "dest" in instr:
+                    taken_vars.add(instr["dest"])
+                if "label" in instr:
+                    taken_labels.add(instr["label"])
+
+            new_instrs: List[Instruction] = []
+            for instr in caller.get("instrs", []):
+                callee: Optional[Function] = None
+                if instr.get("op") == "call":
+                    callee = funcs.get(instr["funcs"][0])
+                if (
+                    callee is None
+                    or callee["name"] in recursive
+                    or function_size(callee) > budget
+                    or _has_phis(callee)
+                ):
+                    new_instrs.append(instr)
+                    continue
+                new_instrs.extend(_inline_call(instr, callee, taken_vars, taken_labels))
+                inlined += 1
+
+                calls = runs.get(id(instr), 0)
+                if calls:
+                    calls_change -= calls
+                    executed_change += calls * (_entry_cost(callee) - 1)
+                    # each return runs for its share of the callee's entries
+                    for ret in callee.get("instrs", []):
+                        if ret.get("op") == "ret":
+                            executed_change += (
+                                calls
+                                * runs.get(id(ret), 0)
+                                / entries[callee["name"]]
+                                * (_return_cost(instr, callee, ret) - 1)
+                            )
+            caller["instrs"] = new_instrs
+
+    if profiles is None:
+        return inlined, None, None
+    return inlined, calls_change, round(executed_change)
+
+
+if __name__ == "__main__":
+    program, cli_flags = load(["-stats"], {"-budget": DEFAULT_BUDGET, "-profile": ""})
+
+    if program is None:
+        sys.exit(1)
+
+    # load types options with defaults of different types as object
+    budget, profile = cli_flags["budget"], cli_flags["profile"]
+    assert isinstance(budget, int) and isinstance(profile, str)
+
+    profiles: Optional[Dict[str, EdgeProfile]] = None
+    if profile:
+        with open(profile) as file:
+            profiles = json.load(file)
+
+    inlined, calls_change, executed_change = inline_program(program, budget, profiles)
+
+    if cli_flags["stats"]:
+        stats = f"{inlined} calls inlined"
+        if calls_change is not None:
+            stats += f", {calls_change:+} calls and {executed_change:+} instructions executed"
+        print(stats, file=sys.stderr)
+
+    print(json.dumps(program, indent=2, sort_keys=True))
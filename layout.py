@@ -0,0 +1,192 @@
+"""
+Profile-guided basic block layout.
+
+Blocks are placed so that the hottest jumps become fall-throughs, following Pettis and Hansen's
+bottom-up chain building: every block starts as a chain of its own, and, taking the edges from
+the most to the least frequent, the chain ending with an edge's source is joined with the chain
+starting with its target. The chain of the entry block is placed first and the other chains
+follow, the one most often entered from the blocks placed so far first. A br names both of its
+targets, so only the edges of jmps can become fall-throughs and take part in chain building.
+
+Edge counts come from an edge profile, as printed by `brili-trace.ts -e`: for each function, the
+label control came from ("" for the top of the function) and the label it went to. Without one,
+an edge is weighted 10 to the depth of the loops that contain both of its blocks.
+
+    bril2json < prog.bril | deno run brili-trace.ts -e {args} > prog.edges.json
+    bril2json < prog.bril | python3 layout.py -profile prog.edges.json | brili -p {args}
+"""
+import json
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from block import Block, blocks_to_instrs
+from bril_type import *
+from cfg import EdgeProfile, count_jumps, make_jumps_explicit, to_cfg
+from loops import get_loop_forest
+from utils import load
+
+LOOP_WEIGHT = 10  # estimated iterations of a loop when there is no profile
+
+
+def _static_weights(
+    func_name: str, blocks: List[Block]
+) -> Dict[Tuple[Block, Block], float]:
+    forest = get_loop_forest(func_name, blocks)
+    weights: Dict[Tuple[Block, Block], float] = {}
+    for block in blocks:
+        for succ in block.successors:
+            loop = forest.block_to_loop.get(block)
+            while loop is not None and succ not in loop.body:
+                loop = loop.parent
+            weights[(block, succ)] = LOOP_WEIGHT ** (loop.depth if loop else 0)
+    return weights
+
+
+def _profile_weights(
+    blocks: List[Block], profile: EdgeProfile, keys: Dict[Block, str]
+) -> Dict[Tuple[Block, Block], float]:
+    return {
+        (block, succ): profile.get(keys[block], {}).get(keys[succ], 0)
+        for block in blocks
+        for succ in block.successors
+    }
+
+
+def layout_blocks(
+    func_name: str, blocks: List[Block], profile: Optional[EdgeProfile] = None
+) -> List[Block]:
+    """
+    Reorder the blocks of function func_name (blocks[0] is the entry block), using profile for
+    the edge counts if it is given. Returns the blocks in their new order, with jumps made explicit
+    where a block no longer falls through and dropped where it now does.
+    """
+    # the labels the profile knows the blocks by, before unlabeled blocks get one
+    keys = {
+        block: block.instrs[0]["label"] if "label" in block.instrs[0] else ""
+        for block in blocks
+    }
+    weights = (
+        _profile_weights(blocks, profile, keys)
+        if profile is not None
+        else _static_weights(func_name, blocks)
+    )
+    make_jumps_explicit(blocks)
+    entry = blocks[0]
+    position = {block: i for i, block in enumerate(blocks)}
+
+    # chain building
+    chain_of: Dict[Block, List[Block]] = {block: [block] for block in blocks}
+    jumps = sorted(
+        (
+            (weights[(block, succ)], block, succ)
+            for block in blocks
+            if block.instrs[-1].get("op") == "jmp"
+            for succ in block.successors
+        ),
+        key=lambda edge: (-edge[0], position[edge[1]]),
+    )
+    for _, block, succ in jumps:
+        chain, succ_chain = chain_of[block], chain_of[succ]
+        if (
+            chain is not succ_chain
+            and chain[-1] is block
+            and succ_chain[0] is succ
+            and succ is not entry
+        ):
+            chain.extend(succ_chain)
+            for moved in succ_chain:
+                chain_of[moved] = chain
+
+    # chain placement, the chain most often entered from the placed blocks goes next
+    chains: List[List[Block]] = []
+    for block in blocks:
+        if chain_of[block][0] is block and block is not entry:
+            chains.append(chain_of[block])
+    order: List[Block] = list(chain_of[entry])
+    placed = set(order)
+    # a chain ending with the block that falls off the end of the function stays last, elsewhere
+    # that block would need a ret
+    last = chain_of[blocks[-1]]
+    if last[-1].instrs[-1].get("op") not in {"jmp", "br", "ret"} and last in chains:
+        chains.remove(last)
+    else:
+        last = []
+    while chains:
+
+        def _entered(chain: List[Block]) -> float:
+            return sum(
+                weights[(pred, block)]
+                for block in chain
+                for pred in block.predecessors
+                if pred in placed
+            )
+
+        # max keeps the first of equally weighted chains, so cold code stays in order
+        chain = max(chains, key=_entered)
+        chains.remove(chain)
+        order.extend(chain)
+        placed.update(chain)
+    order.extend(last)
+
+    # jumps to the next block fall through, blocks that fell off the end of the function return
+    for i, block in enumerate(order):
+        terminator = block.instrs[-1]
+        next_block = order[i + 1] if i + 1 < len(order) else None
+        if terminator.get("op") == "jmp" and next_block is not None:
+            if terminator["labels"] == [next_block.label]:
+                block.instrs.pop()
+        elif terminator.get("op") not in {"jmp", "br", "ret"}:
+            if next_block is not None:
+                block.instrs.append({"op": "ret", "args": []})
+
+    # labels added for unlabeled blocks that nobody jumps to
+    referenced = {
+        label
+        for block in order
+        for instr in block.instrs
+        for label in instr.get("labels", [])
+    }
+    for block in order:
+        if (
+            keys[block] == ""
+            and block.instrs
+            and block.instrs[0].get("label") not in referenced
+        ):
+            block.instrs.pop(0)
+    return [block for block in order if block.instrs]
+
+
+if __name__ == "__main__":
+    program, cli_flags = load(["-stats"], {"-profile": ""})
+
+    if program is None:
+        sys.exit(1)
+
+    profiles: Optional[Dict[str, EdgeProfile]] = None
+    if cli_flags["profile"]:
+        with open(cli_flags["profile"]) as file:
+            profiles = json.load(file)
+
+    for fi, func in enumerate(program["functions"]):
+        if profiles is not None and func["name"] not in profiles:
+            continue  # never run, any layout will do
+
+        blocks = to_cfg(func.get("instrs", []), fi)
+        if not blocks:
+            continue
+
+        jumps_before = count_jumps(blocks)
+        blocks = layout_blocks(
+            func["name"],
+            blocks,
+            profiles[func["name"]] if profiles is not None else None,
+        )
+        func["instrs"] = blocks_to_instrs(blocks)
+
+        if cli_flags["stats"]:
+            print(
+                f"{func['name']}: {jumps_before - count_jumps(blocks)} jumps removed",
+                file=sys.stderr,
+            )
+
+    print(json.dumps(program, indent=2, sort_keys=True))
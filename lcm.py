@@ -0,0 +1,376 @@
+"""
+Partial redundancy elimination by lazy code motion.
+
+Each CFG edge gets a node of its own, which splits every critical edge, and four bit-vector
+problems are solved over the pure expressions of the function:
+- anticipated: computed on every path from a point before any argument is redefined
+- will be available: anticipated, or available, on every path to a point
+- postponable: the computation can be moved down to the point from its earliest placement
+- used: the temporary holding the expression is read after a point
+An expression is computed into a temporary at the latest points it can be postponed to, where
+the temporary is used afterwards, and the computations it makes redundant copy the temporary
+instead. When every replaced computation assigns the same variable and that variable only ever
+holds the expression, it is used as the temporary and the computations are removed outright.
+
+Computations on an edge are placed at the end of its source or the start of its target when
+the edge is the only one leaving or entering it, in a new block otherwise. Division and
+int2char, which fail on some arguments, are not moved.
+
+    bril2json < prog.bril | python3 lcm.py -stats -profile prog.edges.json | brili -p
+"""
+import json
+import sys
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from block import Block, blocks_to_instrs
+from bril_type import *
+from cfg import (
+    EdgeProfile,
+    fall_through,
+    insert_before_terminator,
+    make_jumps_explicit,
+    reachable_blocks,
+    to_cfg,
+)
+from dfa import expression_key, live_variables_block
+from licm import HOISTABLE_OPS
+from loops import invalidate_loop_forest
+from utils import fresh_name, load
+
+
+def _solve(
+    flows_from: List[List[int]],
+    transfer: Callable[[int, int], int],
+    intersect: bool,
+    universe: int,
+    entry: Optional[int] = None,
+) -> Tuple[List[int], List[int]]:
+    """
+    Solve a bit-vector problem over nodes 0..n-1, where flows_from[i] are the nodes whose
+    output flows into node i (predecessors for a forward problem, successors for a backward
+    one). Nodes nothing flows into start from the empty set, and so does entry, the node of the
+    entry block in a forward problem, even when it is a loop header that back edges flow into.
+    Returns the sets flowing into and out of each node.
+    """
+    n = len(flows_from)
+    into = [0] * n
+    out = [universe if intersect else 0] * n
+    changed = True
+    while changed:
+        changed = False
+        for i in range(n):
+            if not flows_from[i] or i == entry:
+                in_set = 0
+            elif intersect:
+                in_set = universe
+                for j in flows_from[i]:
+                    in_set &= out[j]
+            else:
+                in_set = 0
+                for j in flows_from[i]:
+                    in_set |= out[j]
+            into[i] = in_set
+            out_set = transfer(i, in_set)
+            if out_set != out[i]:
+                out[i] = out_set
+                changed = True
+    return into, out
+
+
+def _start(block: Block) -> int:
+    """Index of the first instruction of block after its label and phis."""
+    i = 0
+    while i < len(block.instrs) and (
+        "label" in block.instrs[i] or block.instrs[i].get("op") == "phi"
+    ):
+        i += 1
+    return i
+
+
+def _executed(blocks: List[Block], counts: Dict[Block, int]) -> int:
+    """Instructions executed in blocks, given how many times each block is executed."""
+    return sum(
+        counts.get(block, 0) * sum("label" not in instr for instr in block.instrs)
+        for block in blocks
+    )
+
+
+def lcm(
+    func_name: str,
+    blocks: List[Block],
+    taken: Set[str],
+    profile: Optional[EdgeProfile] = None,
+) -> Tuple[List[Block], int, int, Optional[int]]:
+    """
+    Perform lazy code motion on the blocks of function func_name (blocks[0] is the entry block).
+    New variables and labels are named apart from the ones in taken. Critical edges are split
+    in place, so the cached loop forest of the function is dropped. Returns the blocks, the
+    number of computations inserted and of computations replaced, and, given the edge profile
+    of the function, the net change in the number of instructions executed.
+    """
+    invalidate_loop_forest(func_name)
+    # the labels the profile knows the blocks by, before unlabeled blocks get one
+    keys = {
+        block: block.instrs[0]["label"] if "label" in block.instrs[0] else ""
+        for block in blocks
+    }
+    counts: Dict[Block, int] = {}  # key: block, value: times executed
+    if profile is not None:
+        entered: Dict[str, int] = {}
+        for targets in profile.values():
+            for target, count in targets.items():
+                entered[target] = entered.get(target, 0) + count
+        for block in blocks:
+            counts[block] = (
+                entered.get(keys[block], 0)
+                if keys[block]
+                else sum(profile.get("", {}).values())
+            )
+    executed = _executed(blocks, counts)
+    make_jumps_explicit(blocks)
+    taken.update(block.label for block in blocks)
+
+    reachable = reachable_blocks(blocks[0])
+    real = [block for block in blocks if block in reachable]
+
+    expressions: List[tuple] = []
+    bit: Dict[tuple, int] = {}
+    types: Dict[tuple, Type] = {}
+    for block in real:
+        for instr in block.instrs:
+            key = expression_key(instr)
+            if key is not None and instr["op"] in HOISTABLE_OPS and key not in bit:
+                bit[key] = len(expressions)
+                expressions.append(key)
+                types[key] = instr["type"]
+    if not expressions:
+        blocks = fall_through(blocks)
+        change = _executed(blocks, counts) - executed if profile is not None else None
+        return blocks, 0, 0, change
+    universe = (1 << len(expressions)) - 1
+    kills: Dict[str, int] = {}  # key: var, value: expressions reading it
+    for key, i in bit.items():
+        for arg in key[1]:
+            kills[arg] = kills.get(arg, 0) | 1 << i
+
+    # nodes: the reachable blocks, then one per edge between them
+    node_of = {block: i for i, block in enumerate(real)}
+    edges: List[Tuple[Block, Block]] = [
+        (block, succ)
+        for block in real
+        for succ in sorted(block.successors)
+        if succ in reachable
+    ]
+    n = len(real) + len(edges)
+    preds: List[List[int]] = [[] for _ in range(n)]
+    succs: List[List[int]] = [[] for _ in range(n)]
+    for e, (block, succ) in enumerate(edges):
+        node = len(real) + e
+        preds[node].append(node_of[block])
+        succs[node_of[block]].append(node)
+        succs[node].append(node_of[succ])
+        preds[node_of[succ]].append(node)
+
+    # local properties, edge nodes have none
+    use = [0] * n  # computed before any argument is redefined
+    kill = [0] * n  # an argument is redefined
+    comp = [0] * n  # computed after the last redefinition of any argument
+    upward: Dict[Tuple[Block, tuple], Instruction] = {}  # computations in use
+    for block in real:
+        i = node_of[block]
+        for instr in block.instrs:
+            key = expression_key(instr)
+            if key in bit:
+                if not kill[i] >> bit[key] & 1 and not use[i] >> bit[key] & 1:
+                    use[i] |= 1 << bit[key]
+                    upward[(block, key)] = instr  # type: ignore
+                comp[i] |= 1 << bit[key]
+            if "dest" in instr:
+                kill[i] |= kills.get(instr["dest"], 0)
+                comp[i] &= ~kills.get(instr["dest"], 0)
+
+    _, anticipated_in = _solve(
+        succs, lambda i, out: use[i] | (out & ~kill[i]), True, universe
+    )
+    available_in, _ = _solve(
+        preds,
+        lambda i, in_set: ((anticipated_in[i] | in_set) & ~kill[i]) | comp[i],
+        True,
+        universe,
+        node_of[blocks[0]],
+    )
+    earliest = [anticipated_in[i] & ~available_in[i] for i in range(n)]
+    postponable_in, _ = _solve(
+        preds,
+        lambda i, in_set: (earliest[i] | in_set) & ~use[i],
+        True,
+        universe,
+        node_of[blocks[0]],
+    )
+    latest = []
+    for i in range(n):
+        postponable_succs = universe
+        for j in succs[i]:
+            postponable_succs &= earliest[j] | postponable_in[j]
+        latest.append(
+            (earliest[i] | postponable_in[i]) & (use[i] | ~postponable_succs & universe)
+        )
+    used_out, _ = _solve(
+        succs, lambda i, out: (use[i] | out) & ~latest[i], False, universe
+    )
+
+    # key: expression, value: nodes it is computed in and instructions made redundant
+    insertions: Dict[tuple, List[int]] = {}
+    replacements: Dict[tuple, List[Tuple[Block, Instruction]]] = {}
+    for key, b in bit.items():
+        for i in range(n):
+            if (latest[i] & used_out[i]) >> b & 1:
+                insertions.setdefault(key, []).append(i)
+        for block in real:
+            i = node_of[block]
+            if (use[i] & ~(latest[i] & ~used_out[i])) >> b & 1:
+                replacements.setdefault(key, []).append((block, upward[(block, key)]))
+
+    live_in, _ = live_variables_block(blocks)
+
+    def _live_at(node: int) -> Set[str]:
+        return live_in[real[node] if node < len(real) else edges[node - len(real)][1]]
+
+    defs: Dict[str, Set[tuple]] = {}  # key: var, value: the expressions assigned to it
+    for block in blocks:
+        for instr in block.instrs:
+            if "dest" in instr:
+                defs.setdefault(instr["dest"], set()).add(expression_key(instr))  # type: ignore
+
+    # key: node, value: computations to insert there
+    inserted: Dict[int, List[Instruction]] = {}
+    removed: Set[int] = set()  # ids of the replaced instructions that are dropped
+    # key: id of a replaced computation, value: the copy of the temporary replacing it
+    copies: Dict[int, Instruction] = {}
+    for key in sorted(insertions, key=bit.__getitem__):
+        dests = {instr["dest"] for _, instr in replacements.get(key, [])}
+        (dest,) = dests if len(dests) == 1 else (None,)
+        if (
+            dest is not None
+            and defs[dest] == {key}
+            and dest not in key[1]
+            and all(dest not in _live_at(i) for i in insertions[key])
+        ):
+            # the variable already only holds the expression, it is the temporary
+            temp = dest
+            for _, instr in replacements[key]:
+                removed.add(id(instr))
+        else:
+            temp = fresh_name(f"{sorted(dests)[0] if dests else key[0]}.lcm", taken)
+            for _, instr in replacements.get(key, []):
+                copies[id(instr)] = {
+                    "dest": instr["dest"],
+                    "op": "id",
+                    "type": instr["type"],
+                    "args": [temp],
+                }
+        for i in insertions[key]:
+            inserted.setdefault(i, []).append(
+                {"dest": temp, "op": key[0], "type": types[key], "args": list(key[1])}
+            )
+    for block in real:
+        block.instrs = [
+            copies.get(id(instr), instr)
+            for instr in block.instrs
+            if id(instr) not in removed
+        ]
+
+    # materialize the computations
+    new_blocks: Dict[
+        Block, List[Block]
+    ] = {}  # key: block, value: split blocks before it
+    for i, instrs in sorted(inserted.items()):
+        if i < len(real):
+            block = real[i]
+            start = _start(block)
+            block.instrs[start:start] = instrs
+            continue
+        block, succ = edges[i - len(real)]
+        if len(block.successors) == 1:
+            for instr in instrs:
+                insert_before_terminator(block, instr)
+        elif len(succ.predecessors) == 1:
+            start = _start(succ)
+            succ.instrs[start:start] = instrs
+        else:
+            label = fresh_name(f"{block.label}.{succ.label}", taken)
+            split = Block(
+                id=f"{blocks[0].id.split('-')[0]}-{len(blocks) + len(new_blocks)}",
+                label=label,
+                predecessors={block},
+                successors={succ},
+                instrs=[Instruction(label=label)]
+                + instrs
+                + [{"op": "jmp", "labels": [succ.label]}],
+            )
+            block.instrs[-1]["labels"] = [
+                label if target == succ.label else target
+                for target in block.instrs[-1]["labels"]
+            ]
+            for instr in succ.instrs:
+                if instr.get("op") == "phi":
+                    instr["labels"] = [
+                        label if source == block.label else source
+                        for source in instr["labels"]
+                    ]
+            if profile is not None:
+                counts[split] = profile.get(keys[block], {}).get(keys[succ], 0)
+            new_blocks.setdefault(succ, []).append(split)
+
+    ordered: List[Block] = []
+    for block in blocks:
+        ordered.extend(new_blocks.get(block, []))
+        ordered.append(block)
+
+    n_inserted = sum(len(instrs) for instrs in inserted.values())
+    n_replaced = len(removed) + len(copies)
+    ordered = fall_through(ordered)
+    change = _executed(ordered, counts) - executed if profile is not None else None
+    return ordered, n_inserted, n_replaced, change
+
+
+if __name__ == "__main__":
+    program, cli_flags = load(["-stats"], {"-profile": ""})
+
+    if program is None:
+        sys.exit(1)
+
+    profiles: Optional[Dict[str, EdgeProfile]] = None
+    if cli_flags["profile"]:
+        with open(cli_flags["profile"]) as file:
+            profiles = json.load(file)
+
+    total_change = 0
+    for fi, func in enumerate(program["functions"]):
+        blocks = to_cfg(func.get("instrs", []), fi)
+        if not blocks:
+            continue
+
+        taken = {arg["name"] for arg in func.get("args", [])}
+        for instr in func.get("instrs", []):
+            taken.update(instr.get("args", []))
+            if "dest" in instr:
+                taken.add(instr["dest"])
+            if "label" in instr:
+                taken.add(instr["label"])
+
+        profile = profiles.get(func["name"], {}) if profiles is not None else None
+        blocks, inserted, replaced, change = lcm(func["name"], blocks, taken, profile)
+        func["instrs"] = blocks_to_instrs(blocks)
+
+        if cli_flags["stats"]:
+            stats = f"{func['name']}: {inserted} inserted, {replaced} replaced"
+            if change is not None:
+                stats += f", {change:+} instructions executed"
+                total_change += change
+            print(stats, file=sys.stderr)
+
+    if cli_flags["stats"] and profiles is not None:
+        print(f"total: {total_change:+} instructions executed", file=sys.stderr)
+
+    print(json.dumps(program, indent=2, sort_keys=True))
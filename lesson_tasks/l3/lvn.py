@@ -1,113 +1,157 @@
 import json
 import sys
-from collections import defaultdict
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 from .blocks import Block, func_to_blocks
 from .tdce import get_globally_used_vars, tdce
 
-from bril_type import Instruction
+from bril_type import Instruction, Literal
+from defuse import DefUseIndex
+from fold import PURE_OPS, canonicalize, const_key, fold, simplify
 from utils import flatten, load
 
 
-def lvn(block: Block):
-    """Mutates the block to perform LVN on it."""
+def lvn(block: Block) -> int:
+    """
+    Mutates the block to perform LVN on it: recomputed values become copies of the var that
+    holds them, copies are propagated, expressions with constant arguments are folded and
+    algebraic identities (x + 0, x * 1, ...) are applied. Returns the number of instructions
+    rewritten.
+    """
     num2val: List[tuple] = []  # Maps row entry number to value tuple
     var2num: Dict[str, int] = {}  # Maps var names to their row number
-    num2vars: Dict[
-        int, str
-    ] = {}  # Maps row numbers to var, note row can point to many vars
-    table: Dict[tuple, str] = {}  # Maps value tuples to canonical vars
-
-    # Maps instruction indices to var names (to take ID from)
-    to_replace: Dict[int, str] = defaultdict(dict)  # type: ignore
-
-    def instr_to_tuple(instr: Instruction) -> tuple:
-        # TODO: Add canonicalization of the tuple (e.g., sort args)
-        # (add, 1, 2) == (add, 2, 1)
-        if "op" not in instr:
-            return ()
-
-        if instr["op"] == "const":
-            return ("const", instr.get("value"))
-        elif instr["op"] == "id":
-            return ("id", instr.get("args", [""])[0])
-
-        value = [instr["op"]]
-        if "args" in instr:
-            for arg in instr.get("args", []):
-                try:
-                    value.append(var2num[arg])  # type: ignore
-                except:
-                    value.append(arg)
-
-        return tuple(value)
-
-    def get_dest_replaced_arr(block: Block):
-        """Pre-compute if an instr at i will be overwritten later"""
-        num_instrs = len(block)
-        dest_replaced_arr = [False] * num_instrs
-        vars_so_far = set()
-        for ii in range(num_instrs - 1, -1, -1):
-            instr = block[ii]
-            if "dest" in instr:
-                dest_replaced_arr[ii] = instr["dest"] in vars_so_far
-                vars_so_far.add(instr["dest"])
-        return dest_replaced_arr
-
-    dest_will_be_replaced = get_dest_replaced_arr(block)
+    num2var: Dict[
+        int, Optional[str]
+    ] = {}  # Maps row numbers to the canonical var, None once it is overwritten
+    var2home: Dict[str, int] = {}  # Maps canonical vars to their row number
+    num2const: Dict[int, Literal] = {}  # Maps row numbers of constants to their value
+    table: Dict[tuple, int] = {}  # Maps value tuples to row numbers
+    renamed: Dict[str, str] = {}  # Maps vars to the name of their latest definition
+
+    def new_num(value: tuple) -> int:
+        num2val.append(value)
+        return len(num2val) - 1
+
+    def var_num(var: str) -> int:
+        if var not in var2num:
+            # defined before the block, the var itself holds the value
+            num = new_num(("var", var))
+            var2num[var] = num
+            num2var[num] = var
+            var2home[var] = num
+        return var2num[var]
+
+    def holder(var: str) -> str:
+        """A var that holds the current value of var in the rewritten block."""
+        home = num2var.get(var_num(var))
+        return home if home is not None else renamed.get(var, var)
+
+    # an instr's dest will be overwritten later in the block unless it is the last definition
+    index = DefUseIndex.from_instrs(block)
+    dest_will_be_replaced = [
+        "dest" in instr and index.last_definition(instr["dest"]) is not instr
+        for instr in block
+    ]
+    changed = 0
 
     for ii, instr in enumerate(block):
         if "op" not in instr:
             continue  # Skip labels
 
-        try:
-            arg_ids = tuple(var2num[var] for var in instr.get("args", []))
-            if "args" in instr:
-                instr["args"] = [num2vars[n] for n in arg_ids]
-        except KeyError:
-            pass
-
-        value = instr_to_tuple(instr)
-        # print(value)
-
-        if value in table:
-            # The value has been computed before; reuse it.
-            var = table[value]
-            to_replace[ii] = var
-            var2num[instr.get("dest", "")] = var2num[var]
+        op = instr["op"]
+        if op == "phi":
+            # args are read at the end of the predecessors, not in this block
+            nums: Tuple[int, ...] = ()
         else:
-            # A newly computed value.
-            if "dest" in instr:
-                dest = instr["dest"]
-                num2val.append(value)
-                curr_num = len(num2val) - 1
-                var2num[dest] = curr_num
-
-                if dest_will_be_replaced[ii]:
-                    dest = f"{dest}_v{curr_num}"
-                    instr["dest"] = dest
-                else:
-                    dest = instr["dest"]
-
-                num2vars[curr_num] = dest
-                table[value] = dest
-                var2num[dest] = curr_num
-
-                for ai, arg in enumerate(instr.get("args", [])):
-                    try:
-                        instr["args"][ai] = table[num2val[var2num[arg]]]
-                    except KeyError:
-                        pass
-
-    # Replace all flagged copy propagations
-    for ii in range(len(block)):
-        if ii in to_replace and "dest" in block[ii]:
-            block[ii] = {  # type: ignore
-                "dest": block[ii].get("dest"),
+            nums = tuple(var_num(arg) for arg in instr.get("args", []))
+            if "args" in instr:
+                instr["args"] = [holder(arg) for arg in instr["args"]]
+
+        if "dest" not in instr:
+            continue
+
+        # the instruction's value is a copy of an arg, a constant, or a value tuple
+        copy_of: Optional[int] = None  # index of the copied arg
+        const: Optional[Literal] = None
+        value: Optional[tuple] = None
+        if op == "id":
+            copy_of = 0
+        elif op == "const":
+            const = instr["value"]
+        elif op in PURE_OPS:
+            consts = [num2const.get(num) for num in nums]
+            if all(c is not None for c in consts):
+                const = fold(op, consts)  # type: ignore
+            if const is None:
+                simplified = simplify(op, nums, consts)
+                if simplified is not None:
+                    kind, result = simplified
+                    if kind == "arg":
+                        copy_of = result  # type: ignore
+                    else:
+                        const = result
+            if const is None and copy_of is None:
+                value = canonicalize(op, nums)
+        if const is not None:
+            value = const_key(instr["type"], const)
+
+        # the row of a value computed before, if a var still holds it
+        num: Optional[int] = None
+        if copy_of is not None:
+            num = nums[copy_of]
+        elif value is not None and value in table:
+            num = table[value]
+
+        dest = instr["dest"]
+        if num is not None and num in num2const:
+            new_instr: Instruction = {
+                "dest": dest,
+                "op": "const",
+                "type": instr["type"],
+                "value": num2const[num],
+            }
+        elif num is not None and (num2var.get(num) is not None or copy_of is not None):
+            home = num2var.get(num)
+            new_instr = {
+                "dest": dest,
                 "op": "id",
-                "args": [to_replace[ii]],
+                "type": instr["type"],
+                "args": [home if home is not None else instr["args"][copy_of]],  # type: ignore
             }
+        else:
+            # A newly computed value.
+            num = new_num(value if value is not None else ("unique", ii))
+            if value is not None:
+                table[value] = num
+            if const is not None:
+                num2const[num] = const
+                new_instr = {
+                    "dest": dest,
+                    "op": "const",
+                    "type": instr["type"],
+                    "value": const,
+                }
+            else:
+                new_instr = instr
+
+        if dest_will_be_replaced[ii]:
+            new_instr["dest"] = f"{dest}_v{num}"
+        if new_instr is not instr or new_instr["dest"] != dest:
+            changed += 1
+
+        # the var assigned here no longer holds the value it was canonical for
+        overwritten = var2home.pop(new_instr["dest"], None)
+        if overwritten is not None:
+            num2var[overwritten] = None
+        if num2var.get(num) is None:
+            num2var[num] = new_instr["dest"]
+            var2home[new_instr["dest"]] = num
+
+        var2num[dest] = num
+        renamed[dest] = new_instr["dest"]
+        block[ii] = new_instr
+
+    return changed
 
 
 if __name__ == "__main__":
@@ -121,7 +165,7 @@ if __name__ == "__main__":
         new_instrs = []
 
         for block in basic_blocks:
-            block_changed = lvn(block)
+            lvn(block)
             new_instrs.append(block)
 
         program["functions"][fi]["instrs"] = flatten(new_instrs)
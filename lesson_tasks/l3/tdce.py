@@ -7,6 +7,8 @@ from typing import Dict
 
 from .blocks import Block, func_to_blocks
 
+from dce import dce_func
+from defuse import DefUseIndex
 from utils import flatten, load
 
 
@@ -14,14 +16,7 @@ def get_globally_used_vars(blocks: list[Block]) -> set[str]:
     """
     Return a set of all variables used in the program.
     """
-    used_vars = set()
-
-    for block in blocks:
-        for instr in block:
-            if "args" in instr:
-                used_vars.update(instr["args"])
-
-    return used_vars
+    return DefUseIndex.from_instrs(flatten(blocks)).used_vars()
 
 
 def tdce(
@@ -69,25 +64,15 @@ def tdce(
 
 
 if __name__ == "__main__":
-    program, _ = load()
+    program, cli_flags = load(["-aggressive"])
 
     if program is None:
         sys.exit(1)
 
+    # A single mark and sweep pass over use-def chains in SSA form reaches the result that
+    # iterating tdce to a fixpoint would, without re-splitting every function each round
     total_lines_eliminated = 0
-    while True:
-        lines_eliminated = 0
-        for fi, func in enumerate(program["functions"]):
-            basic_blocks = func_to_blocks(func)
-            new_instrs, lines_elim_in_block = tdce(
-                basic_blocks, get_globally_used_vars(basic_blocks)
-            )
-            program["functions"][fi]["instrs"] = flatten(new_instrs)
-
-            lines_eliminated += lines_elim_in_block
-            # TODO: Measure the performance of dead code elimination
-
-        if lines_eliminated == 0:
-            break
+    for fi, func in enumerate(program["functions"]):
+        total_lines_eliminated += dce_func(func, fi, cli_flags["aggressive"])
 
     json.dump(program, sys.stdout, indent=2)
@@ -1,12 +1,61 @@
 """
 This module contains functions that validate the dominator relationships between blocks in a CFG.
+
+Dominance is checked with a reachability oracle: A dominates B iff B cannot be reached from the
+entry node once A is removed from the graph. Each query is a single graph traversal, so the
+validator stays polynomial on loops and branchy code where enumerating paths would not terminate.
+
+Post-dominance is checked the same way on the reversed CFG: A post-dominates B iff no exit block
+can be reached from B once A is removed.
+
+Run as a script to fuzz `dominator._get_dominators`, the block-level immediate dominators and
+dominance frontiers, post-dominators and control dependence against the oracle on random CFGs
+    python3 -m lesson_tasks.l5.validate_dominators -n 5000 --max-nodes 16
 """
-from typing import List, Set
+import argparse
+import random
+import sys
 from collections import deque
+from typing import Dict, List, Optional, Set, Tuple, TypeVar
 
+from block import Block
 from bril_type import *
+from dominator import (
+    _get_dominators,
+    control_dependence_block,
+    dominance_frontiers_block,
+    dominators_from_idoms,
+    get_immediate_dominators_block,
+    get_immediate_post_dominators_block,
+)
 from node import Node
 
+T = TypeVar("T", Node, Block)
+
+
+def _reachable(entry_node: T, removed: Optional[T] = None) -> Set[T]:
+    """
+    Return the set of nodes reachable from entry_node without passing through removed.
+    """
+    if entry_node == removed:
+        return set()
+
+    seen: Set[T] = {entry_node}
+    q: deque[T] = deque([entry_node])
+    while q:
+        node = q.popleft()
+        for succ in node.successors:
+            if succ not in seen and succ != removed:
+                seen.add(succ)
+                q.append(succ)
+
+    return seen
+
+
+def _validate_entry(cfg_nodes: Set[T], entry_node: T) -> None:
+    if entry_node not in cfg_nodes or len(entry_node.predecessors) != 0:
+        raise Exception("Invalid entry node")
+
 
 def validate_dominators(
     cfg_nodes: List[Node],
@@ -17,31 +66,24 @@ def validate_dominators(
     """
     Return true if node_a dominates node_b.
 
-    A dominator is a node that is on every path from the entry node to a given node.
+    A dominator is a node that is on every path from the entry node to a given node, i.e. node_b
+    is unreachable from the entry node when node_a is removed.
     """
+    all_nodes = set(cfg_nodes)
+
     # validate entry node
-    if entry_node not in cfg_nodes or len(entry_node.predecessors) != 0:
-        raise Exception("Invalid entry node")
+    _validate_entry(all_nodes, entry_node)
 
     # validate node_a and node_b
-    if node_a not in cfg_nodes:
+    if node_a not in all_nodes:
         raise Exception("Invalid node_a")
-    if node_b not in cfg_nodes:
+    if node_b not in all_nodes:
         raise Exception("Invalid node_b")
 
-    paths: Set[List[Node]] = set()
-    q: deque[List[Node]] = deque([[entry_node]])
+    if node_a == node_b:
+        return True
 
-    while q:
-        path = q.popleft()
-        last_node = path[-1]
-        if last_node == node_b:
-            paths.add(path)
-        elif len(last_node.successors) != 0:
-            for next_node in last_node.successors:
-                q.append(path + [next_node])
-
-    return all(node_a in path for path in paths)
+    return node_b not in _reachable(entry_node, removed=node_a)
 
 
 def validate_strictly_dominates(
@@ -58,3 +100,262 @@ def validate_strictly_dominates(
     return (
         validate_dominators(cfg_nodes, entry_node, node_a, node_b) and node_a != node_b
     )
+
+
+def find_dominator_mismatches(
+    cfg_nodes: List[T],
+    entry_node: T,
+    doms: Dict[T, Set[T]],
+) -> List[Tuple[T, T]]:
+    """
+    Check a computed mapping of nodes to their dominators against the reachability oracle.
+
+    Returns every pair (A, B) of reachable nodes where the mapping disagrees with the oracle on
+    whether A dominates B. Runs one traversal per node, i.e. O(N * (N + E)).
+    """
+    all_nodes = set(cfg_nodes)
+    _validate_entry(all_nodes, entry_node)
+
+    reachable = _reachable(entry_node)
+    mismatches: List[Tuple[T, T]] = []
+
+    if set(doms.keys()) != reachable:
+        # nodes missing from (or wrongly present in) the mapping disagree with themselves
+        mismatches.extend((n, n) for n in sorted(reachable ^ set(doms.keys())))
+
+    for node_a in sorted(reachable):
+        reachable_without_a = _reachable(entry_node, removed=node_a)
+        for node_b in sorted(reachable & set(doms.keys())):
+            expected = node_a == node_b or node_b not in reachable_without_a
+            if expected != (node_a in doms[node_b]):
+                mismatches.append((node_a, node_b))
+
+    return mismatches
+
+
+def validate_dominator_map(
+    cfg_nodes: List[Node],
+    entry_node: Node,
+    doms: Dict[Node, Set[Node]],
+) -> bool:
+    """
+    Return true if doms maps every reachable node to exactly its set of dominators.
+    """
+    return len(find_dominator_mismatches(cfg_nodes, entry_node, doms)) == 0
+
+
+def find_frontier_mismatches(
+    blocks: List[Block], frontiers: Dict[Block, Set[Block]]
+) -> List[Tuple[Block, Block]]:
+    """
+    Check computed dominance frontiers against the reachability oracle.
+
+    B is in the frontier of A iff A dominates a predecessor of B but does not strictly dominate
+    B. Returns every pair (A, B) of reachable blocks where frontiers disagrees.
+    """
+    entry_block = blocks[0]
+    reachable = _reachable(entry_block)
+    dominated = {
+        block: reachable - _reachable(entry_block, removed=block) for block in reachable
+    }
+
+    mismatches: List[Tuple[Block, Block]] = []
+    for block_a in sorted(reachable):
+        for block_b in sorted(reachable):
+            expected = any(
+                pred in dominated[block_a] for pred in block_b.predecessors
+            ) and (block_a == block_b or block_b not in dominated[block_a])
+            if expected != (block_b in frontiers.get(block_a, set())):
+                mismatches.append((block_a, block_b))
+
+    return mismatches
+
+
+def _post_dominates(block_a: Block, block_b: Block) -> bool:
+    """
+    Return true if every path from block_b to an exit block passes through block_a.
+    """
+    return block_a == block_b or not any(
+        len(block.successors) == 0 for block in _reachable(block_b, removed=block_a)
+    )
+
+
+def find_post_dominator_mismatches(
+    blocks: List[Block],
+    ipdom: Dict[Optional[Block], Optional[Block]],
+    deps: Dict[Block, Set[Block]],
+) -> List[Tuple[str, Block]]:
+    """
+    Check computed immediate post-dominators and control dependences against the oracle, on the
+    reachable blocks that can reach an exit.
+
+    B is control dependent on A iff B post-dominates a successor of A but does not strictly
+    post-dominate A. Returns ("ipdom", B) or ("deps", B) for every block B that disagrees.
+    """
+    reachable = _reachable(blocks[0])
+    exiting = {
+        block
+        for block in reachable
+        if any(len(other.successors) == 0 for other in _reachable(block))
+    }
+
+    mismatches: List[Tuple[str, Block]] = []
+    computed = {block for block in ipdom.keys() if block in reachable}
+    if computed != exiting:
+        mismatches.extend(("ipdom", block) for block in sorted(exiting ^ computed))
+
+    for block_b in sorted(exiting):
+        strict = [
+            block
+            for block in exiting
+            if block != block_b and _post_dominates(block, block_b)
+        ]
+        # the closest strict post-dominator is post-dominated by all the others
+        closest = [
+            block
+            for block in strict
+            if all(_post_dominates(other, block) for other in strict)
+        ]
+        if ipdom.get(block_b, block_b) != (closest[0] if closest else None):
+            mismatches.append(("ipdom", block_b))
+
+        expected = {
+            block_a
+            for block_a in exiting
+            if any(
+                succ in exiting and _post_dominates(block_b, succ)
+                for succ in block_a.successors
+            )
+            and (block_a == block_b or not _post_dominates(block_b, block_a))
+        }
+        if deps.get(block_b, set()) & reachable != expected:
+            mismatches.append(("deps", block_b))
+
+    return mismatches
+
+
+def _add_random_edges(rng: random.Random, nodes: List[T], edge_prob: float) -> None:
+    """
+    Give every node up to two successors (like a `br`). Edges may point backwards to form loops
+    and some nodes may be left unreachable. No edge ever targets the first node.
+    """
+    for node in nodes:
+        for _ in range(2):
+            if len(nodes) > 1 and rng.random() < edge_prob:
+                succ = nodes[rng.randrange(1, len(nodes))]
+                node.successors.add(succ)
+                succ.predecessors.add(node)
+
+
+def random_cfg(
+    rng: random.Random, num_nodes: int, edge_prob: float, fi: int = 0
+) -> List[Node]:
+    """
+    Build a random fine-grained CFG with num_nodes nodes. The first node is the entry node.
+    """
+    nodes = [
+        Node(
+            id=f"f{fi}-{ii}",
+            predecessors=set(),
+            successors=set(),
+            instr={"op": "nop"},
+            label=None,
+        )
+        for ii in range(num_nodes)
+    ]
+    _add_random_edges(rng, nodes, edge_prob)
+    return nodes
+
+
+def random_block_cfg(
+    rng: random.Random, num_blocks: int, edge_prob: float, fi: int = 0
+) -> List[Block]:
+    """
+    Build a random basic block CFG with num_blocks blocks. The first block is the entry block.
+    """
+    blocks = [
+        Block(
+            id=f"f{fi}-{ii}",
+            label=f"b{ii}",
+            predecessors=set(),
+            successors=set(),
+            instrs=[{"label": f"b{ii}"}],
+        )
+        for ii in range(num_blocks)
+    ]
+    _add_random_edges(rng, blocks, edge_prob)
+    return blocks
+
+
+def fuzz(num_cases: int, max_nodes: int, seed: int) -> int:
+    """
+    Compare `_get_dominators` on random fine-grained CFGs, and the immediate dominators,
+    dominance frontiers, immediate post-dominators and control dependences on random block CFGs,
+    against the reachability oracle on num_cases random CFGs each.
+
+    Returns the number of failing cases, printing the first few that fail.
+    """
+    rng = random.Random(seed)
+    failures = 0
+
+    for case in range(num_cases):
+        num_nodes = rng.randint(1, max_nodes)
+        edge_prob = rng.uniform(0.3, 0.9)
+        nodes = random_cfg(rng, num_nodes, edge_prob)
+        blocks = random_block_cfg(rng, num_nodes, edge_prob)
+        entry_block = blocks[0]
+
+        idom = get_immediate_dominators_block(entry_block)
+        mismatches = [
+            (f"dominators {a.id}", b.id)
+            for a, b in find_dominator_mismatches(
+                nodes, nodes[0], _get_dominators(nodes[0])
+            )
+        ]
+        mismatches += [
+            (f"idom {a.id}", b.id)
+            for a, b in find_dominator_mismatches(
+                blocks, entry_block, dominators_from_idoms(idom)
+            )
+        ]
+        mismatches += [
+            (f"frontier {a.id}", b.id)
+            for a, b in find_frontier_mismatches(
+                blocks, dominance_frontiers_block(entry_block, idom)
+            )
+        ]
+        mismatches += [
+            (kind, block.id)
+            for kind, block in find_post_dominator_mismatches(
+                blocks,
+                get_immediate_post_dominators_block(entry_block),
+                control_dependence_block(entry_block),
+            )
+        ]
+        if mismatches:
+            failures += 1
+            if failures <= 5:
+                node_edges = [(n.id, s.id) for n in nodes for s in sorted(n.successors)]
+                block_edges = [
+                    (b.id, s.id) for b in blocks for s in sorted(b.successors)
+                ]
+                print(
+                    f"Case {case} failed (edges: {node_edges}, blocks: {block_edges})"
+                )
+                print(f"  mismatches: {mismatches}")
+
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(exit_on_error=True)
+    parser.add_argument("-n", type=int, default=1000, help="number of random CFGs")
+    parser.add_argument("--max-nodes", type=int, default=12, help="max nodes per CFG")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    args = parser.parse_args()
+
+    failures = fuzz(args.n, args.max_nodes, args.seed)
+    print(f"{args.n - failures}/{args.n} random CFGs passed")
+
+    if failures:
+        sys.exit(1)
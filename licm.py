@@ -0,0 +1,212 @@
+"""
+Loop-invariant code motion on the basic block CFG.
+
+For every natural loop, innermost first, pure instructions whose arguments are defined outside
+the loop (or by instructions hoisted already) are moved into the loop's preheader, which is
+created if the loop does not have one. An instruction is only hoisted if it is the single
+definition of its variable in the loop and its variable is not live into the header, so every use
+in the loop reads it. Its block must also dominate every block the loop can be left from, so it
+runs before the loop exits anyway, or its variable must be dead after the loop: hoisted
+instructions have no effects, executing one the original program skips is harmless.
+
+    bril2json < prog.bril | python3 licm.py | brili -p
+"""
+import json
+import sys
+from typing import Dict, List, Set
+
+from block import Block, blocks_to_instrs
+from bril_type import *
+from cfg import reverse_postorder, to_cfg
+from dfa import live_variables_block
+from dominator import dominates, get_immediate_dominators_block
+from fold import PURE_OPS
+from loops import Loop, get_loop_forest, invalidate_loop_forest
+from utils import fresh_name, load
+
+# operations that can be executed before the loop without changing the program's behavior,
+# division and int2char are left out since they fail at runtime on some arguments
+HOISTABLE_OPS = (PURE_OPS - {"div", "int2char"}) | {"const", "id"}
+
+
+def _hoistable_instrs(blocks: List[Block], loop: Loop) -> List[Instruction]:
+    """
+    Return the instructions of loop that can be hoisted into its preheader, in the order they
+    have to be executed in.
+    """
+    idom = get_immediate_dominators_block(blocks[0])
+    live_in, _ = live_variables_block(blocks)
+
+    # key: var, value: number of definitions in the loop
+    loop_defs: Dict[str, int] = {}
+    for block in loop.body:
+        for instr in block.instrs:
+            if "dest" in instr:
+                loop_defs[instr["dest"]] = loop_defs.get(instr["dest"], 0) + 1
+
+    # variables read after leaving the loop
+    live_at_exits: Set[str] = set()
+    for exit_block in loop.exits:
+        live_at_exits |= live_in[exit_block]
+        for instr in exit_block.instrs:
+            if instr.get("op") == "phi":
+                live_at_exits.update(instr["args"])
+
+    # in reverse postorder, so definitions are visited before the uses they dominate
+    candidates = [
+        block
+        for block in reverse_postorder(blocks[0], lambda b: sorted(b.successors))
+        if block in loop.body
+    ]
+    # blocks that run before the loop is left
+    dominate_exits = {
+        block
+        for block in candidates
+        if all(dominates(block, exiting, idom) for exiting in loop.exiting)
+    }
+
+    hoisted: List[Instruction] = []
+    hoisted_dests: Set[str] = set()
+    changed = True
+    while changed:
+        changed = False
+        for block in candidates:
+            for instr in block.instrs:
+                dest = instr.get("dest")
+                if (
+                    dest is not None
+                    and instr.get("op") in HOISTABLE_OPS
+                    and dest not in hoisted_dests
+                    and loop_defs[dest] == 1
+                    and dest not in live_in[loop.header]
+                    and (block in dominate_exits or dest not in live_at_exits)
+                    and all(
+                        arg not in loop_defs or arg in hoisted_dests
+                        for arg in instr.get("args", [])
+                    )
+                ):
+                    hoisted.append(instr)
+                    hoisted_dests.add(dest)
+                    changed = True
+
+    return hoisted
+
+
+def _insert_preheader(
+    blocks: List[Block], loop: Loop, fi: int, instrs: List[Instruction]
+) -> bool:
+    """
+    Add instrs to the end of the preheader of loop, creating the preheader if the loop does not
+    have one. Returns false if no preheader can be created.
+    """
+    header = loop.header
+    if loop.preheader is not None:
+        preheader = loop.preheader
+        if preheader.instrs and preheader.instrs[-1].get("op") == "jmp":
+            preheader.instrs[-1:-1] = instrs
+        else:
+            preheader.instrs.extend(instrs)
+        return True
+
+    if "label" not in header.instrs[0]:
+        return False
+
+    outside_preds = [pred for pred in header.predecessors if pred not in loop.body]
+    phis = [instr for instr in header.instrs if instr.get("op") == "phi"]
+    if phis and len(outside_preds) > 1:
+        return False  # the incoming values would have to be merged in the preheader
+
+    name = fresh_name(f"{header.label}.preheader", {block.label for block in blocks})
+    preheader = Block(
+        id=f"f{fi}-{len(blocks)}",
+        label=name,
+        predecessors=set(outside_preds),
+        successors={header},
+        instrs=[Instruction(label=name)] + instrs,
+    )
+
+    # edges from outside the loop go to the preheader instead
+    for pred in outside_preds:
+        terminator = pred.instrs[-1]
+        if terminator.get("op") in {"jmp", "br"}:
+            terminator["labels"] = [
+                name if label == header.label else label
+                for label in terminator["labels"]
+            ]
+        for phi in phis:
+            phi["labels"] = [
+                name if label == pred.label else label for label in phi["labels"]
+            ]
+
+    # the preheader is placed right before the header, so a latch falling through into the
+    # header has to jump over it
+    index = blocks.index(header)
+    if index > 0:
+        prev = blocks[index - 1]
+        if prev in loop.body and (
+            not prev.instrs or prev.instrs[-1].get("op") not in {"jmp", "br", "ret"}
+        ):
+            prev.instrs.append({"op": "jmp", "labels": [header.label]})
+    blocks.insert(index, preheader)
+    return True
+
+
+def licm(func: Function, fi: int) -> int:
+    """
+    Mutates func to hoist loop-invariant instructions out of its loops. Returns the number of
+    instructions hoisted, an instruction hoisted out of several nested loops counts once per
+    loop.
+    """
+    hoisted_total = 0
+    done: Set[str] = set()  # labels of the headers of the loops processed so far
+    func_name = func.get("name", f"f{fi}")
+    blocks = to_cfg(func.get("instrs", []), fi)
+    if not blocks:
+        return 0
+
+    # the CFG and its analyses are rebuilt after each loop that changes, so the preheader of an
+    # inner loop is part of the outer loops when they are processed
+    while True:
+        loops = [
+            loop
+            for loop in get_loop_forest(func_name, blocks).loops
+            if loop.header.label not in done
+        ]
+        if not loops:
+            return hoisted_total
+        loop = loops[0]  # innermost first
+        done.add(loop.header.label)
+
+        hoisted = _hoistable_instrs(blocks, loop)
+        if not hoisted:
+            continue
+
+        hoisted_ids = {id(instr) for instr in hoisted}
+        kept = {
+            block: [instr for instr in block.instrs if id(instr) not in hoisted_ids]
+            for block in loop.body
+        }
+        if not _insert_preheader(blocks, loop, fi, hoisted):
+            continue
+        for block, instrs in kept.items():
+            block.instrs = instrs
+
+        func["instrs"] = blocks_to_instrs(blocks)
+        hoisted_total += len(hoisted)
+        invalidate_loop_forest(func_name)
+        blocks = to_cfg(func["instrs"], fi)
+
+
+if __name__ == "__main__":
+    program, cli_flags = load(["-stats"])
+
+    if program is None:
+        sys.exit(1)
+
+    for fi, func in enumerate(program["functions"]):
+        hoisted = licm(func, fi)
+
+        if cli_flags["stats"]:
+            print(f"{func.get('name', f'f{fi}')}: {hoisted} hoisted", file=sys.stderr)
+
+    print(json.dumps(program, indent=2, sort_keys=True))
@@ -0,0 +1,231 @@
+"""
+Natural loop analysis on the basic block CFG.
+
+Finds back edges (edges whose target dominates their source), the natural loop of every loop
+header, preheaders, exits and the loop nesting forest. Cycles entered at more than one block
+are not natural loops and are reported as irreducible regions instead.
+
+    bril2json < prog.bril | python3 loops.py
+"""
+import sys
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from block import Block
+from bril_type import *
+from cfg import to_cfg
+from dominator import dominates, get_immediate_dominators_block
+from utils import load
+
+
+class Loop:
+    header: Block
+    latches: Set[Block]  # sources of the back edges to the header
+    body: Set[Block]  # blocks in the loop, including the header and latches
+    exiting: Set[Block]  # blocks in the loop with a successor outside of it
+    exits: Set[Block]  # blocks outside the loop with a predecessor inside it
+    preheader: Optional[Block]  # sole entry into the header from outside, if any
+    parent: Optional["Loop"]
+    children: List["Loop"]
+    depth: int  # 1 for outermost loops
+
+    def __init__(self, header: Block, latches: Set[Block], body: Set[Block]) -> None:
+        self.header = header
+        self.latches = latches
+        self.body = body
+        self.exiting = {b for b in body if any(s not in body for s in b.successors)}
+        self.exits = {s for b in self.exiting for s in b.successors if s not in body}
+        self.preheader = _find_preheader(header, body)
+        self.parent = None
+        self.children = []
+        self.depth = 1
+
+    def __str__(self):
+        return f"Loop({self.header.label})"
+
+    def __repr__(self):
+        return f"Loop({self.header.label})"
+
+    def __hash__(self):
+        return hash(self.header)
+
+    def __eq__(self, other):
+        return isinstance(other, Loop) and self.header == other.header
+
+    def contains(self, block: Block) -> bool:
+        return block in self.body
+
+
+class LoopForest:
+    loops: List[Loop]  # innermost loops first
+    top_level: List[Loop]
+    block_to_loop: Dict[Block, Loop]  # innermost loop containing each block
+    irreducible: List[Set[Block]]  # cycles with more than one entry
+
+    def __init__(self, loops: List[Loop], irreducible: List[Set[Block]]) -> None:
+        self.loops = loops
+        self.top_level = [loop for loop in loops if loop.parent is None]
+        self.irreducible = irreducible
+
+        self.block_to_loop = {}
+        for loop in reversed(loops):  # outermost first, inner loops overwrite
+            for block in loop.body:
+                self.block_to_loop[block] = loop
+
+    def loop_of(self, block: Block) -> Optional[Loop]:
+        """Return the innermost loop containing block, if any."""
+        return self.block_to_loop.get(block)
+
+    def depth(self, block: Block) -> int:
+        """Return the loop nesting depth of block, 0 if it is not in a loop."""
+        loop = self.block_to_loop.get(block)
+        return loop.depth if loop is not None else 0
+
+
+def _find_preheader(header: Block, body: Set[Block]) -> Optional[Block]:
+    """
+    Return the preheader of a loop: the only predecessor of the header from outside the loop,
+    provided the header is its only successor.
+    """
+    outside_preds = [pred for pred in header.predecessors if pred not in body]
+    if len(outside_preds) == 1 and len(outside_preds[0].successors) == 1:
+        return outside_preds[0]
+    return None
+
+
+def _natural_loop_body(header: Block, latches: Set[Block]) -> Set[Block]:
+    """
+    Return the natural loop of header: the header plus every block that reaches a latch
+    without passing through the header.
+    """
+    body = {header}
+    stack = [latch for latch in latches if latch != header]
+    while stack:
+        block = stack.pop()
+        if block not in body:
+            body.add(block)
+            stack.extend(block.predecessors)
+    return body
+
+
+def _retreating_edges(entry_block: Block) -> List[Tuple[Block, List[Block]]]:
+    """
+    Return the retreating edges of a depth first search from entry_block: edges to a block
+    still on the DFS stack. Each is given as (source, stack path from target to source).
+    """
+    retreating: List[Tuple[Block, List[Block]]] = []
+    on_stack: Dict[Block, int] = {entry_block: 0}
+    seen: Set[Block] = {entry_block}
+    path: List[Block] = [entry_block]
+    stack = [iter(sorted(entry_block.successors))]
+    while stack:
+        block = path[-1]
+        for succ in stack[-1]:
+            if succ in on_stack:
+                retreating.append((block, path[on_stack[succ] :]))
+            elif succ not in seen:
+                seen.add(succ)
+                on_stack[succ] = len(path)
+                path.append(succ)
+                stack.append(iter(sorted(succ.successors)))
+                break
+        else:
+            stack.pop()
+            del on_stack[path.pop()]
+    return retreating
+
+
+def find_loops(entry_block: Block) -> LoopForest:
+    """
+    Compute the natural loop forest of the function starting at entry_block.
+    """
+    idom = get_immediate_dominators_block(entry_block)
+
+    # back edges latch -> header, grouped by header
+    latches: Dict[Block, Set[Block]] = {}
+    irreducible: List[Set[Block]] = []
+    for source, cycle in _retreating_edges(entry_block):
+        target = cycle[0]
+        if dominates(target, source, idom):
+            latches.setdefault(target, set()).add(source)
+        else:
+            # retreating edge into a cycle its target does not dominate
+            irreducible.append(set(cycle))
+
+    loops = [
+        Loop(header, header_latches, _natural_loop_body(header, header_latches))
+        for header, header_latches in latches.items()
+    ]
+
+    # natural loops with distinct headers are either nested or disjoint,
+    # the parent of a loop is the smallest loop containing its header
+    loops.sort(key=lambda loop: (len(loop.body), loop.header))
+    for i, loop in enumerate(loops):
+        for outer in loops[i + 1 :]:
+            if loop.header in outer.body and outer.header != loop.header:
+                loop.parent = outer
+                outer.children.append(loop)
+                break
+
+    # loops are sorted by size, so parents come after their children
+    for loop in reversed(loops):
+        loop.depth = loop.parent.depth + 1 if loop.parent is not None else 1
+
+    return LoopForest(loops, irreducible)
+
+
+def _labels(blocks: Iterable[Block]) -> List[str]:
+    return sorted(block.label for block in blocks)
+
+
+# key: function name, value: (blocks the forest was computed for, loop forest)
+_loop_forest_cache: Dict[str, Tuple[List[Block], LoopForest]] = {}
+
+
+def get_loop_forest(func_name: str, blocks: List[Block]) -> LoopForest:
+    """
+    Return the loop forest of a function's CFG, reusing the cached analysis when called again
+    with the same list of blocks. Passes that change the CFG must call invalidate_loop_forest.
+    """
+    cached = _loop_forest_cache.get(func_name)
+    if cached is not None and cached[0] is blocks:
+        return cached[1]
+
+    forest = find_loops(blocks[0])
+    _loop_forest_cache[func_name] = (blocks, forest)
+    return forest
+
+
+def invalidate_loop_forest(func_name: Optional[str] = None) -> None:
+    """
+    Drop the cached loop forest of a function, or of every function if func_name is None.
+    """
+    if func_name is None:
+        _loop_forest_cache.clear()
+    else:
+        _loop_forest_cache.pop(func_name, None)
+
+
+if __name__ == "__main__":
+    program, _ = load()
+
+    if program is None:
+        sys.exit(1)
+
+    for fi, func in enumerate(program["functions"]):
+        func_name = func.get("name", f"f{fi}")
+        blocks = to_cfg(func.get("instrs", []), fi)
+        print(f"Function {func_name}:")
+        if not blocks:
+            continue
+
+        forest = get_loop_forest(func_name, blocks)
+        for loop in sorted(forest.loops, key=lambda loop: loop.header):
+            print(f"  loop {loop.header.label} (depth {loop.depth}):")
+            print(f"    body: {_labels(loop.body)}")
+            print(f"    latches: {_labels(loop.latches)}")
+            print(f"    exits: {_labels(loop.exits)}")
+            print(f"    preheader: {loop.preheader.label if loop.preheader else None}")
+            print(f"    parent: {loop.parent.header.label if loop.parent else None}")
+
+        for region in forest.irreducible:
+            print(f"  irreducible region: {_labels(region)}")
@@ -0,0 +1,288 @@
+"""
+CFG simplification: block merging, jump threading, empty block and unreachable block removal.
+
+Every fall-through edge is first made an explicit jump, then a worklist of blocks is simplified
+until nothing changes:
+- a br whose two labels are the same becomes a jmp
+- a jump to a block that only jumps on is threaded to its final target
+- a block ending in a jmp to a block with no other predecessor absorbs that block
+- blocks that are no longer reachable are removed, together with their phi arguments
+Every change removes an edge or a block, so the worklist sees a linear number of changes, but
+threading walks the chain of forwarding blocks behind each jump, which makes long chains
+quadratic. Finally jumps to the block laid out right after them and labels that are no longer
+referenced are dropped.
+
+Given an edge profile, as printed by `brili-trace.ts -e`, -stats also reports the number of
+jumps executed that were removed: the profile gives how often each edge is taken, and edges
+are moved along as jumps are threaded and blocks merged.
+
+    bril2json < prog.bril | deno run brili-trace.ts -e {args} > prog.edges.json
+    bril2json < prog.bril | python3 simplifycfg.py -profile prog.edges.json | brili -p {args}
+"""
+import json
+import sys
+from typing import Dict, List, Optional, Set, Tuple
+
+from block import Block, blocks_to_instrs
+from bril_type import *
+from cfg import (
+    EdgeProfile,
+    count_jumps,
+    fall_through,
+    make_jumps_explicit,
+    reachable_blocks,
+    to_cfg,
+)
+from loops import invalidate_loop_forest
+from utils import load
+
+
+# key: label control came from, value: key: label control went to, value: times taken
+def _is_forwarder(block: Block) -> bool:
+    """A block that does nothing but jump to another block."""
+    instrs = [instr for instr in block.instrs if "label" not in instr]
+    return len(instrs) == 1 and instrs[0].get("op") == "jmp"
+
+
+def _has_phis(block: Block) -> bool:
+    return any(instr.get("op") == "phi" for instr in block.instrs)
+
+
+def _executed_jumps(blocks: List[Block], flow: Dict[Tuple[Block, Block], int]) -> int:
+    """Jumps executed in blocks, given how many times each edge is taken."""
+    jumping = {
+        block
+        for block in blocks
+        if block.instrs and block.instrs[-1].get("op") in {"jmp", "br"}
+    }
+    return sum(count for (block, _), count in flow.items() if block in jumping)
+
+
+def simplify_cfg(
+    func_name: str, blocks: List[Block], profile: Optional[EdgeProfile] = None
+) -> Tuple[List[Block], int, Optional[int]]:
+    """
+    Simplify the CFG of function func_name (blocks[0] is the entry block). The blocks are
+    changed in place, so the cached loop forest of the function is dropped.
+
+    Returns the remaining blocks, in their original order, the number of jmp and br
+    instructions removed and, given the edge profile of the function, the number of jumps
+    executed that were removed.
+    """
+    invalidate_loop_forest(func_name)
+    jumps_before = count_jumps(blocks)
+    # key: edge, value: times taken. The profile knows the blocks by their labels, the entry
+    # block by "" if it has none
+    flow: Dict[Tuple[Block, Block], int] = {}
+    if profile is not None:
+        keys = {
+            block: block.instrs[0]["label"] if "label" in block.instrs[0] else ""
+            for block in blocks
+        }
+        for block in blocks:
+            if keys[block] or block is blocks[0]:
+                for succ in block.successors:
+                    flow[(block, succ)] = profile.get(keys[block], {}).get(
+                        keys[succ], 0
+                    )
+    executed_before = _executed_jumps(blocks, flow)
+    make_jumps_explicit(blocks)
+    entry = blocks[0]
+    label_to_block: Dict[str, Block] = {block.label: block for block in blocks}
+    removed: Set[Block] = set()
+    added_rets: List[
+        Instruction
+    ] = []  # returns added where a merged block fell off the end
+
+    def _terminator(block: Block) -> Instruction:
+        return block.instrs[-1]
+
+    def _remove_edge(pred: Block, succ: Block) -> None:
+        pred.successors.discard(succ)
+        succ.predecessors.discard(pred)
+        flow.pop((pred, succ), None)
+        for instr in succ.instrs:
+            if instr.get("op") == "phi":
+                incoming = [
+                    (label, arg)
+                    for label, arg in zip(instr["labels"], instr["args"])
+                    if label != pred.label
+                ]
+                instr["labels"] = [label for label, _ in incoming]
+                instr["args"] = [arg for _, arg in incoming]
+
+    def _remove_unreachable() -> None:
+        reachable = reachable_blocks(entry)
+        for block in blocks:
+            if block not in reachable and block not in removed:
+                for succ in list(block.successors):
+                    _remove_edge(block, succ)
+                removed.add(block)
+
+    # dead cycles are never left without predecessors, so they are removed up front
+    _remove_unreachable()
+    worklist: List[Block] = [
+        block for block in reversed(blocks) if block not in removed
+    ]
+    while worklist:
+        block = worklist.pop()
+        if block in removed:
+            continue
+
+        # unreachable
+        if block is not entry and not block.predecessors:
+            for succ in list(block.successors):
+                _remove_edge(block, succ)
+                worklist.append(succ)
+            removed.add(block)
+            continue
+
+        terminator = _terminator(block)
+        op = terminator.get("op")
+
+        # br with identical targets
+        if op == "br" and terminator["labels"][0] == terminator["labels"][1]:
+            block.instrs[-1] = {"op": "jmp", "labels": [terminator["labels"][0]]}
+            worklist.append(block)
+            continue
+
+        if op not in {"jmp", "br"}:
+            continue
+
+        # thread jumps through blocks that only jump on
+        changed = False
+        new_labels = []
+        chains: List[
+            List[Block]
+        ] = []  # the blocks each threaded jump no longer goes through
+        for label in terminator["labels"]:
+            target = label_to_block[label]
+            final = target
+            seen = {block}
+            chain = [target]
+            while (
+                _is_forwarder(final)
+                and final not in seen
+                and not _has_phis(final)
+                and final is not entry
+            ):
+                seen.add(final)
+                final = label_to_block[_terminator(final)["labels"][0]]
+                chain.append(final)
+            if final is not target and not _has_phis(final) and final not in seen:
+                changed = True
+                chains.append(chain)
+            else:
+                final = target
+            new_labels.append(final.label)
+        if changed:
+            # the times the jump is taken move from the chain to the new edge
+            for chain in chains:
+                count = flow.pop((block, chain[0]), 0)
+                for source, dest in zip(chain, chain[1:]):
+                    flow[(source, dest)] = flow.get((source, dest), 0) - count
+                flow[(block, chain[-1])] = flow.get((block, chain[-1]), 0) + count
+            old_targets = {label_to_block[label] for label in terminator["labels"]}
+            terminator["labels"] = new_labels
+            new_targets = {label_to_block[label] for label in new_labels}
+            for target in old_targets - new_targets:
+                block.successors.discard(target)
+                target.predecessors.discard(block)
+                worklist.append(target)
+            for target in new_targets - old_targets:
+                block.successors.add(target)
+                target.predecessors.add(block)
+            worklist.append(block)
+            continue
+
+        # merge with a successor that has no other predecessor
+        if op == "jmp":
+            succ = label_to_block[terminator["labels"][0]]
+            if succ is not block and succ is not entry and succ.predecessors == {block}:
+                merged: List[Instruction] = []
+                for instr in succ.instrs:
+                    if "label" in instr:
+                        continue
+                    if instr.get("op") == "phi":
+                        # one predecessor, one value
+                        instr = {
+                            "dest": instr["dest"],
+                            "op": "id",
+                            "type": instr["type"],
+                            "args": instr["args"][:1],
+                        }
+                    merged.append(instr)
+                if not merged or merged[-1].get("op") not in {"jmp", "br", "ret"}:
+                    # succ fell off the end of the function, block may not be laid out last
+                    ret: Instruction = {"op": "ret", "args": []}
+                    merged.append(ret)
+                    added_rets.append(ret)
+                block.instrs = block.instrs[:-1] + merged
+
+                flow.pop((block, succ), None)
+                block.successors = set(succ.successors)
+                for next_block in succ.successors:
+                    flow[(block, next_block)] = flow.pop((succ, next_block), 0)
+                    next_block.predecessors.discard(succ)
+                    next_block.predecessors.add(block)
+                    for instr in next_block.instrs:
+                        if instr.get("op") == "phi":
+                            instr["labels"] = [
+                                block.label if label == succ.label else label
+                                for label in instr["labels"]
+                            ]
+                succ.predecessors = set()
+                succ.successors = set()
+                removed.add(succ)
+                worklist.append(block)
+
+    _remove_unreachable()  # threading can leave cycles behind too
+    remaining = [block for block in blocks if block not in removed]
+
+    remaining = fall_through(remaining)
+    if remaining and any(remaining[-1].instrs[-1] is ret for ret in added_rets):
+        remaining[
+            -1
+        ].instrs.pop()  # laid out last after all, it falls off the end again
+        remaining = [block for block in remaining if block.instrs]
+
+    executed_removed = None
+    if profile is not None:
+        executed_removed = executed_before - _executed_jumps(remaining, flow)
+    return remaining, jumps_before - count_jumps(remaining), executed_removed
+
+
+if __name__ == "__main__":
+    program, cli_flags = load(["-stats"], {"-profile": ""})
+
+    if program is None:
+        sys.exit(1)
+
+    profiles: Optional[Dict[str, EdgeProfile]] = None
+    if cli_flags["profile"]:
+        with open(cli_flags["profile"]) as file:
+            profiles = json.load(file)
+
+    total_removed = 0
+    for fi, func in enumerate(program["functions"]):
+        blocks = to_cfg(func.get("instrs", []), fi)
+        if not blocks:
+            continue
+
+        profile = profiles.get(func["name"], {}) if profiles is not None else None
+        blocks, jumps_removed, executed_removed = simplify_cfg(
+            func["name"], blocks, profile
+        )
+        func["instrs"] = blocks_to_instrs(blocks)
+
+        if cli_flags["stats"]:
+            stats = f"{func.get('name', f'f{fi}')}: {jumps_removed} jumps removed"
+            if executed_removed is not None:
+                stats += f", {executed_removed} executed"
+                total_removed += executed_removed
+            print(stats, file=sys.stderr)
+
+    if cli_flags["stats"] and profiles is not None:
+        print(f"total: {total_removed} executed jumps removed", file=sys.stderr)
+
+    print(json.dumps(program, indent=2, sort_keys=True))
@@ -0,0 +1,188 @@
+"""
+Function specialization for constant arguments.
+
+Constant propagation is run on every function to find the arguments of each call that are
+known constants. The calls to a function are grouped by their constant arguments, and the
+groups with the most call sites get a clone of the function of their own, with the constant
+parameters removed from its signature and assigned their values at its start instead. A clone is
+only made if it gets smaller than the function once both are folded, the assignments cost as
+much as passing the arguments otherwise. The calls are rewritten to call the clone with the
+remaining arguments. Clones are analyzed in turn, so the constants they know flow on into their
+own calls, e.g. through recursion, until no call is rewritten. The number of clones of a
+function is bounded, which ends the process. Functions no longer called by any other function
+are dropped. Constant propagation, CFG simplification and tdce then fold the parameters into
+the clones' bodies and remove the branches they decide.
+
+    bril2json < prog.bril | python3 specialize.py -clones 4 | python3 dfa.py
+        | python3 simplifycfg.py | python3 -m lesson_tasks.l3.tdce | brili -p
+"""
+import copy
+import json
+import sys
+from typing import Dict, List, Set, Tuple
+
+from bril_type import *
+from cfg import to_cfg_fine_grain
+from dce import dce_func
+from dfa import apply_constant_propagation, constant_propagation, constant_value
+from inline import call_graph, function_size
+from utils import fresh_name, load
+
+DEFAULT_CLONES = 4  # most clones made of a function
+
+# the constant arguments of a call: their positions and values
+Constants = Tuple[Tuple[int, Literal], ...]
+
+
+def _has_phis(func: Function) -> bool:
+    # a block placed before the entry would change the predecessor labels of its phis
+    return any(instr.get("op") == "phi" for instr in func.get("instrs", []))
+
+
+def _constant_calls(program: Program) -> Dict[Tuple[str, Constants], List[Instruction]]:
+    """
+    Return the calls of program that have constant arguments, grouped by callee and constant
+    arguments.
+    """
+    funcs = {func["name"]: func for func in program["functions"]}
+    cfg_root_nodes = to_cfg_fine_grain(program)
+    dfas = {
+        root_node.func_name: dfa
+        for root_node, dfa in zip(cfg_root_nodes, constant_propagation(cfg_root_nodes))
+    }
+
+    calls: Dict[Tuple[str, Constants], List[Instruction]] = {}
+    for fi, func in enumerate(program["functions"]):
+        for ii, instr in enumerate(func.get("instrs", [])):
+            callee = funcs.get(instr["funcs"][0]) if instr.get("op") == "call" else None
+            if callee is None or _has_phis(callee):
+                continue
+            in_set = dfas[func["name"]].in_sets[f"f{fi}-{ii}"]
+            constants = tuple(
+                (i, value)
+                for i, value in enumerate(
+                    constant_value(in_set, arg) for arg in instr.get("args", [])
+                )
+                if value is not None
+            )
+            if constants:
+                calls.setdefault((instr["funcs"][0], constants), []).append(instr)
+    return calls
+
+
+def _clone(func: Function, constants: Constants, name: str) -> Function:
+    """Return a copy of func named name, with the constant parameters assigned instead."""
+    clone = copy.deepcopy(func)
+    clone["name"] = name
+    params = clone.get("args", [])
+    fixed = dict(constants)
+    clone["args"] = [param for i, param in enumerate(params) if i not in fixed]
+    assigned: List[Instruction] = [
+        {
+            "dest": params[i]["name"],
+            "op": "const",
+            "type": params[i]["type"],
+            "value": value,  # type: ignore
+        }
+        for i, value in constants
+    ]
+    clone["instrs"] = assigned + clone.get("instrs", [])
+    return clone
+
+
+def _folded_size(func: Function) -> int:
+    """The number of instructions of func left after constant folding and aggressive DCE."""
+    func = copy.deepcopy(func)
+    if not func.get("instrs"):
+        return 0
+    (root_node,) = to_cfg_fine_grain(Program(functions=[func]))
+    (dfa,) = constant_propagation([root_node])
+    apply_constant_propagation(func, dfa)
+    dce_func(func, 0, aggressive=True)
+    return function_size(func)
+
+
+def specialize_program(
+    program: Program, max_clones: int = DEFAULT_CLONES
+) -> Tuple[int, int]:
+    """
+    Mutates program to call clones of functions specialized for their constant arguments,
+    making at most max_clones clones of each function. Returns the number of clones made and
+    of calls rewritten.
+    """
+    funcs: Dict[str, Function] = {func["name"]: func for func in program["functions"]}
+    taken = set(funcs)
+    originals = set(funcs)
+    # key: function and constant arguments, value: the name of its clone
+    clones: Dict[Tuple[str, Constants], str] = {}
+    clone_counts: Dict[str, int] = {}  # key: function, value: clones made of it
+    sizes: Dict[str, int] = {}  # key: function, value: its folded size
+    rejected: Set[Tuple[str, Constants]] = set()
+    called = {name for callees in call_graph(program).values() for name in callees}
+
+    rewritten = 0
+    changed = True
+    while changed:
+        changed = False
+        calls = _constant_calls(program)
+        # calls to the functions of the program as given, the most frequent constants first
+        for key in sorted(
+            (key for key in calls if key[0] in originals),
+            key=lambda key: -len(calls[key]),
+        ):
+            name, constants = key
+            if key in rejected:
+                continue
+            if key not in clones:
+                if clone_counts.get(name, 0) >= max_clones:
+                    continue
+                # the assignments of the constants cost as much as passing them unless
+                # they let more of the function be folded away
+                clone = _clone(funcs[name], constants, f"{name}.spec")
+                if name not in sizes:
+                    sizes[name] = _folded_size(funcs[name])
+                if _folded_size(clone) >= sizes[name]:
+                    rejected.add(key)
+                    continue
+                clone_counts[name] = clone_counts.get(name, 0) + 1
+                clones[key] = clone["name"] = fresh_name(f"{name}.spec", taken)
+                program["functions"].append(clone)
+                funcs[clone["name"]] = clone
+
+            fixed = dict(constants)
+            for call in calls[key]:
+                call["funcs"] = [clones[key]]
+                call["args"] = [
+                    arg for i, arg in enumerate(call.get("args", [])) if i not in fixed
+                ]
+                rewritten += 1
+            changed = True
+
+    # functions that were called and now only call themselves, if anything
+    graph = call_graph(program)
+    still_called = {
+        callee
+        for caller, callees in graph.items()
+        for callee in callees
+        if callee != caller
+    }
+    program["functions"] = [
+        func
+        for func in program["functions"]
+        if func["name"] not in called or func["name"] in still_called
+    ]
+    return len(clones), rewritten
+
+
+if __name__ == "__main__":
+    program, cli_flags = load(["-stats"], {"-clones": DEFAULT_CLONES})
+
+    if program is None:
+        sys.exit(1)
+
+    cloned, rewritten = specialize_program(program, cli_flags["clones"])
+
+    if cli_flags["stats"]:
+        print(f"{cloned} clones, {rewritten} calls rewritten", file=sys.stderr)
+
+    print(json.dumps(program, indent=2, sort_keys=True))
@@ -3,160 +3,261 @@ A series of utility functions for transforming BRIL programs into and out of SSA
 """
 import json
 import sys
-from collections import defaultdict, deque
-from typing import Dict, List, Set
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
 
 from block import Block, blocks_to_instrs
 from block import visualize as visualize_block
 from bril_type import *
 from cfg import to_cfg
+from defuse import DefUseIndex
+from dfa import live_variables_block
 from dominator import (
-    _get_dominators_block,
-    dominance_frontier_block,
-    dominance_tree_block,
+    tree_children,
+    dominance_frontiers_block,
+    get_immediate_dominators_block,
 )
-from node import Node, PhiNode
-from utils import load
+from node import PhiNode
+from utils import fresh_name, load
 
 
-def _collect_vars(entry_node: Block) -> Dict[str, Set[Block]]:
+def _collect_global_vars(blocks: List[Block]) -> Set[str]:
     """
-    Return a mapping of variables to the nodes in which they are defined/assigned .
+    Return the variables that are live on entry to some block (used before being assigned in
+    it). Only these "globals" can ever need a phi node.
     """
-    var_to_assignments: Dict[str, Set[Block]] = defaultdict(set)
-    q = deque([entry_node])
-    seen: Set[str] = set()
-    while q:
-        block = q.popleft()
-        seen.add(block.id)
-
+    global_vars: Set[str] = set()
+    for block in blocks:
+        assigned: Set[str] = set()
         for instr in block.instrs:
-            # assignment statement
+            global_vars.update(
+                arg for arg in instr.get("args", []) if arg not in assigned
+            )
             if "dest" in instr:
-                var_name = instr["dest"]
-                var_to_assignments[var_name].add(block)
+                assigned.add(instr["dest"])
+    return global_vars
+
+
+def count_phis(instrs: List[Instruction]) -> int:
+    """
+    Return the number of phi instructions in a list of instructions.
+    """
+    return sum(1 for instr in instrs if instr.get("op") == "phi")
+
+
+# phi argument for a predecessor on which the variable has no definition
+UNDEFINED = "__undefined"
+
 
-        q.extend([succ for succ in block.successors if succ.id not in seen])
+def _prepare_blocks(blocks: List[Block]) -> List[Block]:
+    """
+    Make a CFG ready for phi nodes, which name their incoming edges by predecessor label.
+    - every block gets a label
+    - an entry block that is the target of a jump gets a fresh entry block in front of it, so
+      the path from the function entry has a label of its own
+    - unreachable blocks are dropped, they are not in the dominator tree and are never renamed
+    """
+    taken = {block.label for block in blocks if "label" in block.instrs[0]}
+    for block in blocks:
+        if "label" not in block.instrs[0]:
+            block.label = fresh_name(block.id.replace("-", "."), taken)
+            block.instrs.insert(0, {"label": block.label})
+
+    entry_block = blocks[0]
+    if entry_block.predecessors:
+        f_id = entry_block.id.split("-")[0]
+        max_ii = max(int(block.id.split("-")[1]) for block in blocks)
+        new_entry = Block(
+            id=f"{f_id}-{max_ii + 1}",
+            label=fresh_name("entry", taken),
+            predecessors=set(),
+            successors={entry_block},
+            instrs=[],
+        )
+        new_entry.instrs.append({"label": new_entry.label})
+        entry_block.predecessors.add(new_entry)
+        blocks = [new_entry] + blocks
+
+    reachable: Set[Block] = {blocks[0]}
+    stack = [blocks[0]]
+    while stack:
+        for succ in stack.pop().successors:
+            if succ not in reachable:
+                reachable.add(succ)
+                stack.append(succ)
+
+    for block in blocks:
+        if block not in reachable:
+            for succ in block.successors:
+                succ.predecessors.discard(block)
 
-    return var_to_assignments
+    return [block for block in blocks if block in reachable]
 
 
-def _rename_vars(entry_node: Block, dom_tree_dict: Dict[str, List[Block]]) -> None:
+def var_types(func: Function) -> Dict[str, Type]:
+    """
+    Return the type of every argument and assigned variable of a function.
+    """
+    dest_to_types: Dict[str, Type] = {
+        arg["name"]: arg["type"] for arg in func.get("args", [])
+    }
+    for instr in func.get("instrs", []):
+        if "dest" in instr and "type" in instr:
+            dest_to_types[instr["dest"]] = instr["type"]
+    return dest_to_types
+
+
+def _rename_vars(
+    entry_node: Block,
+    dom_tree_dict: Dict[str, List[Block]],
+    func_args: List[str],
+    taken: Set[str],
+) -> None:
     """
     Rename variables in a CFG to be in SSA form.
     - entry_node: the entry node of the CFG
     - dom_tree_dict: a mapping of node_id to nodes that it immediately dominates
-    """
-    # key: old_var_name, value: deque of renamed var_names (var -> var_0, var_1, etc.)
-    var_stack: Dict[str, deque] = defaultdict(deque)
+    - func_args: names of the function arguments, which keep their names until reassigned
+    - taken: variable names in use, new names are chosen to not collide with them
 
-    # could use len(var_stack[var]) instead?
+    The dominator tree is walked with an explicit stack. Each block logs the variables it
+    pushed a new name for, and once its subtree is done exactly those names are popped again.
+    """
+    # key: old_var_name, value: stack of renamed var_names (var -> var_0, var_1, etc.)
+    var_stack: Dict[str, List[str]] = defaultdict(list)
     var_counter: Dict[str, int] = defaultdict(int)
 
-    # tracks the current path the recursive _rename function has taken from the entry_block
-    # node_ids_seen: Set[str] = set()
+    for arg in func_args:
+        var_stack[arg].append(arg)
 
-    def _get_new_name(var: str) -> str:
+    def _get_new_name(var: str, pushed: List[str]) -> str:
         new_name = f"{var}_{var_counter[var]}"
+        while new_name in taken:
+            var_counter[var] += 1
+            new_name = f"{var}_{var_counter[var]}"
         var_counter[var] += 1
         var_stack[var].append(new_name)
+        pushed.append(var)
         return new_name
 
-    def _rename(block: Block) -> None:
-        # node_ids_seen_cache = node_ids_seen.copy()
-        # node_ids_seen.add(block.id)
+    # (block, None) renames the block, (block, pushed) pops its names after its subtree
+    stack: List[Tuple[Block, Optional[List[str]]]] = [(entry_node, None)]
+    while stack:
+        block, pushed = stack.pop()
+        if pushed is not None:
+            for var in pushed:
+                var_stack[var].pop()
+            continue
 
-        # deep copy of var_stack
-        var_stack_cache = {var_name: q.copy() for var_name, q in var_stack.items()}
+        pushed = []
 
         # rename dest for all phi_nodes in current node
         if block.phi_nodes is not None:
             for _, phi in block.phi_nodes.items():
-                phi.dest = _get_new_name(phi.dest)
+                phi.dest = _get_new_name(phi.dest, pushed)
 
         for instr in block.instrs:
             if "args" in instr:
-                # replace args
-                new_args = [
-                    var_stack[arg][-1] for arg in instr["args"] if arg in var_stack
+                # a use with no reaching definition keeps its name, and stays undefined
+                instr["args"] = [
+                    var_stack[arg][-1] if var_stack[arg] else arg
+                    for arg in instr["args"]
                 ]
-                instr["args"] = new_args
 
             if "dest" in instr:
-                # replace dest
-                pre_rename_dest = instr["dest"]
-                post_rename_dest = _get_new_name(pre_rename_dest)
-                instr["dest"] = post_rename_dest
+                instr["dest"] = _get_new_name(instr["dest"], pushed)
 
         # update phi_nodes in successors
         for succ in block.successors:
             if succ.phi_nodes is not None:
-                for pre_rename_dest, phi in sorted(
-                    succ.phi_nodes.items(), key=lambda x: x[0]
-                ):
-                    # if phi_src_node_id exists on the current path
-                    # (recursively traversed from the entry_node)
-                    if len(var_stack[pre_rename_dest]) > 0:
+                for pre_rename_dest, phi in succ.phi_nodes.items():
+                    if var_stack[pre_rename_dest]:
                         phi.args[block.label] = var_stack[pre_rename_dest][-1]
                     else:
-                        phi.args[block.label] = "?"
-
-        # rename all immediately dominated nodes
-        for im_dom_node in sorted(dom_tree_dict[block.id]):
-            _rename(im_dom_node)
-
-        # restore var_stack
-        var_stack.clear()
-        var_stack.update(var_stack_cache)
+                        phi.args[block.label] = UNDEFINED
 
-        # # restore node_ids_seen
-        # node_ids_seen.clear()
-        # node_ids_seen.update(node_ids_seen_cache)
+        # children are renamed first (in order), then the names of this block are popped
+        stack.append((block, pushed))
+        for im_dom_node in reversed(dom_tree_dict[block.id]):
+            stack.append((im_dom_node, None))
 
-    _rename(entry_node)
 
-
-def to_ssa(entry_block: Block, dest_to_types: Dict[str, Type]) -> List[Instruction]:
-    """
-    Convert a CFG into SSA form.
+def to_ssa(
+    blocks: List[Block],
+    dest_to_types: Dict[str, Type],
+    pruning: str = "minimal",
+    func_args: Optional[List[Argument]] = None,
+) -> List[Instruction]:
     """
-    var_to_assignments = _collect_vars(entry_block)
+    Convert a CFG (blocks[0] is the entry block) into SSA form.
+    Phi arguments on paths where the variable is not defined are UNDEFINED.
 
-    for var in var_to_assignments.keys():
-        assignments_q = deque(var_to_assignments[var])
-        while assignments_q:
-            block = assignments_q.popleft()
-            for df_block in dominance_frontier_block(block, entry_block):
-                # no phi_nodes, create one for var
+    pruning controls which phi nodes are placed at the iterated dominance frontiers
+    - "minimal": a phi for every assigned variable
+    - "semi-pruned": only for variables that are live on entry to some block
+    - "pruned": only where the variable is live on entry to the phi's block
+    """
+    arg_names = [arg["name"] for arg in func_args or []]
+    blocks = _prepare_blocks(blocks)
+    entry_block = blocks[0]
+    index = DefUseIndex.from_blocks(blocks)
+
+    if pruning == "semi-pruned":
+        global_vars = _collect_global_vars(blocks)
+    elif pruning == "pruned":
+        live_in, _ = live_variables_block(blocks)
+
+    # dominance frontiers are computed once for the whole function
+    idom = get_immediate_dominators_block(entry_block)
+    frontiers = dominance_frontiers_block(entry_block, idom)
+
+    # Cytron et al.'s phi placement: has_already[block] is the last variable (by index) that
+    # got a phi in block and work[block] the last variable for which block was queued, so
+    # the markers never need to be reset between variables
+    has_already: Dict[Block, int] = defaultdict(int)
+    work: Dict[Block, int] = defaultdict(int)
+
+    for var_index, var in enumerate(sorted(index.defined_vars()), start=1):
+        if pruning == "semi-pruned" and var not in global_vars:
+            continue
+
+        worklist = []
+        for block in index.def_blocks(var):
+            work[block] = var_index
+            worklist.append(block)
+
+        while worklist:
+            block = worklist.pop()
+            for df_block in frontiers[block]:
+                if has_already[df_block] == var_index:
+                    continue
+                has_already[df_block] = var_index
+
+                # a phi for a variable that is dead on entry to the block is never used
+                if pruning == "pruned" and var not in live_in[df_block]:
+                    continue
+
+                # args are filled in per predecessor when renaming
                 if df_block.phi_nodes is None:
                     df_block.phi_nodes = {}
+                df_block.phi_nodes[var] = PhiNode(dest=var, args={})
 
-                # no phi_node for var, create one
-                if var not in df_block.phi_nodes:
-                    df_block.phi_nodes[var] = PhiNode(dest=var, args={})
-
-                # different assignment to var, add to phi_node
-                if (
-                    block.label not in df_block.phi_nodes[var].args
-                    and df_block.id != block.id
-                ):
-                    df_block.phi_nodes[var].args[block.label] = var
-
-                # update assignments to include the phi node use case
-                if df_block not in var_to_assignments[var]:
-                    var_to_assignments[var].add(df_block)
-                    assignments_q.append(df_block)
-
-    doms = _get_dominators_block(entry_block)
-    all_blocks = {block.id: block for block in doms.keys()}
+                # the phi node is a new assignment to var
+                if work[df_block] != var_index:
+                    work[df_block] = var_index
+                    worklist.append(df_block)
 
-    dom_tree = dominance_tree_block(doms)
     dom_tree_dict = {
-        block.id: [all_blocks[succ.id] for succ in block.successors]
-        for block in dom_tree
+        block.id: sorted(children) for block, children in tree_children(idom).items()
     }
 
-    _rename_vars(entry_block, dom_tree_dict)
+    taken = set(arg_names) | {
+        name
+        for block in blocks
+        for instr in block.instrs
+        for name in instr.get("args", []) + [instr.get("dest", "")]
+    }
+    _rename_vars(entry_block, dom_tree_dict, arg_names, taken)
 
     # add phi nodes to block.instrs
     for block in blocks:
@@ -167,7 +268,7 @@ def to_ssa(entry_block: Block, dest_to_types: Dict[str, Type]) -> List[Instructi
                     {
                         "op": "phi",
                         "dest": phi.dest,
-                        "type": dest_to_types[pre_rename_var],  # TODO: fix later
+                        "type": dest_to_types[pre_rename_var],
                         "labels": [label for label in phi.args.keys()],
                         "args": [renamed_var for renamed_var in phi.args.values()],
                     },
@@ -177,52 +278,401 @@ def to_ssa(entry_block: Block, dest_to_types: Dict[str, Type]) -> List[Instructi
     return blocks_to_instrs(blocks)
 
 
-def from_ssa(cfg_nodes: List[Node]) -> List[Node]:
+def sequentialize_copies(
+    copies: List[Tuple[str, str, Type]], taken: Set[str]
+) -> List[Instruction]:
+    """
+    Order a parallel copy (every source is read before any destination is written) as a list of
+    `id` instructions. A copy is emitted once no other pending copy reads its destination, what
+    is left after that are cycles and each one is broken with a single temporary.
+    - copies: (dest, src, type) with distinct dests
+    """
+    # key: dest, value: (src, type) of copies that are not emitted yet
+    pending: Dict[str, Tuple[str, Type]] = {
+        dest: (src, typ) for dest, src, typ in copies if dest != src
+    }
+    # key: var, value: dests of pending copies that read it
+    readers: Dict[str, List[str]] = defaultdict(list)
+    for dest, (src, _) in pending.items():
+        readers[src].append(dest)
+
+    ready = [dest for dest in pending if not readers[dest]]
+    seq: List[Instruction] = []
+    while pending:
+        while ready:
+            dest = ready.pop()
+            src, typ = pending.pop(dest)
+            seq.append({"op": "id", "dest": dest, "type": typ, "args": [src]})
+            readers[src].remove(dest)
+            if not readers[src] and src in pending:
+                ready.append(src)
+
+        if pending:
+            # every remaining dest is still read by another copy, save one value of a cycle
+            dest = next(iter(pending))
+            tmp = fresh_name(f"{dest}_tmp", taken)
+            seq.append(
+                {"op": "id", "dest": tmp, "type": pending[dest][1], "args": [dest]}
+            )
+            for reader in readers.pop(dest):
+                pending[reader] = (tmp, pending[reader][1])
+                readers[tmp].append(reader)
+            ready.append(dest)
+
+    return seq
+
+
+def from_ssa(
+    blocks: List[Block], func_args: Optional[List[Argument]] = None
+) -> List[Instruction]:
+    """
+    Convert a CFG (blocks[0] is the entry block) from SSA form back into regular form.
+
+    Each phi becomes a copy on every incoming edge, and the copies on one edge form a parallel
+    copy. A phi dest is coalesced with its argument whenever the two do not interfere, which
+    turns their copy into a no-op. What is left of each parallel copy is sequentialized and
+    placed at the end of the predecessor, splitting the edge if the predecessor ends in a `br`
+    (this covers every critical edge).
+    """
+    arg_names = {arg["name"] for arg in func_args or []}
+    taken = arg_names | {block.label for block in blocks}
+    for block in blocks:
+        for instr in block.instrs:
+            taken.update(instr.get("args", []))
+            if "dest" in instr:
+                taken.add(instr["dest"])
+
+    live_in, live_out = live_variables_block(blocks)
+
+    # variables that interfere can not share a name: one is defined while the other is live
+    neighbors: Dict[str, Set[str]] = defaultdict(set)
+
+    def _interfere(a: str, b: str) -> None:
+        if a != b:
+            neighbors[a].add(b)
+            neighbors[b].add(a)
+
+    # key: block, value: variables live right after its phis
+    live_after_phis: Dict[Block, Set[str]] = {}
+    for block in blocks:
+        live = set(live_out[block])
+        for instr in reversed(block.instrs):
+            if instr.get("op") == "phi":
+                # phi dests are defined by the copies at the end of the predecessors
+                continue
+            if "dest" in instr:
+                for var in live:
+                    _interfere(instr["dest"], var)
+                live.discard(instr["dest"])
+            live.update(instr.get("args", []))
+        live_after_phis[block] = live
+
+    # function arguments are all defined on entry
+    for arg in arg_names:
+        for var in live_in[blocks[0]] | arg_names:
+            _interfere(arg, var)
+
+    # lower phis into parallel copies on their incoming edges
+    # key: (pred, block), value: (dest, src, type) copies
+    edge_copies: Dict[Tuple[Block, Block], List[Tuple[str, str, Type]]] = {}
+    for block in blocks:
+        phis = [instr for instr in block.instrs if instr.get("op") == "phi"]
+        if not phis:
+            continue
+        block.instrs = [instr for instr in block.instrs if instr.get("op") != "phi"]
+
+        for pred in sorted(block.predecessors):
+            copies = [
+                (phi["dest"], arg, phi["type"])
+                for phi in phis
+                for arg, label in zip(phi["args"], phi["labels"])
+                if label == pred.label and arg != UNDEFINED
+            ]
+            edge_copies[(pred, block)] = copies
+
+            # the dests are defined at the copy, while everything live into the block is live
+            # (a dest does not interfere with its own source, unless that is overwritten too)
+            dests = {dest for dest, _, _ in copies}
+            for dest, src, _ in copies:
+                for var in live_after_phis[block] | dests:
+                    if var != src or src in dests:
+                        _interfere(dest, var)
+
+    # coalesce phi copies, keeping function arguments as the names of their classes
+    parent: Dict[str, str] = {}
+
+    def _find(var: str) -> str:
+        while var in parent:
+            var = parent[var]
+        return var
+
+    for copies in edge_copies.values():
+        for dest, src, _ in copies:
+            keep, drop = _find(dest), _find(src)
+            if keep == drop or drop in neighbors[keep]:
+                continue
+            if keep in arg_names and drop in arg_names:
+                continue
+            if drop in arg_names:
+                keep, drop = drop, keep
+
+            parent[drop] = keep
+            for var in neighbors.pop(drop, set()):
+                neighbors[var].discard(drop)
+                neighbors[var].add(keep)
+                neighbors[keep].add(var)
+
+    # place the copies left after coalescing at the end of the predecessor, splitting the edge
+    # if the predecessor ends in a br
+    f_id = blocks[0].id.split("-")[0]
+    next_ii = max(int(block.id.split("-")[1]) for block in blocks) + 1
+    split_after: Dict[Block, List[Block]] = defaultdict(list)
+    for (pred, block), copies in edge_copies.items():
+        renamed = {_find(dest): (_find(src), typ) for dest, src, typ in copies}
+        seq = sequentialize_copies(
+            [(dest, src, typ) for dest, (src, typ) in renamed.items()], taken
+        )
+        if not seq:
+            continue
+
+        if pred.instrs[-1].get("op") == "br":
+            split = Block(
+                id=f"{f_id}-{next_ii}",
+                label=fresh_name(f"{block.label}.split", taken),
+                predecessors={pred},
+                successors={block},
+                instrs=[],
+            )
+            next_ii += 1
+            split.instrs = [Instruction(label=split.label)] + seq
+            split.instrs.append({"op": "jmp", "labels": [block.label]})
+            pred.instrs[-1]["labels"] = [
+                split.label if label == block.label else label
+                for label in pred.instrs[-1]["labels"]
+            ]
+            pred.successors.remove(block)
+            pred.successors.add(split)
+            block.predecessors.remove(pred)
+            block.predecessors.add(split)
+            split_after[pred].append(split)
+        elif pred.instrs[-1].get("op") == "jmp":
+            pred.instrs[-1:-1] = seq
+        else:
+            pred.instrs.extend(seq)
+
+    # split blocks go right after the br they were split from, nothing falls through to them
+    instrs: List[Instruction] = []
+    for block in blocks:
+        for b in [block] + split_after[block]:
+            for instr in b.instrs:
+                if "dest" in instr:
+                    instr["dest"] = _find(instr["dest"])
+                if "args" in instr:
+                    instr["args"] = [_find(arg) for arg in instr["args"]]
+                instrs.append(instr)
+
+    return instrs
+
+
+def find_ssa_violations(
+    blocks: List[Block], func_args: Optional[List[Argument]] = None
+) -> List[str]:
     """
-    Convert a CFG from SSA form back into regular form.
+    Check a CFG (blocks[0] is the entry block) for violations of SSA form and describe each.
+    - every variable is assigned once (function arguments are assigned on entry)
+    - phis come first in their block, with one argument per predecessor, labelled by it
+    - every use is dominated by its definition, a phi argument must dominate the end of the
+      predecessor it comes from
+
+    Blocks unreachable from the entry are skipped. Dominance is answered in constant time from a
+    numbering of the dominator tree, so the whole check is linear in the size of the function.
     """
-    return []
+    violations: List[str] = []
+    entry_block = blocks[0]
+    idom = get_immediate_dominators_block(entry_block)
+
+    # number the dominator tree: a dominates b iff b's interval is nested in a's
+    pre: Dict[Block, int] = {}
+    post: Dict[Block, int] = {}
+    children = tree_children(idom)
+    counter = 0
+    stack: List[Tuple[Block, bool]] = [(entry_block, False)]
+    while stack:
+        block, done = stack.pop()
+        counter += 1
+        if done:
+            post[block] = counter
+            continue
+        pre[block] = counter
+        stack.append((block, True))
+        stack.extend((child, False) for child in children[block])
+
+    def _dominates(a: Block, b: Block) -> bool:
+        return pre[a] <= pre[b] and post[b] <= post[a]
+
+    # key: var, value: (block, index) of its definition, index -1 for function arguments
+    defs: Dict[str, Tuple[Block, int]] = {}
+    for param in func_args or []:
+        defs[param["name"]] = (entry_block, -1)
+
+    reachable = [block for block in blocks if block in idom]
+    for block in reachable:
+        for i, instr in enumerate(block.instrs):
+            if "dest" not in instr:
+                continue
+            if instr["dest"] in defs:
+                violations.append(f"{instr['dest']} is assigned more than once")
+            defs[instr["dest"]] = (block, i)
+
+    for block in reachable:
+        pred_labels = sorted(pred.label for pred in block.predecessors if pred in idom)
+        label_to_pred = {pred.label: pred for pred in block.predecessors}
+        in_phis = True
+        for i, instr in enumerate(block.instrs):
+            if "label" in instr:
+                continue
+
+            if instr.get("op") != "phi":
+                in_phis = False
+                for arg in instr.get("args", []):
+                    if arg not in defs:
+                        violations.append(
+                            f"{arg} is used in {block.label}, never assigned"
+                        )
+                        continue
+                    def_block, def_index = defs[arg]
+                    if def_block == block:
+                        ok = def_index < i
+                    else:
+                        ok = _dominates(def_block, block)
+                    if not ok:
+                        violations.append(
+                            f"{arg} does not dominate its use in {block.label}"
+                        )
+                continue
+
+            if not in_phis:
+                violations.append(
+                    f"phi {instr['dest']} is not at the top of {block.label}"
+                )
+
+            # one argument per reachable predecessor, labels naming anything else are wrong
+            args, labels = instr.get("args", []), instr.get("labels", [])
+            if (
+                len(args) != len(labels)
+                or any(label not in label_to_pred for label in labels)
+                or sorted(label for label in labels if label_to_pred[label] in idom)
+                != pred_labels
+            ):
+                violations.append(
+                    f"phi {instr['dest']} does not match the predecessors of {block.label}"
+                )
+
+            for arg, label in zip(args, labels):
+                pred = label_to_pred.get(label)
+                if arg == UNDEFINED or pred is None or pred not in idom:
+                    continue
+                if arg not in defs:
+                    violations.append(f"{arg} is used in {block.label}, never assigned")
+                elif not _dominates(defs[arg][0], pred):
+                    violations.append(f"{arg} does not dominate the end of {label}")
 
+    return violations
 
-def validate_ssa(cfg_nodes: List[Node]) -> bool:
+
+def validate_ssa(
+    blocks: List[Block], func_args: Optional[List[Argument]] = None
+) -> bool:
     """
     Validate that a CFG is in SSA form.
     """
-    return True
+    return len(find_ssa_violations(blocks, func_args)) == 0
+
+
+def _check_program(program: Program) -> bool:
+    """
+    Print the SSA violations of every function in program to stderr, return true if none.
+    """
+    ok = True
+    for fi, func in enumerate(program["functions"]):
+        blocks = to_cfg(func.get("instrs", []), fi)
+        if not blocks:
+            continue
+
+        for violation in find_ssa_violations(blocks, func.get("args", [])):
+            print(f"{func.get('name', f'f{fi}')}: {violation}", file=sys.stderr)
+            ok = False
+    return ok
 
 
 if __name__ == "__main__":
-    program, cli_flags = load(["-to", "-from", "-check", "-v"])
+    program, cli_flags = load(
+        ["-to", "-from", "-check", "-v", "-semi", "-pruned", "-stats"]
+    )
 
     if program is None:
         sys.exit(1)
 
-    if not cli_flags["to"] and not cli_flags["from"]:
-        print("Please specify either: \n  ... ssa.py -to \n  ... ssa.py -from")
+    if not cli_flags["to"] and not cli_flags["from"] and not cli_flags["check"]:
+        print(
+            "Please specify either: \n  ... ssa.py -to \n  ... ssa.py -from"
+            "\n  ... ssa.py -check"
+        )
         sys.exit(1)
 
     if cli_flags["to"]:
         for fi, func in enumerate(program["functions"]):
             blocks = to_cfg(func.get("instrs", []), fi)
-            entry_block = blocks[0]
+            if not blocks:
+                continue
+
             # get types of all variables in preparation for phi node construction
-            dest_to_types: Dict[str, Type] = {}
-            for block in blocks:
-                for instr in block.instrs:
-                    if "dest" in instr and "type" in instr:
-                        dest_to_types[instr["dest"]] = instr["type"]
+            dest_to_types = var_types(func)
+
+            pruning = "minimal"
+            if cli_flags["pruned"]:
+                pruning = "pruned"
+            elif cli_flags["semi"]:
+                pruning = "semi-pruned"
 
             # mutate func
-            func["instrs"] = to_ssa(entry_block, dest_to_types)
+            func["instrs"] = to_ssa(
+                blocks, dest_to_types, pruning, func.get("args", [])
+            )
+
+            if cli_flags["stats"]:
+                print(
+                    f"{func.get('name', f'f{fi}')}: {count_phis(func['instrs'])} phis",
+                    file=sys.stderr,
+                )
 
             if cli_flags["v"]:
                 print(visualize_block(blocks))
 
+        # validate the output of the conversion
+        if cli_flags["check"] and not _check_program(program):
+            sys.exit(1)
+
         if not cli_flags["v"]:
             print(json.dumps(program, indent=2, sort_keys=True))
 
     elif cli_flags["from"]:
-        if cli_flags["-check"]:
-            # Validate that the program is in SSA form
-            pass
-        pass
+        # validate that the input is in SSA form
+        if cli_flags["check"] and not _check_program(program):
+            sys.exit(1)
+
+        for fi, func in enumerate(program["functions"]):
+            blocks = to_cfg(func.get("instrs", []), fi)
+            if not blocks:
+                continue
+
+            func["instrs"] = from_ssa(blocks, func.get("args", []))
+
+        print(json.dumps(program, indent=2, sort_keys=True))
+
+    else:
+        # -check on its own passes a valid program through, to run between passes
+        if not _check_program(program):
+            sys.exit(1)
+
+        print(json.dumps(program, indent=2, sort_keys=True))
@@ -0,0 +1,92 @@
+"""
+Tail recursion to loop conversion.
+
+A self tail call is a call of the function itself that is immediately followed by a ret of its
+result (or by a plain ret, or the end of the function, for calls without a result). It is
+replaced by assigning the call's arguments to the function's parameters, as one parallel copy,
+and jumping back to a new label at the start of the function, so the recursion runs in a single
+frame.
+
+    bril2json < prog.bril | python3 tailrec.py | brili -p
+"""
+import json
+import sys
+from typing import List, Set
+
+from bril_type import *
+from ssa import sequentialize_copies
+from utils import fresh_name, load
+
+
+def _is_tail_call(func: Function, instrs: List[Instruction], i: int) -> bool:
+    call = instrs[i]
+    if call.get("op") != "call" or call.get("funcs") != [func["name"]]:
+        return False
+    if i + 1 == len(instrs):
+        return "dest" not in call  # falls off the end of the function
+    ret = instrs[i + 1]
+    if ret.get("op") != "ret":
+        return False
+    if "dest" in call:
+        return ret.get("args", []) == [call["dest"]]
+    return not ret.get("args")
+
+
+def eliminate_tail_calls(func: Function) -> int:
+    """
+    Mutates func to turn its self tail calls into jumps to its start. Returns the number of
+    calls replaced.
+    """
+    instrs = func.get("instrs", [])
+    if any(instr.get("op") == "phi" for instr in instrs):
+        return 0  # a new predecessor of the first block would need phi arguments
+
+    tail_calls = {i for i in range(len(instrs)) if _is_tail_call(func, instrs, i)}
+    if not tail_calls:
+        return 0
+
+    taken_labels = {instr["label"] for instr in instrs if "label" in instr}
+    taken_vars: Set[str] = {arg["name"] for arg in func.get("args", [])}
+    for instr in instrs:
+        taken_vars.update(instr.get("args", []))
+        if "dest" in instr:
+            taken_vars.add(instr["dest"])
+
+    start = fresh_name(f"{func['name']}.start", taken_labels)
+    params = func.get("args", [])
+
+    new_instrs: List[Instruction] = [{"label": start}]
+    skip = set()
+    for i, instr in enumerate(instrs):
+        if i in skip:
+            continue
+        if i not in tail_calls:
+            new_instrs.append(instr)
+            continue
+
+        # the arguments are all read before any parameter is assigned
+        copies = [
+            (param["name"], arg, param["type"])
+            for param, arg in zip(params, instr.get("args", []))
+        ]
+        new_instrs.extend(sequentialize_copies(copies, taken_vars))
+        new_instrs.append({"op": "jmp", "labels": [start]})
+        skip.add(i + 1)  # the ret
+
+    func["instrs"] = new_instrs
+    return len(tail_calls)
+
+
+if __name__ == "__main__":
+    program, cli_flags = load(["-stats"])
+
+    if program is None:
+        sys.exit(1)
+
+    for func in program["functions"]:
+        replaced = eliminate_tail_calls(func)
+
+        if cli_flags["stats"]:
+            print(f"{func['name']}: {replaced} tail calls replaced", file=sys.stderr)
+
+    print(json.dumps(program, indent=2, sort_keys=True))
@@ -0,0 +1,319 @@
+"""
+Loop unrolling of innermost loops.
+
+Loops are unrolled when their header ends with the loop's exit test, a br with one target inside
+the loop and one outside. The trip count, the number of times the test passes, is known when the
+test compares a basic induction variable (the only definition of it in the loop is an add or sub
+of a constant, in a block that runs on every iteration) to a constant, and the variable holds a
+constant on entry, using constant propagation. Copies of the loop body are chained one after
+the other, each jumping back to the header of the next, and the header of a copy that is known
+to pass the test jumps straight into the body instead of branching:
+- a loop whose trip count is known and whose copies fit in the budget is unrolled fully, the
+  last copy is just the header and leaves the loop
+- other loops with a known trip count are unrolled by the factor, the iterations that do not
+  fill a last group of copies are peeled off in front of the loop, so only the first copy of
+  each group keeps the test
+- loops with an unknown trip count are unrolled by the factor with the test kept in every copy,
+  each copy then falls through into the next instead of jumping back to the header, which does
+  not help a loop that is a single block
+The factor is lowered until the copies fit in the budget. Variables are shared between the
+copies, so the input must not be in SSA form. The compare and increment instructions left in the
+copies are cleaned up by lvn and tdce.
+
+    bril2json < prog.bril | python3 unroll.py -budget 64 -factor 4 | brili -p
+"""
+import copy
+import json
+import sys
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from block import Block, blocks_to_instrs
+from bril_type import *
+from cfg import fall_through, make_jumps_explicit, to_cfg, to_cfg_fine_grain
+from dfa import constant_propagation, constant_value
+from dominator import dominates, get_immediate_dominators_block
+from fold import is_int
+from indvars import COMPARISON_OPS, NEGATED_OPS, SWAPPED_OPS, trip_count
+from loops import Loop, get_loop_forest, invalidate_loop_forest
+from utils import fresh_name, load
+
+DEFAULT_BUDGET = 64  # most instructions unrolling a loop may add
+DEFAULT_FACTOR = 4  # copies of the body a loop is partially unrolled into
+
+
+def _exit_test(loop: Loop) -> Optional[Tuple[str, str]]:
+    """
+    Return the labels the header of loop branches to when it stays in the loop and when it
+    leaves it, if it ends with the exit test.
+    """
+    terminator = loop.header.instrs[-1]
+    if terminator.get("op") != "br":
+        return None
+    inside = [
+        label
+        for label in terminator["labels"]
+        if any(block.label == label for block in loop.body)
+    ]
+    if len(inside) != 1 or terminator["labels"][0] == terminator["labels"][1]:
+        return None
+    (stay,) = inside
+    (leave,) = [label for label in terminator["labels"] if label != stay]
+    return stay, leave
+
+
+def _known_trip_count(
+    blocks: List[Block],
+    loop: Loop,
+    in_facts: Dict[int, Dict],
+    out_facts: Dict[int, Dict],
+) -> Optional[int]:
+    """
+    Return the trip count of loop, if it can be told. in_facts and out_facts map the id of each
+    instruction to the constants before and after it.
+    """
+    header = loop.header
+    (latch,) = loop.latches
+    terminator = header.instrs[-1]
+    cond = terminator["args"][0]
+    compare: Optional[Instruction] = None
+    for instr in reversed(header.instrs[:-1]):
+        if instr.get("dest") == cond:
+            compare = instr
+            break
+    if compare is None or compare.get("op") not in COMPARISON_OPS:
+        return None
+    op = compare["op"]
+    if terminator["labels"][0] not in {block.label for block in loop.body}:
+        op = NEGATED_OPS[op]  # the loop is left when the comparison holds
+
+    # key: var, value: (block, instruction) of its definitions in the loop
+    loop_defs: Dict[str, List[Tuple[Block, Instruction]]] = {}
+    for block in loop.body:
+        for instr in block.instrs:
+            if "dest" in instr:
+                loop_defs.setdefault(instr["dest"], []).append((block, instr))
+
+    idom = get_immediate_dominators_block(blocks[0])
+    outside_preds = [pred for pred in header.predecessors if pred not in loop.body]
+    a, b = compare["args"]
+    for var, bound_var, var_op in ((a, b, op), (b, a, SWAPPED_OPS[op])):
+        if len(loop_defs.get(var, [])) != 1 or var == bound_var:
+            continue
+        ((block, update),) = loop_defs[var]
+        if update.get("op") not in {"add", "sub"} or not dominates(block, latch, idom):
+            continue
+        x, y = update["args"]
+        if update["op"] == "add" and y == var:
+            x, y = y, x
+        if x != var or y == var:
+            continue
+        step = constant_value(in_facts[id(update)], y)
+        bound = constant_value(in_facts[id(compare)], bound_var)
+        starts = {
+            constant_value(out_facts[id(pred.instrs[-1])], var)
+            for pred in outside_preds
+        }
+        if len(starts) != 1:
+            continue
+        (start,) = starts
+        if not all(is_int(value) for value in (step, bound, start)):  # type: ignore
+            continue
+        if update["op"] == "sub":
+            step = -step  # type: ignore
+        if block == header:
+            position = {id(instr): i for i, instr in enumerate(header.instrs)}
+            if position[id(update)] < position[id(compare)]:
+                start += step  # type: ignore  # the test sees the incremented value
+        return trip_count(var_op, start, bound, step)  # type: ignore
+    return None
+
+
+def _unroll_loop(
+    blocks: List[Block],
+    loop: Loop,
+    exit_test: Tuple[str, str],
+    modes: List[str],
+    back_to: int,
+    taken: Set[str],
+) -> List[Block]:
+    """
+    Replace loop with a chain of copies of its blocks, one per mode, and return the blocks of
+    the function. The header of a copy keeps the exit test ("test"), jumps to the label the test
+    stays in the loop with ("stay") or leaves it with ("leave", only the header is copied). The
+    latch of each copy jumps to the header of the next one, the last one to the header of copy
+    back_to. The first copy keeps the labels of the loop, so it is entered from outside.
+    """
+    header = loop.header
+    (latch,) = loop.latches
+    stay, leave = exit_test
+    # the latch is placed last, so it falls through into the header of the next copy
+    order = [header] + [
+        block
+        for block in blocks
+        if block in loop.body and block != header and block != latch
+    ]
+    if latch != header:
+        order.append(latch)
+
+    # key: label of a block of the loop, value: its label in each copy
+    labels: Dict[str, List[str]] = {
+        block.label: [block.label]
+        + [fresh_name(f"{block.label}.{c}", taken) for c in range(1, len(modes))]
+        for block in order
+    }
+
+    copies: List[Block] = []
+    for c, mode in enumerate(modes):
+        next_copy = c + 1 if c + 1 < len(modes) else back_to
+        for block in [header] if mode == "leave" else order:
+            instrs = copy.deepcopy(block.instrs)
+            instrs[0] = {"label": labels[block.label][c]}
+            if block == header and mode != "test":
+                instrs[-1] = {
+                    "op": "jmp",
+                    "labels": [stay if mode == "stay" else leave],
+                }
+            terminator = instrs[-1]
+            if terminator.get("op") in {"jmp", "br"}:
+                terminator["labels"] = [
+                    labels[label][next_copy]
+                    if label == header.label
+                    else labels[label][c]
+                    if label in labels
+                    else label
+                    for label in terminator["labels"]
+                ]
+            copies.append(
+                Block(
+                    id=f"{blocks[0].id.split('-')[0]}-{len(blocks) + len(copies)}",
+                    label=labels[block.label][c],
+                    predecessors=set(),
+                    successors=set(),
+                    instrs=instrs,
+                )
+            )
+
+    new_blocks: List[Block] = []
+    for block in blocks:
+        if block == header:
+            new_blocks.extend(copies)
+        elif block not in loop.body:
+            new_blocks.append(block)
+    return new_blocks
+
+
+def _size(blocks: Iterable[Block]) -> int:
+    return sum("label" not in instr for block in blocks for instr in block.instrs)
+
+
+def unroll(
+    func: Function, fi: int, budget: int = DEFAULT_BUDGET, factor: int = DEFAULT_FACTOR
+) -> Tuple[int, int]:
+    """
+    Mutates func to unroll its innermost loops, each adding at most budget instructions.
+    Returns the number of loops unrolled fully and partially.
+    """
+    if any(instr.get("op") == "phi" for instr in func.get("instrs", [])):
+        return 0, 0
+    func_name = func.get("name", f"f{fi}")
+    blocks = to_cfg(func.get("instrs", []), fi)
+    if not blocks:
+        return 0, 0
+
+    taken: Set[str] = set()  # labels
+    headers = [
+        loop.header.label
+        for loop in get_loop_forest(func_name, blocks).loops
+        if not loop.children and "label" in loop.header.instrs[0]
+    ]
+
+    full = partial = 0
+    # the CFG and the constants are recomputed after each loop that is unrolled, the headers of
+    # the loops keep their labels
+    for label in headers:
+        loop = next(
+            (
+                loop
+                for loop in get_loop_forest(func_name, blocks).loops
+                if loop.header.label == label
+            ),
+            None,
+        )
+        if loop is None or loop.children or len(loop.latches) != 1:
+            continue
+        exit_test = _exit_test(loop)
+        if exit_test is None:
+            continue
+
+        (root,) = to_cfg_fine_grain({"functions": [func]})
+        (dfa,) = constant_propagation([root])
+        in_facts = {
+            id(instr): dfa.in_sets[f"f0-{ii}"]
+            for ii, instr in enumerate(func["instrs"])
+        }
+        out_facts = {
+            id(instr): dfa.out_sets[f"f0-{ii}"]
+            for ii, instr in enumerate(func["instrs"])
+        }
+        trips = _known_trip_count(blocks, loop, in_facts, out_facts)
+
+        body_size = _size(loop.body)
+        modes: List[str] = []
+        back_to = 0
+        if (
+            trips is not None
+            and trips * body_size + _size([loop.header]) - body_size <= budget
+        ):
+            modes = ["stay"] * trips + ["leave"]
+            full += 1
+        else:
+            for copies in range(factor, 1, -1):
+                if trips is None:
+                    # a copy only saves the jump from its latch to the next header
+                    if (
+                        loop.header not in loop.latches
+                        and (copies - 1) * body_size <= budget
+                    ):
+                        modes = ["test"] * copies
+                        break
+                elif (
+                    trips >= copies
+                    and (trips % copies + copies - 1) * body_size <= budget
+                ):
+                    # the remaining iterations fill whole groups of copies
+                    back_to = trips % copies
+                    modes = ["stay"] * back_to + ["test"] + ["stay"] * (copies - 1)
+                    break
+            if not modes:
+                continue
+            partial += 1
+
+        make_jumps_explicit(blocks)
+        taken.update(block.label for block in blocks)
+        blocks = _unroll_loop(blocks, loop, exit_test, modes, back_to, taken)
+        func["instrs"] = blocks_to_instrs(fall_through(blocks))
+        invalidate_loop_forest(func_name)
+        blocks = to_cfg(func["instrs"], fi)
+
+    return full, partial
+
+
+if __name__ == "__main__":
+    program, cli_flags = load(
+        ["-stats"], {"-budget": DEFAULT_BUDGET, "-factor": DEFAULT_FACTOR}
+    )
+
+    if program is None:
+        sys.exit(1)
+
+    for fi, func in enumerate(program["functions"]):
+        full, partial = unroll(func, fi, cli_flags["budget"], cli_flags["factor"])
+
+        if cli_flags["stats"]:
+            print(
+                f"{func.get('name', f'f{fi}')}: {full} fully unrolled, "
+                f"{partial} partially unrolled",
+                file=sys.stderr,
+            )
+
+    print(json.dumps(program, indent=2, sort_keys=True))
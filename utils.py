@@ -3,17 +3,26 @@
 import argparse
 import json
 import sys
-from typing import Dict, List, Tuple
+from typing import Dict, List, Set, Tuple, TypeVar, Union
 
 from bril_type import *
 
 
-def load(cli_flags: List[str] = []) -> Tuple[Program, Dict[str, str]]:
-    """Load a .bril program from the command line or stdin, expecting the specified cli_flags"""
+T = TypeVar("T")
+
+
+def load(
+    cli_flags: List[str] = [], cli_options: Dict[str, T] = {}
+) -> Tuple[Program, Dict[str, Union[bool, T]]]:
+    """Load a .bril program from the command line or stdin, expecting the specified cli_flags
+    and cli_options (options take a value, e.g. -budget 40, their default sets the type)
+    """
 
     parser = argparse.ArgumentParser(exit_on_error=True)
     for cli_flag in cli_flags:
         parser.add_argument(cli_flag, action="store_true")
+    for cli_option, default in cli_options.items():
+        parser.add_argument(cli_option, type=type(default), default=default)
     args = parser.parse_args()
 
     try:
@@ -26,3 +35,16 @@ def load(cli_flags: List[str] = []) -> Tuple[Program, Dict[str, str]]:
 def flatten(blocks: list[list[Instruction]]):
     """Flatten a list of basic blocks into a single list of instructions."""
     return [instr for block in blocks for instr in block]
+
+
+def fresh_name(base: str, taken: Set[str]) -> str:
+    """
+    Return base, or base with the smallest numeric suffix, that is not in taken and reserve it.
+    """
+    name = base
+    suffix = 0
+    while name in taken:
+        name = f"{base}.{suffix}"
+        suffix += 1
+    taken.add(name)
+    return name